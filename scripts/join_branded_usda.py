@@ -1,14 +1,21 @@
 import pandas as pd
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "usdaEmbeddings"))
+from pipeline_metrics import open_metrics
+
+metrics = open_metrics("join_branded_usda")
 
 # Use a more efficient way of reading large CSV files
 chunk_size = 500000  # Adjust this size based on your system's capacity
-food_nutrient_chunks = pd.read_csv("/Users/seb/Documents/USDA_Data/branded/food_nutrient.csv", chunksize=chunk_size, low_memory=False)
+with metrics.timer("read_csv"):
+    food_nutrient_chunks = pd.read_csv("/Users/seb/Documents/USDA_Data/branded/food_nutrient.csv", chunksize=chunk_size, low_memory=False)
 
-# Process chunks and concatenate
-food_nutrient = pd.concat([chunk for chunk in food_nutrient_chunks])
+    # Process chunks and concatenate
+    food_nutrient = pd.concat([chunk for chunk in food_nutrient_chunks])
 
-# Read the 'food_shortened' CSV file
-food_shortened = pd.read_csv("/Users/seb/Documents/USDA_Data/branded/shortened_food.csv", low_memory=False)
+    # Read the 'food_shortened' CSV file
+    food_shortened = pd.read_csv("/Users/seb/Documents/USDA_Data/branded/shortened_food.csv", low_memory=False)
 
 # Mapping nutrient IDs to their names and required units
 nutrient_mapping = {
@@ -113,14 +120,22 @@ nutrient_mapping = {
 }
 
 # Optimize nutrient processing
-food_nutrient['nutrient_name'] = food_nutrient['nutrient_id'].map(lambda x: nutrient_mapping.get(x, (None, None))[0])
-food_nutrient = food_nutrient.dropna(subset=['nutrient_name'])
+with metrics.timer("map_nutrients"):
+    food_nutrient['nutrient_name'] = food_nutrient['nutrient_id'].map(lambda x: nutrient_mapping.get(x, (None, None))[0])
+    food_nutrient = food_nutrient.dropna(subset=['nutrient_name'])
 
 # Pivot the table more efficiently
-nutrients_pivot = food_nutrient.pivot_table(index='fdc_id', columns='nutrient_name', values='amount', aggfunc='sum', fill_value=0)
+with metrics.timer("pivot"):
+    nutrients_pivot = food_nutrient.pivot_table(index='fdc_id', columns='nutrient_name', values='amount', aggfunc='sum', fill_value=0)
 
 # Efficient join with food_shortened
-food_combined = food_shortened.merge(nutrients_pivot, left_on='fdc_id', right_index=True, how='left')
+with metrics.timer("join"):
+    food_combined = food_shortened.merge(nutrients_pivot, left_on='fdc_id', right_index=True, how='left')
 
 # Save to CSV
-food_combined.to_csv("/Users/seb/Documents/USDA_Data/branded/food_joined.csv", index=False)
+with metrics.timer("write_csv"):
+    food_combined.to_csv("/Users/seb/Documents/USDA_Data/branded/food_joined.csv", index=False)
+metrics.count("rows_written", len(food_combined))
+
+metrics.close()
+print(metrics.summary())
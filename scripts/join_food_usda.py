@@ -1,10 +1,17 @@
 import pandas as pd
 import json
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "usdaEmbeddings"))
+from pipeline_metrics import open_metrics
+
+metrics = open_metrics("join_food_usda")
 
 # Load CSV files
-food_nutrient = pd.read_csv("/Users/seb/Documents/USDA_Data/legacy/food_nutrient.csv", low_memory=False)
-food_portion = pd.read_csv("/Users/seb/Documents/USDA_Data/legacy/food_portion.csv")
-food_shortened = pd.read_csv("/Users/seb/Documents/USDA_Data/legacy/food_shortened.csv")
+with metrics.timer("read_csv"):
+    food_nutrient = pd.read_csv("/Users/seb/Documents/USDA_Data/legacy/food_nutrient.csv", low_memory=False)
+    food_portion = pd.read_csv("/Users/seb/Documents/USDA_Data/legacy/food_portion.csv")
+    food_shortened = pd.read_csv("/Users/seb/Documents/USDA_Data/legacy/food_shortened.csv")
 
 # Parse the 'old_fdc_ids' column in 'food_shortened'
 food_shortened['old_fdc_ids'] = food_shortened['old_fdc_ids'].apply(json.loads)
@@ -111,20 +118,29 @@ nutrient_mapping = {
     1058: ("Theobromine", "MG")
 }
 # Map nutrient IDs to names
-food_nutrient['nutrient_name'] = food_nutrient['nutrient_id'].map(nutrient_mapping).apply(lambda x: x[0] if pd.notnull(x) else None)
-food_nutrient = food_nutrient[food_nutrient['nutrient_name'].notnull()]
+with metrics.timer("map_nutrients"):
+    food_nutrient['nutrient_name'] = food_nutrient['nutrient_id'].map(nutrient_mapping).apply(lambda x: x[0] if pd.notnull(x) else None)
+    food_nutrient = food_nutrient[food_nutrient['nutrient_name'].notnull()]
 
 # Pivot the table to get nutrients as columns
-nutrients_pivot = food_nutrient.pivot_table(index='fdc_id', columns='nutrient_name', values='amount', aggfunc='sum')
+with metrics.timer("pivot"):
+    nutrients_pivot = food_nutrient.pivot_table(index='fdc_id', columns='nutrient_name', values='amount', aggfunc='sum')
 
 # Join nutrient data with food_shortened
-food_combined = food_shortened.join(nutrients_pivot, on='fdc_id')
+with metrics.timer("join"):
+    food_combined = food_shortened.join(nutrients_pivot, on='fdc_id')
 
 # Process and join portion data
-food_portion['portion_data'] = food_portion.apply(lambda row: json.dumps({'seq_num': row['seq_num'], 'amount': row['amount'], 'measure_unit_id': row['measure_unit_id'], 'portion_description': row['portion_description'], 'modifier': row['modifier'], 'gram_weight': row['gram_weight']}), axis=1)
-portion_json = food_portion.groupby('fdc_id')['portion_data'].apply(list).reset_index()
-food_combined = food_combined.merge(portion_json, on='fdc_id', how='left')
+with metrics.timer("join_portions"):
+    food_portion['portion_data'] = food_portion.apply(lambda row: json.dumps({'seq_num': row['seq_num'], 'amount': row['amount'], 'measure_unit_id': row['measure_unit_id'], 'portion_description': row['portion_description'], 'modifier': row['modifier'], 'gram_weight': row['gram_weight']}), axis=1)
+    portion_json = food_portion.groupby('fdc_id')['portion_data'].apply(list).reset_index()
+    food_combined = food_combined.merge(portion_json, on='fdc_id', how='left')
 
 
 # Save to CSV
-food_combined.to_csv("/Users/seb/Documents/USDA_Data/legacy/food_joined.csv", index=False)
\ No newline at end of file
+with metrics.timer("write_csv"):
+    food_combined.to_csv("/Users/seb/Documents/USDA_Data/legacy/food_joined.csv", index=False)
+metrics.count("rows_written", len(food_combined))
+
+metrics.close()
+print(metrics.summary())
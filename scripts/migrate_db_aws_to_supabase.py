@@ -5,6 +5,9 @@ import concurrent.futures
 import signal
 from urllib.parse import urlparse, urlunparse
 from tqdm import tqdm  # Import tqdm for the progress bar
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "usdaEmbeddings"))
+from pipeline_metrics import open_metrics
 
 def calculate_total_rows(source_db_url):
     """
@@ -47,11 +50,14 @@ NUM_WORKERS = 5  # Adjust based on your system's capabilities
 # Setting up a global variable for graceful shutdown
 shutdown_flag = False
 
+# Shared by the fetch loop and the insert threads; Metrics is thread-safe
+metrics = open_metrics("migrate_db_aws_to_supabase")
+
 def fetch_data(fdc_id, batch_size):
     """
     Fetches a batch of data from the source database.
     """
-    with psycopg2.connect(source_db_url) as conn:
+    with metrics.timer("fetch"), psycopg2.connect(source_db_url) as conn:
         with conn.cursor() as cursor:
             cursor.execute(
                 'SELECT * FROM public."UsdaFoodItemEmbedding" WHERE "fdcId" > %s ORDER BY "fdcId" ASC LIMIT %s', 
@@ -66,7 +72,7 @@ def insert_data(rows):
     """
     rows_inserted = 0
     if rows:
-        with psycopg2.connect(dest_db_url) as conn:
+        with metrics.timer("write", rows=len(rows)), psycopg2.connect(dest_db_url) as conn:
             with conn.cursor() as cursor:
                 for row in rows:
                     cursor.execute('''
@@ -78,6 +84,7 @@ def insert_data(rows):
                 # Check the number of rows successfully inserted
                 rows_inserted = cursor.rowcount
                 conn.commit()
+        metrics.count("rows_inserted", rows_inserted)
     return rows_inserted
 
 def signal_handler(signum, frame):
@@ -92,49 +99,54 @@ def main():
     # Register the signal handler for Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
 
-    with psycopg2.connect(dest_db_url) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute('SELECT MAX("fdcId") FROM public."UsdaFoodItemEmbedding"')
-            max_fdc_id = cursor.fetchone()[0] or 0
-        total_rows = calculate_total_rows(source_db_url)
-    initial_progress = calculate_initial_progress(dest_db_url)
-
-    # Create a tqdm progress bar
-    progress_bar = tqdm(total=total_rows, initial=initial_progress, desc="Migrating Rows", unit="row")
-
-    # Use ThreadPoolExecutor for parallel execution
-    with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
-        future_to_batch = {}
-
-        while True:
-            if shutdown_flag and not future_to_batch:
-                break  # Exit the loop if shutdown is flagged and no futures are pending
-
-            if not shutdown_flag:
-                rows = fetch_data(max_fdc_id, BATCH_SIZE)
-                if not rows:
-                    break  # Exit if no more rows to migrate
-
-                # Submit the insert task to the executor
-                future = executor.submit(insert_data, rows)
-                future_to_batch[future] = rows
-
-                # Update max_fdc_id for the next batch
-                max_fdc_id = rows[-1][1]
-
-            # Check for completion of any futures
-            done, _ = concurrent.futures.wait(
-                future_to_batch, timeout=0, return_when=concurrent.futures.FIRST_COMPLETED
-            )
-
-            for future in done:
-                inserted_rows = future.result()
-                progress_bar.update(inserted_rows)  # Update progress bar based on actual inserted rows
-                print(f"Batch inserted: {inserted_rows} rows")  # Feedback about the batch
-                del future_to_batch[future]
-
-        progress_bar.close()
-        print("Migration completed.")
+    # Flush the metrics textfile and event log even when the migration fails
+    try:
+        with psycopg2.connect(dest_db_url) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT MAX("fdcId") FROM public."UsdaFoodItemEmbedding"')
+                max_fdc_id = cursor.fetchone()[0] or 0
+            total_rows = calculate_total_rows(source_db_url)
+        initial_progress = calculate_initial_progress(dest_db_url)
+
+        # Create a tqdm progress bar
+        progress_bar = tqdm(total=total_rows, initial=initial_progress, desc="Migrating Rows", unit="row")
+
+        # Use ThreadPoolExecutor for parallel execution
+        with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
+            future_to_batch = {}
+
+            while True:
+                if shutdown_flag and not future_to_batch:
+                    break  # Exit the loop if shutdown is flagged and no futures are pending
+
+                if not shutdown_flag:
+                    rows = fetch_data(max_fdc_id, BATCH_SIZE)
+                    if not rows:
+                        break  # Exit if no more rows to migrate
+
+                    # Submit the insert task to the executor
+                    future = executor.submit(insert_data, rows)
+                    future_to_batch[future] = rows
+
+                    # Update max_fdc_id for the next batch
+                    max_fdc_id = rows[-1][1]
+
+                # Check for completion of any futures
+                done, _ = concurrent.futures.wait(
+                    future_to_batch, timeout=0, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    inserted_rows = future.result()
+                    progress_bar.update(inserted_rows)  # Update progress bar based on actual inserted rows
+                    print(f"Batch inserted: {inserted_rows} rows")  # Feedback about the batch
+                    del future_to_batch[future]
+
+            progress_bar.close()
+            print("Migration completed.")
+    finally:
+        metrics.close()
+        print(metrics.summary())
 
 if __name__ == "__main__":
     main()
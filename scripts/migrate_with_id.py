@@ -4,9 +4,14 @@ from dotenv import load_dotenv
 import os
 from urllib.parse import urlparse, urlunparse
 from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "usdaEmbeddings"))
+from pipeline_metrics import open_metrics
 
 BATCH_SIZE = 200  # Adjust as needed
 
+metrics = open_metrics("migrate_with_id")
+
 def clean_database_url(db_url):
     parsed_url = urlparse(db_url)
     return urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, None, None, None))
@@ -24,9 +29,10 @@ async def find_missing_ids(conn, table_name):
     )
 
 async def fetch_rows_by_ids(conn, table_name, ids):
-    return await conn.fetch(
-        f'SELECT * FROM {table_name} WHERE id = ANY($1::int[])', ids
-    )
+    with metrics.timer("fetch", rows=len(ids)):
+        return await conn.fetch(
+            f'SELECT * FROM {table_name} WHERE id = ANY($1::int[])', ids
+        )
 
 async def insert_batch(conn, table_name, rows):
     # Prepare the statement for deleting conflicting rows
@@ -41,18 +47,21 @@ async def insert_batch(conn, table_name, rows):
 
     for row in rows:
         # Check if a row with the same fdcId exists in the target database
-        existing_row = await conn.fetchrow(
-            f'SELECT 1 FROM {table_name} WHERE "fdcId" = $1', row['fdcId']
-        )
+        with metrics.timer("exists_check"):
+            existing_row = await conn.fetchrow(
+                f'SELECT 1 FROM {table_name} WHERE "fdcId" = $1', row['fdcId']
+            )
 
         # If a conflict is found, delete the existing row
         if existing_row:
             await conn.execute(delete_statement, row['fdcId'])
 
         # Insert the new row
-        await conn.execute(insert_statement, 
-                        row['id'], row['fdcId'], row['foodName'], row['foodBrand'], 
-                        row['brandOwner'], row['bgeLargeEmbedding'], row['bgeBaseEmbedding'])
+        with metrics.timer("write"):
+            await conn.execute(insert_statement, 
+                            row['id'], row['fdcId'], row['foodName'], row['foodBrand'], 
+                            row['brandOwner'], row['bgeLargeEmbedding'], row['bgeBaseEmbedding'])
+        metrics.count("rows_migrated")
 
 async def main():
     load_dotenv('.env.prod')
@@ -97,6 +106,8 @@ async def main():
             progress_bar.update(len(rows))
 
     progress_bar.close()
+    metrics.close()
+    print(metrics.summary())
     await source_conn.close()
     await dest_conn.close()
 
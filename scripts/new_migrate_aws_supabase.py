@@ -5,9 +5,14 @@ from dotenv import load_dotenv
 import os
 from urllib.parse import urlparse, urlunparse
 from tqdm import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "usdaEmbeddings"))
+from pipeline_metrics import open_metrics
 
 BATCH_SIZE = 250
 
+metrics = open_metrics("new_migrate_aws_supabase")
+
 def clean_database_url(db_url):
     """ 
     Removes query parameters from the database URL to make it compatible with psycopg2.
@@ -35,28 +40,31 @@ async def fetch_next_batch(conn, table_name, fdc_id, batch_size=BATCH_SIZE):
     """
     Asynchronously fetches the next batch of data from the database.
     """
-    return await conn.fetch(
-        f'SELECT * FROM {table_name} WHERE "fdcId" > $1 ORDER BY "fdcId" ASC LIMIT $2',
-        fdc_id, batch_size
-    )
+    with metrics.timer("fetch"):
+        return await conn.fetch(
+            f'SELECT * FROM {table_name} WHERE "fdcId" > $1 ORDER BY "fdcId" ASC LIMIT $2',
+            fdc_id, batch_size
+        )
 
 async def insert_batch(conn, table_name, rows):
     """
     Asynchronously inserts a batch of rows into the target database.
     """
-    await conn.executemany(f'''
-        INSERT INTO {table_name} (
-            id, "fdcId", "foodName", "foodBrand", "brandOwner", "bgeLargeEmbedding", "bgeBaseEmbedding"
-        ) VALUES ($1, $2, $3, $4, $5, $6, $7)
-        ON CONFLICT (id) DO UPDATE SET
-            "fdcId" = EXCLUDED."fdcId",
-            "foodName" = EXCLUDED."foodName",
-            "foodBrand" = EXCLUDED."foodBrand",
-            "brandOwner" = EXCLUDED."brandOwner",
-            "bgeLargeEmbedding" = EXCLUDED."bgeLargeEmbedding",
-            "bgeBaseEmbedding" = EXCLUDED."bgeBaseEmbedding"
-        WHERE {table_name}."fdcId" != EXCLUDED."fdcId";
-    ''', rows)
+    with metrics.timer("write", rows=len(rows)):
+        await conn.executemany(f'''
+            INSERT INTO {table_name} (
+                id, "fdcId", "foodName", "foodBrand", "brandOwner", "bgeLargeEmbedding", "bgeBaseEmbedding"
+            ) VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (id) DO UPDATE SET
+                "fdcId" = EXCLUDED."fdcId",
+                "foodName" = EXCLUDED."foodName",
+                "foodBrand" = EXCLUDED."foodBrand",
+                "brandOwner" = EXCLUDED."brandOwner",
+                "bgeLargeEmbedding" = EXCLUDED."bgeLargeEmbedding",
+                "bgeBaseEmbedding" = EXCLUDED."bgeBaseEmbedding"
+            WHERE {table_name}."fdcId" != EXCLUDED."fdcId";
+        ''', rows)
+    metrics.count("rows_migrated", len(rows))
 
 async def main():
     load_dotenv('.env.prod')
@@ -85,6 +93,8 @@ async def main():
 
     await fetch_task  # Ensure the last fetch task is completed
     progress_bar.close()
+    metrics.close()
+    print(metrics.summary())
     await source_conn.close()
     await dest_conn.close()
 
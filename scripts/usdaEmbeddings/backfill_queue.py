@@ -0,0 +1,89 @@
+# backfill_queue.py
+
+import json
+import os
+
+ITEM_COLUMNS = 'id, "fdcId", "foodName", "foodBrand", "brandOwner"'
+
+
+def missing_flag(column):
+    """Name of the boolean field iter_missing_embeddings adds to each row for `column`."""
+    return f"missing_{column}"
+
+def _missing_condition(columns):
+    if isinstance(columns, str):
+        columns = [columns]
+    return "(" + " OR ".join(f'"{column}" IS NULL' for column in columns) + ")"
+
+
+def read_checkpoint(path):
+    """Returns the last row id whose embedding is known to be written, or 0 for a fresh run."""
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, 'r') as file:
+        return json.load(file)["lastId"]
+
+def write_checkpoint(path, last_id):
+    # Write to a temp file and rename over the old checkpoint so a crash mid-write
+    # never leaves a truncated file behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({"lastId": last_id}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+def clear_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+async def count_missing_embeddings(conn, columns, after_id=0):
+    return await conn.fetchval(
+        f'SELECT COUNT(*) FROM "UsdaFoodItemEmbedding" WHERE id > $1 AND {_missing_condition(columns)}',
+        after_id
+    )
+
+async def iter_missing_embeddings(conn, columns, batch_size, after_id=0, before_id=None):
+    """
+    Yields batches of rows where any of `columns` (one column name or a list) is NULL,
+    in id order, paging with a keyset (`id > last id seen`) instead of re-sorting the
+    remaining rows on every fetch.
+    Every fetch is a short range scan on the primary key (or the partial index on
+    missing embeddings), so its cost stays flat no matter how far the backfill is.
+    Rows already handed out are never returned again, even before they are written.
+    `before_id` optionally bounds the scan to ids below it. Each row carries a
+    missing_flag(column) field per column telling whether that one still needs filling.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    flags = "".join(f', "{column}" IS NULL AS "{missing_flag(column)}"' for column in columns)
+    upper_bound = "AND id < $3" if before_id is not None else ""
+    query = f"""
+        SELECT {ITEM_COLUMNS}{flags}
+        FROM "UsdaFoodItemEmbedding"
+        WHERE id > $1 {upper_bound} AND {_missing_condition(columns)}
+        ORDER BY id
+        LIMIT $2
+    """
+    bounds = [before_id] if before_id is not None else []
+    last_id = after_id
+    while True:
+        items = await conn.fetch(query, last_id, batch_size, *bounds)
+        if not items:
+            return
+        last_id = items[-1]['id']
+        yield items
+
+# First key of the two-key advisory locks that claim id chunks; the second key is the chunk number
+CHUNK_LOCK_NAMESPACE = 0x55534441  # "USDA"
+
+async def try_claim_chunk(conn, chunk):
+    """
+    Claims id chunk `chunk` with a session-level advisory lock. Locks live on the server,
+    so workers on any number of hosts can share one table without stepping on each other.
+    """
+    return await conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", CHUNK_LOCK_NAMESPACE, chunk)
+
+async def release_chunk(conn, chunk):
+    await conn.fetchval("SELECT pg_advisory_unlock($1, $2)", CHUNK_LOCK_NAMESPACE, chunk)
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import bisect
+import json
+import time
+import zlib
+import asyncpg
+import numpy as np
+import buildEmbeddings
+from backfill_queue import iter_missing_embeddings, missing_flag
+from bulk_writer import ensure_staging_table
+from embedding_pipeline import run_pipeline, run_sequential
+from encode_scheduler import TokenBudgetScheduler
+from pgvector_codec import register_vector_codec
+
+# Offline throughput benchmark for the embedding backfill. It runs the real backfill
+# code (keyset reader, encode_targets, the COPY and per-row writers, sequential or
+# pipelined) over a synthetic "UsdaFoodItemEmbedding" table, either held by an
+# in-process fake of the connection or created in a scratch Postgres schema, with a
+# stub or small real encoder. Each combination of batch size, pipeline mode and write
+# strategy reports rows/s, encode and write time and p50/p99 batch latency.
+
+BENCH_SCHEMA = "backfill_bench"
+
+SAMPLE_WORDS = ["Milk", "Whole", "Chicken", "Breast", "Roasted", "Greek", "Yogurt", "Plain", "Nonfat", "Peanut",
+                "Butter", "Cups", "Brown", "Rice", "Cooked", "Banana", "Raw", "Cheddar", "Cheese", "Shredded",
+                "Organic", "Low", "Sodium", "Vanilla", "Chocolate", "Frozen", "Pizza", "Sliced", "Turkey"]
+SAMPLE_BRANDS = ["Great Value", "Kirkland Signature", "Trader Joe's", "Chobani", "Kraft", "Nestle", "Tyson"]
+
+
+def synthetic_rows(count, duplicate_rate=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for row_id in range(1, count + 1):
+        if rows and rng.random() < duplicate_rate:
+            # Same name/brand/owner under a newer fdcId, like USDA re-publications
+            previous = rows[int(rng.integers(len(rows)))]
+            name, brand, owner = previous["foodName"], previous["foodBrand"], previous["brandOwner"]
+        else:
+            name = " ".join(rng.choice(SAMPLE_WORDS, size=int(rng.integers(1, 9))))
+            brand = str(rng.choice(SAMPLE_BRANDS)) if rng.random() < 0.7 else None
+            owner = f"{brand} Inc." if brand else None
+        rows.append({"id": row_id, "fdcId": 100000 + row_id, "foodName": name, "foodBrand": brand, "brandOwner": owner})
+    return rows
+
+
+class StubTokenizer:
+    def __call__(self, sentences, truncation=True, max_length=512, **kwargs):
+        return {"input_ids": [[0] * min(len(sentence.split()) + 2, max_length) for sentence in sentences]}
+
+
+class StubEncoder:
+    """
+    Stands in for a transformer: deterministic unit vectors per sentence, and a blocking
+    delay proportional to the padded tokens of each mini-batch, which is what dominates
+    real encoder cost.
+    """
+
+    variant = "stub"
+
+    def __init__(self, dim=768, seconds_per_token=2e-6):
+        self.dim = dim
+        self.seconds_per_token = seconds_per_token
+        self.tokenizer = StubTokenizer()
+
+    def encode(self, sentences, batch_size=256, max_length=512):
+        lengths = [len(ids) for ids in self.tokenizer(sentences, max_length=max_length)["input_ids"]]
+        padded_tokens = sum(len(lengths[i:i + batch_size]) * max(lengths[i:i + batch_size])
+                            for i in range(0, len(lengths), batch_size))
+        time.sleep(padded_tokens * self.seconds_per_token)
+
+        embeddings = np.empty((len(sentences), self.dim), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            embeddings[i] = np.random.default_rng(zlib.crc32(sentence.encode())).standard_normal(self.dim)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+async def batch_update_db_prepared(conn, column, items_with_embeddings):
+    """
+    The backfill's original writer, kept as the "row" baseline: one UPDATE per item,
+    matched on name, brand and owner, in one transaction.
+    """
+    async with conn.transaction():
+        for item, embedding in items_with_embeddings:
+            # The embedding goes over the wire in binary through the registered vector codec
+            parameters = [embedding, item['foodName']]
+
+            food_brand = item.get('foodBrand')
+            brand_owner = item.get('brandOwner')
+
+            # Modify the SQL statement based on the available parameters
+            if food_brand:
+                brand_condition = f"\"foodBrand\" = ${len(parameters) + 1}"
+                parameters.append(food_brand)
+            else:
+                brand_condition = "(\"foodBrand\" IS NULL OR \"foodBrand\" = '')"
+
+            if brand_owner:
+                owner_condition = f"\"brandOwner\" = ${len(parameters) + 1}"
+                parameters.append(brand_owner)
+            else:
+                owner_condition = "(\"brandOwner\" IS NULL OR \"brandOwner\" = '')"
+
+            await conn.execute(f"""
+                UPDATE "UsdaFoodItemEmbedding"
+                SET "{column}" = $1
+                WHERE "foodName" = $2
+                AND ({brand_condition})
+                AND ({owner_condition});
+            """, *parameters)
+
+
+class FakeTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        await self.conn.round_trip()
+
+    async def __aexit__(self, *exc_info):
+        await self.conn.round_trip()
+
+
+class FakeConnection:
+    """
+    In-process stand-in for the asyncpg connection the backfill reads and writes through.
+    Rows live in memory and every call costs one network round trip plus a per-row
+    cost, which is enough to compare per-row writes with COPY and to see whether
+    encoding and DB I/O overlap.
+    """
+
+    def __init__(self, rows, round_trip_ms=1.0, row_cost_us=5.0):
+        self.rows = rows
+        self.ids = [row["id"] for row in rows]
+        self.round_trip_seconds = round_trip_ms / 1000
+        self.row_cost_seconds = row_cost_us / 1e6
+        self.embedded_ids = set()
+        self.staged = []
+
+    async def round_trip(self, rows=0):
+        await asyncio.sleep(self.round_trip_seconds + rows * self.row_cost_seconds)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    async def fetch(self, query, last_id, limit, *bounds):
+        # The keyset query from backfill_queue: id > $1 [AND id < $3], missing embedding, LIMIT $2
+        before_id = bounds[0] if bounds else None
+        flag = missing_flag(buildEmbeddings.columnNameEmbedding)
+        items = []
+        for row in self.rows[bisect.bisect_right(self.ids, last_id):]:
+            if len(items) == limit or (before_id is not None and row["id"] >= before_id):
+                break
+            if row["id"] not in self.embedded_ids:
+                items.append({**row, flag: True})
+        await self.round_trip(len(items))
+        return items
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        self.staged = list(records)
+        await self.round_trip(len(self.staged))
+
+    async def execute(self, query, *args):
+        if "FROM embedding_staging" in query:
+            updated = len(self.staged)
+            self.embedded_ids.update(record[0] for record in self.staged)
+            self.staged = []
+            await self.round_trip(updated)
+            return f"UPDATE {updated}"
+        # One per-row UPDATE from batch_update_db_prepared
+        await self.round_trip(1)
+        return "UPDATE 1"
+
+
+async def setup_postgres(dsn, rows):
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f'CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}')
+        await conn.execute(f'DROP TABLE IF EXISTS {BENCH_SCHEMA}."UsdaFoodItemEmbedding"')
+        await conn.execute(f'''
+            CREATE TABLE {BENCH_SCHEMA}."UsdaFoodItemEmbedding" (
+                id integer PRIMARY KEY,
+                "fdcId" integer NOT NULL UNIQUE,
+                "foodName" text NOT NULL,
+                "foodBrand" text,
+                "brandOwner" text,
+                "bgeLargeEmbedding" public.vector(1024),
+                "bgeBaseEmbedding" public.vector(768)
+            )
+        ''')
+        await conn.execute(f'''
+            CREATE INDEX ON {BENCH_SCHEMA}."UsdaFoodItemEmbedding" (id) WHERE "bgeBaseEmbedding" IS NULL
+        ''')
+        columns = ["id", "fdcId", "foodName", "foodBrand", "brandOwner"]
+        await conn.copy_records_to_table("UsdaFoodItemEmbedding", schema_name=BENCH_SCHEMA, columns=columns,
+                                         records=[tuple(row[column] for column in columns) for row in rows])
+    finally:
+        await conn.close()
+
+async def connect_postgres(dsn):
+    # The backfill's SQL names "UsdaFoodItemEmbedding" unqualified, so resolve it to the bench schema
+    return await asyncpg.connect(dsn, server_settings={"search_path": f"{BENCH_SCHEMA}, public"})
+
+async def run_once(make_connections, encoder, batch_size, mode, writer):
+    read_conn, write_conn = await make_connections()
+    model = TokenBudgetScheduler(encoder)
+    column = buildEmbeddings.columnNameEmbedding
+    target = buildEmbeddings.EmbeddingTarget(column, model, model)
+    read_times = {}
+    batch_latencies = []
+    encode_time = 0.0
+    write_time = 0.0
+
+    async def timed_batches():
+        async for items in iter_missing_embeddings(read_conn, column, batch_size):
+            read_times[items[0]["id"]] = time.perf_counter()
+            yield items
+
+    def encode_batch(items):
+        nonlocal encode_time
+        start_time = time.perf_counter()
+        encoded = buildEmbeddings.encode_targets([target], items)
+        encode_time += time.perf_counter() - start_time
+        return encoded
+
+    async def write_batch(items, encoded):
+        nonlocal write_time
+        start_time = time.perf_counter()
+        if writer == "copy":
+            await buildEmbeddings.batch_update_db_copy(write_conn, items, encoded)
+        else:
+            await batch_update_db_prepared(write_conn, column, encoded[column])
+        write_time += time.perf_counter() - start_time
+        batch_latencies.append(time.perf_counter() - read_times.pop(items[0]["id"]))
+
+    run = run_pipeline if mode == "pipelined" else run_sequential
+    start_time = time.perf_counter()
+    rows = await run(timed_batches(), encode_batch, write_batch)
+    elapsed = time.perf_counter() - start_time
+
+    for conn in (read_conn, write_conn):
+        if isinstance(conn, asyncpg.Connection):
+            await conn.close()
+
+    return {
+        "batch_size": batch_size,
+        "mode": mode,
+        "writer": writer,
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed else 0.0,
+        "encode_seconds": encode_time,
+        "write_seconds": write_time,
+        "p50_batch_ms": float(np.percentile(batch_latencies, 50) * 1000) if batch_latencies else 0.0,
+        "p99_batch_ms": float(np.percentile(batch_latencies, 99) * 1000) if batch_latencies else 0.0,
+        "padding_ratio": model.stats.padding_ratio,
+    }
+
+def load_bench_encoder(name):
+    if name == "stub":
+        return StubEncoder()
+    # Anything else is a Hugging Face model name for the configured real backend
+    from encoders import get_encoder
+    return get_encoder(name)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding backfill on a synthetic table.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-sizes", default="64,256,1024")
+    parser.add_argument("--modes", default="sequential,pipelined")
+    parser.add_argument("--writers", default="row,copy")
+    parser.add_argument("--encoder", default="stub", help='"stub" or a Hugging Face model name, e.g. a small bge.')
+    parser.add_argument("--dsn", help=f"Scratch Postgres with pgvector; the table is created in schema {BENCH_SCHEMA}. "
+                                      "Uses the in-process fake when omitted.")
+    parser.add_argument("--round-trip-ms", type=float, default=1.0, help="Fake DB latency per call.")
+    parser.add_argument("--row-cost-us", type=float, default=5.0, help="Fake DB cost per row sent or received.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows)
+    encoder = load_bench_encoder(args.encoder)
+    if args.dsn:
+        await setup_postgres(args.dsn, rows)
+
+    async def make_connections():
+        if not args.dsn:
+            fake = FakeConnection(rows, args.round_trip_ms, args.row_cost_us)
+            return fake, fake
+        reset_conn = await connect_postgres(args.dsn)
+        await reset_conn.execute(f'UPDATE "UsdaFoodItemEmbedding" SET "{buildEmbeddings.columnNameEmbedding}" = NULL')
+        await reset_conn.close()
+        read_conn = await connect_postgres(args.dsn)
+        write_conn = await connect_postgres(args.dsn)
+        await register_vector_codec(write_conn)
+        await ensure_staging_table(write_conn, [buildEmbeddings.columnNameEmbedding])
+        return read_conn, write_conn
+
+    results = []
+    print(f"{args.rows} rows, encoder {args.encoder}, {'postgres' if args.dsn else 'fake DB'}")
+    print(f"{'batch':>6} {'mode':>10} {'writer':>6} {'rows/s':>10} {'encode s':>9} {'write s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for batch_size in map(int, args.batch_sizes.split(",")):
+        for mode in args.modes.split(","):
+            for writer in args.writers.split(","):
+                result = await run_once(make_connections, encoder, batch_size, mode, writer)
+                results.append(result)
+                print(f"{batch_size:>6} {mode:>10} {writer:>6} {result['rows_per_sec']:>10.1f} "
+                      f"{result['encode_seconds']:>9.2f} {result['write_seconds']:>9.2f} "
+                      f"{result['p50_batch_ms']:>9.1f} {result['p99_batch_ms']:>9.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import argparse
+import sys
+import time
+import numpy as np
+from encoders import OnnxEncoder, TorchEncoder
+
+# Checks that the ONNX Runtime backends agree with PyTorch (cosine similarity of the
+# embeddings each produces for the same sentences) and compares CPU throughput. Exits
+# non-zero when a backend's worst-case agreement falls below its threshold.
+
+# Minimum cosine similarity to the PyTorch embedding of every sentence
+MIN_COSINE = {"onnx": 0.999, "onnx-int8": 0.98}
+
+SAMPLE_NAMES = ["Milk", "Whole Milk, 3.25% Milkfat", "Chicken Breast, Roasted", "Greek Yogurt, Plain, Nonfat",
+                "Peanut Butter Cups", "Brown Rice, Cooked", "Banana, Raw", "Cheddar Cheese, Shredded"]
+SAMPLE_BRANDS = ["", "Great Value - Walmart Inc.", "Kirkland Signature - Costco Companies Inc.",
+                 "Trader Joe's - Trader Joe's Company", "Chobani - Chobani Llc"]
+
+
+def sample_sentences(count, seed=0):
+    rng = np.random.default_rng(seed)
+    sentences = []
+    for _ in range(count):
+        name = rng.choice(SAMPLE_NAMES)
+        brand = rng.choice(SAMPLE_BRANDS)
+        sentences.append(f"{name} - {brand}" if brand else name)
+    return sentences
+
+def load_sentences(path, count):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip()][:count]
+
+def throughput(encoder, sentences, batch_size):
+    encoder.encode(sentences[:batch_size], batch_size=batch_size)  # warm up
+    start_time = time.time()
+    embeddings = encoder.encode(sentences, batch_size=batch_size)
+    return embeddings, len(sentences) / (time.time() - start_time)
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and CPU throughput of the encoder backends.")
+    parser.add_argument("--model", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--sentences", type=int, default=1024)
+    parser.add_argument("--input", help="File with one sentence per line; synthetic food names otherwise.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.input, args.sentences) if args.input else sample_sentences(args.sentences)
+    encoders = {
+        "torch": TorchEncoder(args.model),
+        "onnx": OnnxEncoder(args.model),
+        "onnx-int8": OnnxEncoder(args.model, quantize=True),
+    }
+
+    reference, torch_rate = throughput(encoders["torch"], sentences, args.batch_size)
+    print(f"{len(sentences)} sentences, {args.model}")
+    print(f"{'backend':12}{'sentences/s':>14}{'speedup':>10}{'min cos':>10}{'mean cos':>10}")
+    print(f"{'torch':12}{torch_rate:14.1f}{1.0:9.2f}x{1.0:10.4f}{1.0:10.4f}")
+    failed = []
+    for name in ("onnx", "onnx-int8"):
+        embeddings, rate = throughput(encoders[name], sentences, args.batch_size)
+        # Embeddings are normalized, so the row-wise dot product is the cosine similarity
+        agreement = np.sum(reference * embeddings, axis=1)
+        print(f"{name:12}{rate:14.1f}{rate / torch_rate:9.2f}x{agreement.min():10.4f}{agreement.mean():10.4f}")
+        if agreement.min() < MIN_COSINE[name]:
+            failed.append(f"{name} min cosine {agreement.min():.4f} < {MIN_COSINE[name]}")
+
+    if failed:
+        sys.exit("Parity check failed: " + "; ".join(failed))
+
+if __name__ == "__main__":
+    main()
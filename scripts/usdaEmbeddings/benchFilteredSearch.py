@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import os
+import time
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+from dotenv import load_dotenv
+from exact_search import recall_at_k
+from filtered_search import FOOD_KINDS, search_kinds, search_sql
+from pgvector_codec import register_vector_codec
+from pipeline_metrics import percentile
+
+# Latency/recall report for kind-filtered vector search against the live database.
+# Query vectors are sampled from "foodEmbeddingCache"; the ground truth for each query
+# and kind is an exact scan (index scans disabled), and each ef_search setting reports
+# p50/p95 latency, recall@k and how often a search came back with fewer than k rows.
+
+# Load environment variables
+load_dotenv(dotenv_path=".env.prod")
+DATABASE_URL = os.getenv("SUPABASE_PG_URI")
+
+# What each report row searches: None is the unfiltered full index, a tuple of kinds
+# is merged from those kinds' partial indexes
+SEARCH_MODES = {"all": None, **{kind: (kind,) for kind in FOOD_KINDS}, "merged": FOOD_KINDS}
+
+
+async def sample_queries(conn, count):
+    rows = await conn.fetch(
+        'SELECT "bgeBaseEmbedding" FROM "foodEmbeddingCache" WHERE "bgeBaseEmbedding" IS NOT NULL '
+        'ORDER BY random() LIMIT $1', count
+    )
+    return [row["bgeBaseEmbedding"] for row in rows]
+
+async def exact_top_k(conn, embedding, k, kind=None):
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_indexscan = off")
+        rows = await conn.fetch(search_sql(kind), embedding, k)
+    return [row["fdcId"] for row in rows]
+
+async def main():
+    parser = argparse.ArgumentParser(description="Report latency and recall of kind-filtered vector search.")
+    parser.add_argument("--dsn", default=DATABASE_URL, help="Postgres to query (default: SUPABASE_PG_URI).")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--ef-search", default="20,40,80,160", help="Comma-separated hnsw.ef_search values.")
+    args = parser.parse_args()
+
+    parsed_url = urlparse(args.dsn)
+    sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+    conn = await asyncpg.connect(sanitized_url)
+    await register_vector_codec(conn)
+
+    try:
+        queries = await sample_queries(conn, args.queries)
+        print(f"Computing exact top-{args.k} for {len(queries)} queries...")
+        truth = {None: [await exact_top_k(conn, embedding, args.k) for embedding in queries]}
+        for kind in FOOD_KINDS:
+            truth[kind] = [await exact_top_k(conn, embedding, args.k, kind) for embedding in queries]
+
+        print(f"{'mode':>8} {'ef':>5} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7} {'short':>6}")
+        for ef_search in (int(value) for value in args.ef_search.split(",")):
+            for mode, kinds in SEARCH_MODES.items():
+                # Merging both kinds is exact-equivalent to the unfiltered search
+                expected = truth[kinds[0] if kinds and len(kinds) == 1 else None]
+                latencies = []
+                found = []
+                for embedding in queries:
+                    start_time = time.perf_counter()
+                    rows = await search_kinds(conn, embedding, args.k, kinds, ef_search)
+                    latencies.append(time.perf_counter() - start_time)
+                    found.append([row["fdcId"] for row in rows])
+                short = sum(len(ids) < min(args.k, len(true_ids)) for ids, true_ids in zip(found, expected))
+                print(f"{mode:>8} {ef_search:>5} {percentile(latencies, 50) * 1000:>8.2f} "
+                      f"{percentile(latencies, 95) * 1000:>8.2f} {recall_at_k(found, expected, args.k):>7.3f} "
+                      f"{short / max(len(queries), 1):>6.1%}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+from dotenv import load_dotenv
+from benchFilteredSearch import exact_top_k, sample_queries
+from exact_search import recall_at_k
+from filtered_search import search_kinds
+from pgvector_codec import register_vector_codec
+from pipeline_metrics import percentile
+from quantized_search import QUANTIZATIONS, quantized_search
+
+# Compares the float32 HNSW index with the quantized first-pass indexes (halfvec,
+# binary) plus full-precision rescoring: index size, build time (with --rebuild),
+# p50/p95 latency and recall@k against an exact scan, for query vectors sampled from
+# "foodEmbeddingCache". --rebuild never touches the indexes search uses: it builds a
+# copy of each under BENCH_SUFFIX, measures that, and drops it again.
+
+# Load environment variables
+load_dotenv(dotenv_path=".env.prod")
+DATABASE_URL = os.getenv("SUPABASE_PG_URI")
+
+FLOAT32_INDEX = {
+    "index": "UsdaFoodItemEmbedding_bgeBaseEmbedding_idx",
+    "create": """CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_idx" ON public."UsdaFoodItemEmbedding" USING hnsw ("bgeBaseEmbedding" vector_ip_ops) WITH (m='16', ef_construction='128')""",
+}
+INDEXES = {"float32": FLOAT32_INDEX, **QUANTIZATIONS}
+BENCH_SUFFIX = "_bench"
+
+
+def bench_copy(definition):
+    name = definition["index"] + BENCH_SUFFIX
+    return {"index": name, "create": definition["create"].replace(f'"{definition["index"]}"', f'"{name}"')}
+
+async def drop_index(conn, definition):
+    await conn.execute(f'DROP INDEX IF EXISTS public."{definition["index"]}"')
+
+async def build_index(conn, definition):
+    await drop_index(conn, definition)
+    start_time = time.perf_counter()
+    await conn.execute(definition["create"])
+    return time.perf_counter() - start_time
+
+async def index_size(conn, definition):
+    return await conn.fetchval("SELECT pg_relation_size(to_regclass($1))", f'public."{definition["index"]}"')
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized first-pass indexes against float32.")
+    parser.add_argument("--dsn", help="Postgres to query (default: SUPABASE_PG_URI; required with --rebuild).")
+    parser.add_argument("--modes", default="float32,halfvec,binary")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--rescore-candidates", default="40,100,200",
+                        help="Comma-separated first-pass candidate counts for the quantized modes.")
+    parser.add_argument("--ef-search", type=int, help="hnsw.ef_search for every mode (at least the candidates).")
+    parser.add_argument("--rebuild", action="store_true",
+                        help=f"Time each index's build on a {BENCH_SUFFIX} copy, dropped afterwards.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+    if args.rebuild and not args.dsn:
+        parser.error("--rebuild builds indexes on the target database; pass --dsn explicitly")
+
+    parsed_url = urlparse(args.dsn or DATABASE_URL)
+    sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+    conn = await asyncpg.connect(sanitized_url)
+    await register_vector_codec(conn)
+
+    results = []
+    modes = args.modes.split(",")
+    # With --rebuild, sizes are the freshly built copies'; the planner may serve
+    # queries from either twin, which have the same definition
+    measured = {mode: bench_copy(INDEXES[mode]) if args.rebuild else INDEXES[mode] for mode in modes}
+    try:
+        build_seconds = {}
+        for mode in modes:
+            if args.rebuild:
+                print(f"Building a copy of the {mode} index...")
+                build_seconds[mode] = await build_index(conn, measured[mode])
+
+        queries = await sample_queries(conn, args.queries)
+        print(f"Computing exact top-{args.k} for {len(queries)} queries...")
+        truth = [await exact_top_k(conn, embedding, args.k) for embedding in queries]
+
+        print(f"{'mode':>8} {'cands':>6} {'index MB':>9} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+        for mode in modes:
+            size = await index_size(conn, measured[mode])
+            for candidates in ([None] if mode == "float32" else map(int, args.rescore_candidates.split(","))):
+                latencies = []
+                found = []
+                for embedding in queries:
+                    start_time = time.perf_counter()
+                    if mode == "float32":
+                        rows = await search_kinds(conn, embedding, args.k, ef_search=args.ef_search)
+                    else:
+                        rows = await quantized_search(conn, embedding, args.k, mode, candidates, args.ef_search)
+                    latencies.append(time.perf_counter() - start_time)
+                    found.append([row["fdcId"] for row in rows])
+                result = {
+                    "mode": mode,
+                    "candidates": candidates,
+                    "index_bytes": size,
+                    "build_seconds": build_seconds.get(mode),
+                    "p50_ms": percentile(latencies, 50) * 1000,
+                    "p95_ms": percentile(latencies, 95) * 1000,
+                    "recall": recall_at_k(found, truth, args.k),
+                }
+                results.append(result)
+                build = f"{result['build_seconds']:.1f}" if result["build_seconds"] is not None else "-"
+                print(f"{mode:>8} {candidates or '-':>6} {(size or 0) / 2**20:>9.1f} {build:>8} "
+                      f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['recall']:>7.3f}")
+    finally:
+        if args.rebuild:
+            for definition in measured.values():
+                await drop_index(conn, definition)
+        await conn.close()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
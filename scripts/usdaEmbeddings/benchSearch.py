@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from urllib.parse import urlparse, urlunparse
+import numpy as np
+from benchBackfill import SAMPLE_WORDS, load_bench_encoder, synthetic_rows
+from embedding_store import EmbeddingStore
+from exact_search import ExactIndex, exact_index_path, recall_at_k
+from local_index import LocalAnnIndex, local_index_path
+from pipeline_metrics import open_metrics, percentile
+from rerank import GteReranker
+from search_service import construct_sentence_results
+
+# Reproducible search latency/recall benchmark. A fixed query set is embedded once per
+# query, answered by each engine (the exact brute-force matrix, the local HNSW graph,
+# pgvector when --dsn is given) and optionally reranked with GTE; every stage's
+# p50/p95/p99 latency and each engine's recall@k against the exact top-k are reported.
+# Runs fully offline on a synthetic catalog (stub encoder by default) or on indexes
+# exported with buildLocalIndex.py.
+
+
+
+def synthetic_queries(count, seed=1):
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(SAMPLE_WORDS, size=int(rng.integers(1, 5)))) for _ in range(count)]
+
+def read_queries(path):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+def build_synthetic_indexes(directory, rows, encoder, dim, with_hnsw):
+    """Embeds the synthetic catalog and writes an exact index, and an HNSW one if asked."""
+    items = synthetic_rows(rows)
+    embeddings = encoder.encode([construct_sentence_results(item) for item in items])
+    exact = ExactIndex(os.path.join(directory, "exact"), dim=dim, dtype="float16", writable=True)
+    exact.add(items, embeddings)
+    exact.close()
+    if with_hnsw:
+        hnsw = LocalAnnIndex(os.path.join(directory, "hnsw"), dim=dim, writable=True)
+        hnsw.add(items, embeddings)
+        hnsw.save()
+        hnsw.close()
+
+def usearch_available():
+    try:
+        import usearch  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+async def open_pgvector_engine(dsn, ef_search):
+    import asyncpg
+    from filtered_search import search_kinds
+    from pgvector_codec import register_vector_codec
+
+    parsed_url = urlparse(dsn)
+    sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+    conn = await asyncpg.connect(sanitized_url)
+    await register_vector_codec(conn)
+
+    async def search(embedding, k):
+        return [dict(row) for row in await search_kinds(conn, embedding, k, ef_search=ef_search)]
+    return search, conn
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark search latency per stage and recall@k per engine.")
+    parser.add_argument("--synthetic", type=int, metavar="ROWS",
+                        help="Build a synthetic catalog of ROWS foods instead of using exported indexes.")
+    parser.add_argument("--column", default="bgeBaseEmbedding", help="Exported indexes to use without --synthetic.")
+    parser.add_argument("--queries", help="File with one query per line (default: synthetic queries).")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--encoder", default="stub", help='"stub" or a Hugging Face model name for query embeddings.')
+    parser.add_argument("--engines", default="exact,hnsw", help="Comma-separated: exact, hnsw, pgvector.")
+    parser.add_argument("--dsn", help="Postgres holding the same rows, for the pgvector engine.")
+    parser.add_argument("--ef-search", type=int, help="hnsw.ef_search for the pgvector engine.")
+    parser.add_argument("--rerank", help='Also rerank each engine\'s results with this GTE model ("stub" works offline).')
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=5, help="Queries run per engine before timing.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    if "hnsw" in engines and not usearch_available():
+        print("usearch is not installed; skipping the hnsw engine")
+        engines.remove("hnsw")
+    if "pgvector" in engines and not args.dsn:
+        parser.error("the pgvector engine needs --dsn")
+
+    encoder = load_bench_encoder(args.encoder)
+    scratch = tempfile.mkdtemp(prefix="bench_search_")
+    metrics = open_metrics("benchSearch")
+    cleanups = []
+    conn = None
+    try:
+        if args.synthetic:
+            dim = len(encoder.encode(["probe"])[0])
+            print(f"Building a synthetic catalog of {args.synthetic} foods...")
+            build_synthetic_indexes(scratch, args.synthetic, encoder, dim, "hnsw" in engines)
+            exact_dir, hnsw_dir = os.path.join(scratch, "exact"), os.path.join(scratch, "hnsw")
+        else:
+            exact_dir, hnsw_dir = exact_index_path(args.column), local_index_path(args.column)
+        exact = ExactIndex(exact_dir)
+        cleanups.append(exact.close)
+
+        searchers = {}
+        if "exact" in engines:
+            searchers["exact"] = lambda embedding, k: exact.search([embedding], k)[0]
+        if "hnsw" in engines:
+            hnsw = LocalAnnIndex(hnsw_dir)
+            cleanups.append(hnsw.close)
+            searchers["hnsw"] = lambda embedding, k: hnsw.search([embedding], k)[0]
+        if "pgvector" in engines:
+            pg_search, conn = await open_pgvector_engine(args.dsn, args.ef_search)
+            searchers["pgvector"] = pg_search
+
+        reranker = None
+        if args.rerank:
+            rerank_model = load_bench_encoder(args.rerank)
+            rerank_dim = len(rerank_model.encode(["probe"])[0])
+            store = EmbeddingStore(os.path.join(scratch, "gte_store"), args.rerank, rerank_dim,
+                           rerank_model.variant)
+            reranker = GteReranker(rerank_model, store, construct_sentence_results)
+
+        queries = read_queries(args.queries) if args.queries else synthetic_queries(args.num_queries)
+        embeddings = []
+        for query in queries:
+            start_time = time.perf_counter()
+            embeddings.append(encoder.encode([query])[0])
+            metrics.observe("embed", time.perf_counter() - start_time)
+        labels, _ = exact.top_k(np.asarray(embeddings), args.k)
+        truth = [[exact.items.row(int(label))["fdcId"] for label in row] for row in labels]
+        print(f"{len(exact)} foods, {len(queries)} queries, k={args.k}, encoder {args.encoder}")
+
+        recalls = {}
+        for engine, search in searchers.items():
+            for embedding in embeddings[:args.warmup]:
+                result = search(embedding, args.k)
+                if asyncio.iscoroutine(result):
+                    await result
+            found = []
+            for query, embedding in zip(queries, embeddings):
+                start_time = time.perf_counter()
+                foods = search(embedding, args.k)
+                if asyncio.iscoroutine(foods):
+                    foods = await foods
+                metrics.observe(f"{engine}.retrieve", time.perf_counter() - start_time)
+                found.append([food["fdcId"] for food in foods])
+                if reranker:
+                    candidates = [{**food, "cosine_similarity": food.get("similarity", food.get("cosine_similarity"))}
+                                  for food in foods]
+                    start_time = time.perf_counter()
+                    reranker.rerank(query, candidates)
+                    metrics.observe(f"{engine}.rerank", time.perf_counter() - start_time)
+            recalls[engine] = recall_at_k(found, truth, args.k)
+
+        # The query embedding is shared by every engine, so it is one row
+        rows = [("-", "embed", "embed")]
+        rows += [(engine, stage, f"{engine}.{stage}") for engine in searchers for stage in ("retrieve", "rerank")]
+        results = []
+        print(f"{'engine':>10} {'stage':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {f'recall@{args.k}':>10}")
+        for engine, stage, name in rows:
+            histogram = metrics.histograms.get(name)
+            if not histogram:
+                continue
+            result = {"engine": engine, "stage": stage}
+            for q in (50, 95, 99):
+                result[f"p{q}_ms"] = percentile(histogram.samples, q) * 1000
+            if stage == "retrieve":
+                result["recall"] = recalls[engine]
+            results.append(result)
+            recall = f"{result['recall']:.3f}" if "recall" in result else ""
+            print(f"{engine:>10} {stage:>9} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                  f"{result['p99_ms']:>9.2f} {recall:>10}")
+
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump(results, file, indent=2)
+    finally:
+        if conn is not None:
+            await conn.close()
+        for cleanup in cleanups:
+            cleanup()
+        metrics.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import argparse
+import timeit
+import numpy as np
+from pgvector_codec import encode_vector, decode_vector
+
+# Micro-benchmark of the per-row cost of moving one embedding through asyncpg:
+# the old text path ('[0.0123,...]' built with map(str, ...) and parsed back from
+# "bgeBaseEmbedding"::text) versus the binary codec in pgvector_codec.
+
+
+def vector_to_sql(value):
+    return '[' + ','.join(map(str, value)) + ']'
+
+def sql_to_vector(text):
+    return np.array(text[1:-1].split(','), dtype=np.float32)
+
+def time_per_row(fn, number):
+    # Best of 5 repeats, in microseconds per call
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare text and binary pgvector encoding cost per row.")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--rows", type=int, default=2000, help="Rows per timing repeat.")
+    args = parser.parse_args()
+
+    embedding = np.random.default_rng(0).standard_normal(args.dimensions).astype(np.float32)
+    text = vector_to_sql(embedding.tolist())
+    binary = encode_vector(embedding)
+    assert np.allclose(sql_to_vector(text), decode_vector(binary))
+
+    results = {
+        "encode": (time_per_row(lambda: vector_to_sql(embedding.tolist()), args.rows),
+                   time_per_row(lambda: encode_vector(embedding), args.rows)),
+        "decode": (time_per_row(lambda: sql_to_vector(text), args.rows),
+                   time_per_row(lambda: decode_vector(binary), args.rows)),
+    }
+
+    print(f"{args.dimensions}-d vector, payload: text {len(text)} bytes, binary {len(binary)} bytes")
+    print(f"{'':8}{'text (us/row)':>16}{'binary (us/row)':>18}{'speedup':>10}")
+    for name, (text_us, binary_us) in results.items():
+        print(f"{name:8}{text_us:16.2f}{binary_us:18.2f}{text_us / binary_us:9.1f}x")
+
+if __name__ == "__main__":
+    main()
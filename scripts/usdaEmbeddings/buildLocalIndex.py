@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import os
+import shutil
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+import tqdm
+from dotenv import load_dotenv
+from exact_search import MATRIX_DTYPES, exact_index_path, open_exact_index
+from local_index import VECTOR_DTYPES, local_index_path, open_local_index
+from pgvector_codec import register_vector_codec
+
+# Exports one embedding column of "UsdaFoodItemEmbedding", with fdcId, name, brand and
+# owner, into a local memory-mapped index that searchServer.py --local-index and batch
+# matching jobs search in-process: the HNSW graph (--kind hnsw) or the exact
+# brute-force matrix (--kind exact). Rows whose fdcId is already in the index
+# are skipped, so re-running it only adds what is new; the USDA sync scripts also add
+# the rows they insert once an index exists.
+
+# Load environment variables
+load_dotenv(dotenv_path=".env.prod")
+DATABASE_URL = os.getenv("SUPABASE_PG_URI")
+
+
+async def iter_embedded_rows(conn, column, batch_size):
+    query = f"""
+        SELECT id, "fdcId", "foodName", "foodBrand", "brandOwner", "{column}" AS embedding
+        FROM "UsdaFoodItemEmbedding"
+        WHERE id > $1 AND "{column}" IS NOT NULL
+        ORDER BY id
+        LIMIT $2
+    """
+    last_id = 0
+    while True:
+        rows = await conn.fetch(query, last_id, batch_size)
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield rows
+
+async def main():
+    parser = argparse.ArgumentParser(description="Export an embedding column into a local HNSW index.")
+    parser.add_argument("--column", default="bgeBaseEmbedding")
+    parser.add_argument("--kind", default="hnsw", choices=["hnsw", "exact"])
+    parser.add_argument("--dtype", choices=VECTOR_DTYPES + MATRIX_DTYPES,
+                        help="Scalar type of the stored vectors (default f16 for hnsw, float16 for exact).")
+    parser.add_argument("--connectivity", type=int, default=16, help="HNSW M: graph edges per node.")
+    parser.add_argument("--expansion-add", type=int, default=128, help="HNSW ef_construction.")
+    parser.add_argument("--expansion-search", type=int, default=64, help="HNSW ef_search.")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--rebuild", action="store_true", help="Delete the existing index and export from scratch.")
+    args = parser.parse_args()
+
+    directory = local_index_path(args.column) if args.kind == "hnsw" else exact_index_path(args.column)
+    if args.rebuild and os.path.exists(directory):
+        shutil.rmtree(directory)
+
+    parsed_url = urlparse(DATABASE_URL)
+    sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+    conn = await asyncpg.connect(sanitized_url)
+    await register_vector_codec(conn)
+
+    index = None
+    added = 0
+    try:
+        total = await conn.fetchval(f'SELECT COUNT(*) FROM "UsdaFoodItemEmbedding" WHERE "{args.column}" IS NOT NULL')
+        pbar = tqdm.tqdm(total=total, desc=f"Indexing {args.column}")
+        async for rows in iter_embedded_rows(conn, args.column, args.batch_size):
+            if index is None:
+                # The dimension comes from the data, so any embedding column works
+                dim = len(rows[0]['embedding'])
+                if args.kind == "hnsw":
+                    index = open_local_index(args.column, dim=dim, dtype=args.dtype or "f16",
+                                             connectivity=args.connectivity, expansion_add=args.expansion_add,
+                                             expansion_search=args.expansion_search, writable=True)
+                else:
+                    index = open_exact_index(args.column, dim=dim, dtype=args.dtype or "float16", writable=True)
+            added += index.add([dict(row) for row in rows], [row['embedding'] for row in rows])
+            pbar.update(len(rows))
+        pbar.close()
+
+        if index is None:
+            print(f"No rows with {args.column}; nothing to index.")
+            return
+        index.save()
+        print(f"Added {added} rows; {len(index)} in the index at {directory}")
+    finally:
+        if index is not None:
+            index.close()
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
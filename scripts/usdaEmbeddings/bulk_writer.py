@@ -0,0 +1,50 @@
+# bulk_writer.py
+
+STAGING_TABLE = "embedding_staging"
+
+
+def _as_columns(columns):
+    return [columns] if isinstance(columns, str) else list(columns)
+
+async def ensure_staging_table(conn, columns):
+    """
+    Creates the session-local staging table used by copy_update_embeddings, with one
+    vector column per target embedding column. Call it once per connection, after
+    pgvector_codec.register_vector_codec since COPY sends vectors in binary; ON COMMIT
+    DELETE ROWS empties the table after every batch.
+    """
+    vector_columns = ",\n".join(f'"{column}" vector' for column in _as_columns(columns))
+    await conn.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+            id integer NOT NULL,
+            {vector_columns}
+        ) ON COMMIT DELETE ROWS
+    """)
+
+async def copy_update_embeddings(conn, columns, records, table='"UsdaFoodItemEmbedding"'):
+    """
+    Writes a whole batch of (id, embedding, ...) records in one round trip: the records
+    are streamed with COPY into a temp staging table and applied with a single
+    UPDATE ... FROM join on the primary key. `columns` is one embedding column or a
+    list of them, in record order; a None embedding leaves that column as it is.
+    `conn` must have been set up with ensure_staging_table for the same columns.
+
+    Returns the number of rows updated.
+    """
+    columns = _as_columns(columns)
+    records = list(records)
+    if not records:
+        return 0
+
+    assignments = ", ".join(f'"{column}" = COALESCE(s."{column}", t."{column}")' for column in columns)
+    async with conn.transaction():
+        await conn.copy_records_to_table(STAGING_TABLE, records=records, columns=["id", *columns])
+        status = await conn.execute(f"""
+            UPDATE {table} AS t
+            SET {assignments}
+            FROM {STAGING_TABLE} AS s
+            WHERE t.id = s.id
+        """)
+
+    # status is "UPDATE <count>"
+    return int(status.split()[-1])
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+import tqdm
+import buildEmbeddings
+from backfill_queue import count_missing_embeddings, iter_missing_embeddings, release_chunk, try_claim_chunk
+from bulk_writer import ensure_staging_table
+from embedding_pipeline import run_pipeline
+from encode_scheduler import EncodeStats
+from pgvector_codec import register_vector_codec
+from pipeline_metrics import open_metrics
+
+# Launches N embedding backfill workers. The id space is cut into fixed-size chunks and
+# each worker claims a chunk at a time with an advisory lock, so any number of workers,
+# on this host or others, can share one table safely. Each worker has its own model
+# instance per target column and its own torch thread budget, and reports per-batch
+# progress back to the launcher.
+
+
+def sanitize_url(url):
+    parsed_url = urlparse(url)
+    return urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+
+async def run_worker(targets, worker_index, num_workers, chunk_size, batch_size, queue_size, progress):
+    columns = [target.column for target in targets]
+    sanitized_url = sanitize_url(buildEmbeddings.DATABASE_URL)
+    read_conn = await asyncpg.connect(sanitized_url)
+    write_conn = await asyncpg.connect(sanitized_url)
+    await register_vector_codec(write_conn)
+    await ensure_staging_table(write_conn, columns)
+    metrics = open_metrics(f"embeddingWorkers_{worker_index}")
+
+    def encode_batch(items):
+        start_time = time.time()
+        encoded = buildEmbeddings.encode_targets(targets, items, metrics)
+        return encoded, time.time() - start_time
+
+    async def write_batch(items, encoded_with_time):
+        encoded, encode_time = encoded_with_time
+        start_time = time.time()
+        with metrics.timer("write", rows=len(items)):
+            await buildEmbeddings.batch_update_db_copy(write_conn, items, encoded)
+        metrics.count("rows_written", len(items))
+        progress.put(("batch", worker_index, len(items), encode_time, time.time() - start_time))
+
+    try:
+        max_id = await read_conn.fetchval('SELECT MAX(id) FROM "UsdaFoodItemEmbedding"') or 0
+        num_chunks = max_id // chunk_size + 1
+        # Start each worker on its own slice of the table so workers rarely race for the same chunk
+        first_chunk = worker_index * num_chunks // num_workers
+
+        for offset in range(num_chunks):
+            chunk = (first_chunk + offset) % num_chunks
+            if not await try_claim_chunk(read_conn, chunk):
+                continue  # Another worker has it
+            try:
+                await run_pipeline(
+                    metrics.timed_iter("fetch", iter_missing_embeddings(read_conn, columns, batch_size,
+                                                                        after_id=chunk * chunk_size - 1,
+                                                                        before_id=(chunk + 1) * chunk_size)),
+                    encode_batch,
+                    write_batch,
+                    queue_size=queue_size,
+                )
+            finally:
+                await release_chunk(read_conn, chunk)
+    finally:
+        metrics.close()
+        await read_conn.close()
+        await write_conn.close()
+
+def worker_main(worker_index, num_workers, columns, threads, chunk_size, batch_size, queue_size, progress):
+    import torch
+    torch.set_num_threads(threads)
+    targets = buildEmbeddings.load_targets(columns)
+    try:
+        asyncio.run(run_worker(targets, worker_index, num_workers, chunk_size, batch_size, queue_size, progress))
+    except Exception as e:
+        progress.put(("error", worker_index, repr(e)))
+        raise
+    progress.put(("done", worker_index, {target.column: target.scheduler.stats.as_dict() for target in targets}))
+
+async def count_remaining(columns):
+    conn = await asyncpg.connect(sanitize_url(buildEmbeddings.DATABASE_URL))
+    try:
+        return await count_missing_embeddings(conn, columns)
+    finally:
+        await conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the embedding backfill across several worker processes.")
+    parser.add_argument("--columns", default=buildEmbeddings.columnNameEmbedding,
+                        help="Comma-separated embedding columns to fill in one pass.")
+    parser.add_argument("--threads-per-worker", type=int, default=4, help="Torch intra-op threads for each worker.")
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to CPU count / threads per worker.")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Row ids per claimed chunk.")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--queue-size", type=int, default=4)
+    args = parser.parse_args()
+    columns = args.columns.split(",")
+    unknown = [column for column in columns if column not in buildEmbeddings.EMBEDDING_COLUMNS]
+    if unknown:
+        parser.error(f"Unknown embedding columns: {', '.join(unknown)}")
+
+    num_workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads_per_worker)
+    print(f"Starting {num_workers} workers with {args.threads_per_worker} threads each")
+
+    # Spawn rather than fork: torch and asyncpg state must not be shared with children
+    context = multiprocessing.get_context("spawn")
+    progress = context.Queue()
+    workers = [
+        context.Process(target=worker_main, args=(i, num_workers, columns, args.threads_per_worker, args.chunk_size,
+                                                  args.batch_size, args.queue_size, progress))
+        for i in range(num_workers)
+    ]
+
+    pbar = tqdm.tqdm(total=asyncio.run(count_remaining(columns)), desc="Processing rows", position=0, leave=True)
+    rows_per_worker = [0] * num_workers
+    encode_time_per_worker = [0.0] * num_workers
+    write_time_per_worker = [0.0] * num_workers
+    batches_per_worker = [0] * num_workers
+    encode_stats_per_worker = [{column: EncodeStats() for column in columns} for _ in range(num_workers)]
+    running = set(range(num_workers))
+    start_time = time.time()
+    for worker in workers:
+        worker.start()
+
+    while running:
+        try:
+            message = progress.get(timeout=1)
+        except queue.Empty:
+            # A worker killed before it could report (OOM, signal) must not hang the launcher
+            running = {i for i in running if workers[i].is_alive()}
+            continue
+
+        kind, worker_index = message[0], message[1]
+        if kind == "batch":
+            rows, encode_time, write_time = message[2:]
+            rows_per_worker[worker_index] += rows
+            encode_time_per_worker[worker_index] += encode_time
+            write_time_per_worker[worker_index] += write_time
+            batches_per_worker[worker_index] += 1
+            pbar.update(rows)
+            pbar.set_postfix(rows_per_sec=f"{sum(rows_per_worker) / (time.time() - start_time):.1f}", refresh=False)
+        elif kind == "error":
+            print(f"\nWorker {worker_index} failed: {message[2]}")
+            running.discard(worker_index)
+        elif kind == "done":
+            encode_stats_per_worker[worker_index] = {column: EncodeStats.from_dict(stats)
+                                                     for column, stats in message[2].items()}
+            running.discard(worker_index)
+
+    for worker in workers:
+        worker.join()
+    pbar.close()
+
+    elapsed = time.time() - start_time
+    total_rows = sum(rows_per_worker)
+    print(f"\nProcessed {total_rows} rows in {elapsed:.1f}s ({total_rows / elapsed:.1f} rows/s)")
+    for i in range(num_workers):
+        batches = batches_per_worker[i] or 1
+        print(f"  worker {i}: {rows_per_worker[i]} rows, {rows_per_worker[i] / elapsed:.1f} rows/s, "
+              f"avg encode {encode_time_per_worker[i] / batches:.2f}s, avg write {write_time_per_worker[i] / batches:.2f}s per batch")
+        for column, stats in encode_stats_per_worker[i].items():
+            print(f"    {column}: {stats.sentences_per_sec:.1f} sentences/s, {stats.tokens_per_sec:.0f} tokens/s, "
+                  f"{stats.padding_ratio:.1%} padding")
+
+if __name__ == "__main__":
+    main()
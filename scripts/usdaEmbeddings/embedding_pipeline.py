@@ -0,0 +1,82 @@
+# embedding_pipeline.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Marks the end of the stream on a stage queue
+_DONE = object()
+
+
+async def run_pipeline(batches, encode_batch, write_batch, queue_size=4, executor=None):
+    """
+    Runs read -> encode -> write as three concurrent stages joined by bounded queues.
+
+    `batches` is an async iterable of row batches. `encode_batch(batch)` is a blocking
+    call and runs in `executor` so inference never stalls the event loop, and
+    `write_batch(batch, encoded)` is awaited in the same order the batches were read.
+    A full queue blocks the stage feeding it, so no stage gets more than `queue_size`
+    batches ahead of the next one and the pipeline runs at the speed of its slowest stage.
+
+    Returns the number of rows written.
+    """
+    loop = asyncio.get_running_loop()
+    to_encode = asyncio.Queue(maxsize=queue_size)
+    to_write = asyncio.Queue(maxsize=queue_size)
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+
+    async def reader():
+        async for batch in batches:
+            if batch:
+                await to_encode.put(batch)
+        await to_encode.put(_DONE)
+
+    async def encoder():
+        while True:
+            batch = await to_encode.get()
+            if batch is _DONE:
+                break
+            encoded = await loop.run_in_executor(executor, encode_batch, batch)
+            await to_write.put((batch, encoded))
+        await to_write.put(_DONE)
+
+    async def writer():
+        rows_written = 0
+        while True:
+            item = await to_write.get()
+            if item is _DONE:
+                return rows_written
+            batch, encoded = item
+            await write_batch(batch, encoded)
+            rows_written += len(batch)
+
+    stages = [asyncio.create_task(reader()), asyncio.create_task(encoder()), asyncio.create_task(writer())]
+    try:
+        await asyncio.gather(*stages)
+    except BaseException:
+        # One stage failed: stop the others instead of leaving them blocked on a queue
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        raise
+    finally:
+        if owns_executor:
+            executor.shutdown(wait=False)
+
+    return stages[2].result()
+
+async def run_sequential(batches, encode_batch, write_batch):
+    """
+    Same contract as run_pipeline, but each batch is read, encoded and written before
+    the next one is read. This is the baseline the pipeline is measured against.
+    """
+    rows_written = 0
+    async for batch in batches:
+        if not batch:
+            continue
+        encoded = encode_batch(batch)
+        await write_batch(batch, encoded)
+        rows_written += len(batch)
+    return rows_written
@@ -0,0 +1,206 @@
+# embedding_store.py
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from contextlib import contextmanager
+import numpy as np
+
+# Where stores live unless EMBEDDING_STORE_DIR says otherwise
+DEFAULT_STORE_DIR = ".embedding_store"
+
+_KEY_DTYPE = np.dtype('<u8')
+
+
+def normalize_text(text):
+    # Only changes that cannot alter what the model sees: Unicode form and whitespace runs
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+def text_key(model_name, text):
+    digest = hashlib.blake2b(f"{model_name}\0{normalize_text(text)}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class EmbeddingStore:
+    """
+    Local content-addressed embedding store for one model and encoder variant (see
+    encoders.Encoder.variant), so approximate or quantized vectors never stand in for
+    another backend's.
+
+    Vectors live in an append-only float32/float16 matrix (`vectors.bin`) that is read
+    through a memory map, and row i belongs to the i-th 64-bit key in `keys.bin`. Keys
+    are hashes of (model name, normalized text), so any script that embeds the same
+    sentence with the same model finds it here. Appends take an exclusive file lock,
+    so several processes can share one store.
+    """
+
+    def __init__(self, directory, model_name, dim, variant, dtype='float32'):
+        self.directory = directory
+        self.model_name = model_name
+        self.variant = variant
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._row_bytes = dim * self.dtype.itemsize
+        self._keys_path = os.path.join(directory, "keys.bin")
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._lock_path = os.path.join(directory, "lock")
+
+        # Index: a sorted array for the bulk of the keys plus a dict for recent appends,
+        # merged once the dict grows past a fraction of the sorted part
+        self._sorted_keys = np.empty(0, dtype=_KEY_DTYPE)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self._recent = {}
+        self._row_count = 0
+        self._vectors = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._check_meta()
+        with self._locked():
+            self._truncate_partial_writes()
+        self.refresh()
+
+    def __len__(self):
+        return self._row_count
+
+    def _check_meta(self):
+        meta = {"model": self.model_name, "variant": self.variant, "dim": self.dim, "dtype": self.dtype.name}
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                existing = json.load(file)
+            if existing != meta:
+                raise ValueError(f"Embedding store at {self.directory} holds {existing}, not {meta}")
+        else:
+            with open(meta_path, 'w') as file:
+                json.dump(meta, file)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _truncate_partial_writes(self):
+        # Vectors are appended before their keys, so after a crash the key count is
+        # authoritative; drop any half-written key or trailing vector bytes
+        for path in (self._keys_path, self._vectors_path):
+            open(path, 'ab').close()
+        key_count = os.path.getsize(self._keys_path) // _KEY_DTYPE.itemsize
+        vector_count = os.path.getsize(self._vectors_path) // self._row_bytes
+        rows = min(key_count, vector_count)
+        os.truncate(self._keys_path, rows * _KEY_DTYPE.itemsize)
+        os.truncate(self._vectors_path, rows * self._row_bytes)
+
+    def refresh(self):
+        """Picks up rows appended since the last refresh, including by other processes."""
+        with open(self._keys_path, 'rb') as file:
+            file.seek(self._row_count * _KEY_DTYPE.itemsize)
+            new_keys = np.frombuffer(file.read(), dtype=_KEY_DTYPE)
+        if not len(new_keys):
+            return
+
+        first_row = self._row_count
+        self._recent.update(zip(new_keys.tolist(), range(first_row, first_row + len(new_keys))))
+        self._row_count += len(new_keys)
+        if len(self._recent) > max(1024, len(self._sorted_keys) // 8):
+            self._merge_recent()
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode='r',
+                                  shape=(self._row_count, self.dim))
+
+    def _merge_recent(self):
+        keys = np.concatenate([self._sorted_keys, np.fromiter(self._recent.keys(), dtype=_KEY_DTYPE)])
+        rows = np.concatenate([self._sorted_rows, np.fromiter(self._recent.values(), dtype=np.int64)])
+        order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[order]
+        self._sorted_rows = rows[order]
+        self._recent = {}
+
+    def keys_for(self, texts):
+        return np.array([text_key(self.model_name, text) for text in texts], dtype=_KEY_DTYPE)
+
+    def lookup(self, keys):
+        """Returns the row of each key, or -1 where the key is not stored."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._sorted_keys):
+            positions = np.searchsorted(self._sorted_keys, keys).clip(max=len(self._sorted_keys) - 1)
+            found = self._sorted_keys[positions] == keys
+            rows[found] = self._sorted_rows[positions[found]]
+        if self._recent:
+            for i in np.flatnonzero(rows < 0):
+                rows[i] = self._recent.get(int(keys[i]), -1)
+        return rows
+
+    def vectors(self, rows):
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def get(self, text):
+        row = self.lookup(self.keys_for([text]))[0]
+        return self.vectors([row])[0] if row >= 0 else None
+
+    def put(self, texts, embeddings):
+        self.put_keys(self.keys_for(texts), embeddings)
+
+    def put_keys(self, keys, embeddings):
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype).reshape(len(keys), self.dim)
+        with self._locked():
+            # Another process may have appended since our last refresh; catch up first so
+            # the rows we add line up with their keys
+            self.refresh()
+            with open(self._vectors_path, 'ab') as file:
+                file.write(embeddings.tobytes())
+            with open(self._keys_path, 'ab') as file:
+                file.write(np.asarray(keys, dtype=_KEY_DTYPE).tobytes())
+            self.refresh()
+
+
+class CachedEncoder:
+    """
+    Drop-in front for a model's encode(): sentences already in the store are read from
+    it and only the rest, deduplicated, are sent to the model and then stored.
+    """
+
+    def __init__(self, model, store):
+        self.model = model
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    def encode(self, sentences, **kwargs):
+        keys = self.store.keys_for(sentences)
+        rows = self.store.lookup(keys)
+        embeddings = np.empty((len(sentences), self.store.dim), dtype=np.float32)
+
+        found = rows >= 0
+        if found.any():
+            embeddings[found] = self.store.vectors(rows[found])
+
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            unique_keys, first_index, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+            new_embeddings = self.model.encode([sentences[missing[i]] for i in first_index], **kwargs)
+            self.store.put_keys(unique_keys, new_embeddings)
+            embeddings[missing] = new_embeddings[inverse.ravel()]
+
+        self.hits += int(found.sum())
+        self.misses += len(missing)
+        return embeddings
+
+
+def open_embedding_store(model_name, dim, variant, dtype='float32', namespace=None):
+    # `variant` is the encoder's (e.g. "torch" or "onnx-int8"). A namespace gives a model
+    # a second store with its own key space, e.g. one keyed by catalog id as well as text
+    root = os.getenv("EMBEDDING_STORE_DIR", DEFAULT_STORE_DIR)
+    name = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)}.{variant}"
+    if namespace:
+        name = f"{name}.{namespace}"
+    return EmbeddingStore(os.path.join(root, name), model_name, dim, variant, dtype)
@@ -0,0 +1,112 @@
+# encode_scheduler.py
+
+import time
+import numpy as np
+
+
+def plan_batches(lengths, max_tokens, max_batch_size=None):
+    """
+    Groups sentence indices into batches of similar token length. Indices are visited
+    shortest first and a batch is closed once adding the next sentence would take its
+    padded size (sentences x longest sentence) over `max_tokens`, so short rows are
+    never padded out to the length of long branded names.
+    """
+    batches = []
+    current = []
+    for index in np.argsort(lengths, kind='stable'):
+        # Visiting in ascending order, so this sentence is the longest in the batch so far
+        padded_size = lengths[index] * (len(current) + 1)
+        if current and (padded_size > max_tokens or (max_batch_size and len(current) >= max_batch_size)):
+            batches.append(current)
+            current = []
+        current.append(int(index))
+    if current:
+        batches.append(current)
+    return batches
+
+def padded_tokens(lengths, batches):
+    return sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+
+
+class EncodeStats:
+    def __init__(self):
+        self.sentences = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        # Padded size the same sentences would have had in fixed-size arrival-order batches
+        self.baseline_padded_tokens = 0
+        self.seconds = 0.0
+
+    @property
+    def tokens_per_sec(self):
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    @property
+    def sentences_per_sec(self):
+        return self.sentences / self.seconds if self.seconds else 0.0
+
+    @property
+    def padding_ratio(self):
+        return 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+    @property
+    def baseline_padding_ratio(self):
+        return 1 - self.tokens / self.baseline_padded_tokens if self.baseline_padded_tokens else 0.0
+
+    def as_dict(self):
+        return {
+            "sentences": self.sentences,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "baseline_padded_tokens": self.baseline_padded_tokens,
+            "seconds": self.seconds,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        stats = cls()
+        for name, value in values.items():
+            setattr(stats, name, value)
+        return stats
+
+
+class TokenBudgetScheduler:
+    """
+    Sits in front of a model's encode(): buckets sentences by token length, encodes
+    them in batches sized by a total token budget instead of a fixed sentence count,
+    and returns the embeddings in the original order.
+    """
+
+    def __init__(self, model, max_tokens=16384, max_length=512, baseline_batch_size=32):
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.max_tokens = max_tokens
+        self.max_length = max_length
+        self.baseline_batch_size = baseline_batch_size
+        self.stats = EncodeStats()
+
+    def token_lengths(self, sentences):
+        input_ids = self.tokenizer(sentences, truncation=True, max_length=self.max_length)['input_ids']
+        return [len(ids) for ids in input_ids]
+
+    def encode(self, sentences):
+        start_time = time.time()
+        lengths = self.token_lengths(sentences)
+        batches = plan_batches(lengths, self.max_tokens)
+
+        embeddings = None
+        for batch in batches:
+            batch_embeddings = self.model.encode([sentences[i] for i in batch], batch_size=len(batch),
+                                                 max_length=self.max_length)
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), batch_embeddings.shape[1]), dtype=batch_embeddings.dtype)
+            embeddings[batch] = batch_embeddings
+
+        baseline_batches = [list(range(i, min(i + self.baseline_batch_size, len(sentences))))
+                            for i in range(0, len(sentences), self.baseline_batch_size)]
+        self.stats.sentences += len(sentences)
+        self.stats.tokens += sum(lengths)
+        self.stats.padded_tokens += padded_tokens(lengths, batches)
+        self.stats.baseline_padded_tokens += padded_tokens(lengths, baseline_batches)
+        self.stats.seconds += time.time() - start_time
+        return embeddings
@@ -0,0 +1,164 @@
+# encoders.py
+
+import inspect
+import os
+import re
+import numpy as np
+
+# How each model turns token states into one sentence vector
+POOLING = {
+    'BAAI/bge-base-en-v1.5': 'cls',
+    'BAAI/bge-large-en-v1.5': 'cls',
+    'thenlper/gte-base': 'mean',
+}
+
+# Exported ONNX graphs are cached here unless ONNX_MODEL_DIR says otherwise
+DEFAULT_ONNX_DIR = ".onnx_models"
+# Part of the exported file names; bumped when the export changes so stale graphs on
+# disk are not reused (v1 fed the attention mask into token_type_ids and vice versa)
+ONNX_EXPORT_VERSION = 2
+
+
+def pool(last_hidden_state, attention_mask, pooling):
+    if pooling == 'cls':
+        return last_hidden_state[:, 0]
+    mask = attention_mask[..., None].astype(last_hidden_state.dtype)
+    return (last_hidden_state * mask).sum(axis=1) / mask.sum(axis=1)
+
+def normalize(embeddings):
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class Encoder:
+    """
+    Common interface for sentence encoders: encode() returns L2-normalized float32
+    embeddings of shape (len(sentences), dim), in input order. Every backend exposes
+    its Hugging Face tokenizer so callers can count tokens, and a `variant` naming the
+    backend and precision, since vectors from different variants are not
+    interchangeable (embedding stores are kept per variant).
+    """
+
+    def __init__(self, model_name):
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.pooling = POOLING.get(model_name, 'cls')
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def encode(self, sentences, batch_size=256, max_length=512):
+        if not len(sentences):
+            return np.empty((0, self.dim), dtype=np.float32)
+        embeddings = [
+            self._encode_batch(sentences[i:i + batch_size], max_length)
+            for i in range(0, len(sentences), batch_size)
+        ]
+        return normalize(np.concatenate(embeddings).astype(np.float32))
+
+    def _encode_batch(self, sentences, max_length):
+        raise NotImplementedError
+
+
+class TorchEncoder(Encoder):
+    def __init__(self, model_name, use_fp16=False):
+        import torch
+        from transformers import AutoModel
+        super().__init__(model_name)
+        self.torch = torch
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = AutoModel.from_pretrained(model_name).to(self.device).eval()
+        self.variant = "torch"
+        if use_fp16 and self.device == 'cuda':
+            self.model = self.model.half()
+            self.variant = "torch-fp16"
+        self.dim = self.model.config.hidden_size
+
+    def _encode_batch(self, sentences, max_length):
+        inputs = self.tokenizer(sentences, max_length=max_length, padding=True, truncation=True, return_tensors='pt')
+        inputs = inputs.to(self.device)
+        with self.torch.inference_mode():
+            last_hidden_state = self.model(**inputs).last_hidden_state
+        return pool(last_hidden_state.float().cpu().numpy(), inputs['attention_mask'].cpu().numpy(), self.pooling)
+
+
+class OnnxEncoder(Encoder):
+    """
+    ONNX Runtime CPU backend. The model is exported from PyTorch on first use and, with
+    quantize=True, converted to int8 with dynamic quantization; both are cached on disk.
+    """
+
+    def __init__(self, model_name, quantize=False, threads=None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx encoder backend needs onnxruntime: pip install onnxruntime") from e
+        super().__init__(model_name)
+        self.variant = "onnx-int8" if quantize else "onnx"
+        model_path = export_onnx_model(model_name, quantize=quantize)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def _encode_batch(self, sentences, max_length):
+        inputs = self.tokenizer(sentences, max_length=max_length, padding=True, truncation=True, return_tensors='np')
+        feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        last_hidden_state = self.session.run(None, feed)[0]
+        return pool(last_hidden_state, inputs['attention_mask'], self.pooling)
+
+
+def export_onnx_model(model_name, quantize=False):
+    directory = os.path.join(os.getenv("ONNX_MODEL_DIR", DEFAULT_ONNX_DIR), re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+    model_path = os.path.join(directory, f"model.v{ONNX_EXPORT_VERSION}.onnx")
+    quantized_path = os.path.join(directory, f"model.v{ONNX_EXPORT_VERSION}.int8.onnx")
+
+    if not os.path.exists(model_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        os.makedirs(directory, exist_ok=True)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = AutoTokenizer.from_pretrained(model_name)(["export sample"], return_tensors='pt')
+        # The inputs are passed positionally, so they must follow forward()'s parameter
+        # order (input_ids, attention_mask, token_type_ids for BERT), not the tokenizer's
+        parameters = list(inspect.signature(model.forward).parameters)
+        input_names = [name for name in parameters if name in sample]
+        if input_names != parameters[:len(input_names)] or len(input_names) != len(sample):
+            raise ValueError(f"Cannot export {model_name}: tokenizer outputs {list(sample.keys())} "
+                             f"are not the leading parameters of forward() {parameters[:len(sample)]}")
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    if not quantize:
+        return model_path
+
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+def get_encoder(model_name, backend=None, quantize=None):
+    """
+    Builds the configured encoder for `model_name`. The backend comes from the
+    EMBEDDING_BACKEND environment variable ("torch", the default, or "onnx") and
+    EMBEDDING_QUANTIZE=int8 selects the quantized ONNX model.
+    """
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "torch")
+    if quantize is None:
+        quantize = os.getenv("EMBEDDING_QUANTIZE", "") == "int8"
+
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend == "onnx":
+        return OnnxEncoder(model_name, quantize=quantize)
+    raise ValueError(f"Unknown encoder backend: {backend}")
@@ -0,0 +1,192 @@
+# exact_search.py
+
+import fcntl
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from local_index import DEFAULT_INDEX_DIR, ItemTable
+
+# Scalar types the embedding matrix can be stored in
+MATRIX_DTYPES = ('float32', 'float16')
+# Rows of the matrix scored per task; each task holds queries x block_rows float32 scores
+DEFAULT_BLOCK_ROWS = 32768
+# Queries scored together against a block
+QUERY_CHUNK = 256
+# Bytes of float32 temporaries (converted blocks and score matrices) that concurrent
+# block tasks may hold at once; the thread count is capped to stay under it
+DEFAULT_MEMORY_BUDGET = 1 << 30
+
+
+def top_k_rows(scores, k):
+    """Column indices of the k largest values in each row of `scores`, best first."""
+    k = min(k, scores.shape[1])
+    if not k:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+def recall_at_k(found_ids, true_ids, k):
+    """Mean fraction of the true top-k ids present in each found top-k list."""
+    recalls = [len(set(list(found)[:k]) & set(list(truth)[:k])) / min(k, len(truth))
+               for found, truth in zip(found_ids, true_ids) if len(truth)]
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+class ExactIndex:
+    """
+    Exact cosine top-k over every embedding of one column, kept as an append-only
+    memory-mapped float16 or float32 matrix next to the same item table the HNSW index
+    uses. Queries are scored against fixed-size row blocks in parallel threads (the
+    matrix multiplications release the GIL), each block keeps its own top-k with
+    argpartition, and the per-block winners are merged. This is the recall ground truth
+    for the approximate indexes and a fast path for bulk offline matching.
+
+    A float32 matrix is scored in place; a float16 block is converted once per search
+    and reused for every query chunk. Threads are capped so the blocks and score
+    matrices in flight fit in `memory_budget` bytes.
+    """
+
+    def __init__(self, directory, dim=None, dtype='float32', threads=None, block_rows=DEFAULT_BLOCK_ROWS,
+                 writable=False, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.directory = directory
+        self.writable = writable
+        self.block_rows = block_rows
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock_file = None
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as file:
+                self.meta = json.load(file)
+        else:
+            if dim is None:
+                raise ValueError(f"No exact index at {directory}; pass dim to create one")
+            if dtype not in MATRIX_DTYPES:
+                raise ValueError(f"dtype must be one of {MATRIX_DTYPES}, not {dtype}")
+            self.meta = {"dim": dim, "dtype": dtype}
+            with open(self._meta_path, 'w') as file:
+                json.dump(self.meta, file)
+        self.dim = self.meta["dim"]
+        self.dtype = np.dtype(self.meta["dtype"])
+        self._row_bytes = self.dim * self.dtype.itemsize
+
+        if writable:
+            self._lock_file = open(os.path.join(directory, "lock"), 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self.items = ItemTable(directory)
+        open(self._vectors_path, 'ab').close()
+        if writable:
+            # Vectors are appended after their item rows, so drop item rows a crashed
+            # writer left without a vector
+            rows = os.path.getsize(self._vectors_path) // self._row_bytes
+            os.truncate(self._vectors_path, rows * self._row_bytes)
+            if len(self.items) > rows:
+                self.items.truncate(rows)
+        self._known_fdc_ids = None
+        converted_bytes = block_rows * self.dim * 4 if self.dtype != np.float32 else 0
+        task_bytes = converted_bytes + QUERY_CHUNK * block_rows * 4
+        self.threads = max(1, min(threads or os.cpu_count() or 1, memory_budget // task_bytes))
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="exact-search")
+        self.refresh()
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def refresh(self):
+        """Maps rows appended since the last refresh, including by other processes."""
+        self.items.refresh()
+        rows = min(os.path.getsize(self._vectors_path) // self._row_bytes, len(self.items))
+        if rows:
+            self.matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode='r', shape=(rows, self.dim))
+        else:
+            self.matrix = np.empty((0, self.dim), dtype=self.dtype)
+
+    def _search_block(self, queries, start, k):
+        # A float32 memmap slice is used as is; float16 is converted once for all chunks
+        block = self.matrix[start:start + self.block_rows]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        scores = np.empty((len(queries), min(k, len(block))), dtype=np.float32)
+        columns = np.empty(scores.shape, dtype=np.int64)
+        for chunk_start in range(0, len(queries), QUERY_CHUNK):
+            chunk = slice(chunk_start, chunk_start + QUERY_CHUNK)
+            chunk_scores = queries[chunk] @ block.T
+            columns[chunk] = top_k_rows(chunk_scores, k)
+            scores[chunk] = np.take_along_axis(chunk_scores, columns[chunk], axis=1)
+        return scores, columns + start
+
+    def top_k(self, queries, k=20):
+        """
+        Exact top-k for a batch of query vectors. Returns (labels, similarities), both of
+        shape (len(queries), min(k, len(self))), best first; labels are item table rows.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        k = min(k, len(self.matrix))
+        if not k:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        blocks = list(self.executor.map(lambda start: self._search_block(queries, start, k),
+                                        range(0, len(self.matrix), self.block_rows)))
+        block_scores = np.concatenate([scores for scores, _ in blocks], axis=1)
+        block_labels = np.concatenate([columns for _, columns in blocks], axis=1)
+        best = top_k_rows(block_scores, k)
+        return np.take_along_axis(block_labels, best, axis=1), np.take_along_axis(block_scores, best, axis=1)
+
+    def search(self, queries, k=20):
+        """Same results shape as LocalAnnIndex.search: per query, dicts best first."""
+        labels, similarities = self.top_k(queries, k)
+        return [
+            [{**self.items.row(int(label)), "similarity": float(similarity)}
+             for label, similarity in zip(row_labels, row_similarities)]
+            for row_labels, row_similarities in zip(labels, similarities)
+        ]
+
+    def add(self, items, embeddings):
+        """
+        Appends rows (dicts with fdcId, foodName, foodBrand, brandOwner) and their
+        embeddings, L2-normalized, skipping fdcIds already present. Returns the number added.
+        """
+        if not self.writable:
+            raise RuntimeError("Exact index was opened read-only")
+        if self._known_fdc_ids is None:
+            self._known_fdc_ids = set(self.items.fdc_ids.tolist())
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(items), self.dim)
+        keep = []
+        for i, item in enumerate(items):
+            if item['fdcId'] not in self._known_fdc_ids:
+                self._known_fdc_ids.add(item['fdcId'])
+                keep.append(i)
+        if not keep:
+            return 0
+
+        vectors = embeddings[keep] / np.linalg.norm(embeddings[keep], axis=1, keepdims=True)
+        self.items.append([items[i] for i in keep])
+        with open(self._vectors_path, 'ab') as file:
+            file.write(vectors.astype(self.dtype).tobytes())
+        self.refresh()
+        return len(keep)
+
+    def save(self):
+        # Rows are on disk as soon as add() returns; this only mirrors LocalAnnIndex
+        pass
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self._lock_file:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def exact_index_path(column):
+    return os.path.join(os.getenv("LOCAL_INDEX_DIR", DEFAULT_INDEX_DIR), f"{column}.exact")
+
+def open_exact_index(column='bgeBaseEmbedding', **kwargs):
+    return ExactIndex(exact_index_path(column), **kwargs)
+
+def exact_index_exists(column='bgeBaseEmbedding'):
+    return os.path.exists(os.path.join(exact_index_path(column), "meta.json"))
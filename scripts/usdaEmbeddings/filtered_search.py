@@ -0,0 +1,74 @@
+# filtered_search.py
+
+# Kinds of USDA food a search can be restricted to. Each has a partial HNSW index on
+# "bgeBaseEmbedding" (migrations 20261018110000 and 20261018110100) whose predicate is
+# the condition below, word for word: the planner only uses a partial index when the
+# query repeats its predicate, and then it walks a graph holding only matching rows
+# instead of filtering the full graph afterwards, which can return fewer than k rows.
+# The search_usda_database RPC keeps its older "foodBrand" IS NOT NULL filter.
+FOOD_KINDS = ('branded', 'generic')
+KIND_CONDITIONS = {
+    'branded': """COALESCE("foodBrand", '') <> ''""",
+    'generic': """COALESCE("foodBrand", '') = ''""",
+}
+
+# pgvector's default; an HNSW scan returns at most ef_search rows
+DEFAULT_EF_SEARCH = 40
+
+SEARCH_SQL = """
+    SELECT
+        "fdcId",
+        "foodName",
+        "foodBrand",
+        "brandOwner",
+        1 - ("bgeBaseEmbedding" <=> $1) AS cosine_similarity
+    FROM "UsdaFoodItemEmbedding"
+    WHERE {condition} AND "bgeBaseEmbedding" IS NOT NULL
+    ORDER BY "bgeBaseEmbedding" <#> $1
+    LIMIT $2
+"""
+
+
+def parse_kinds(kinds):
+    """
+    Normalizes a kinds argument: None or "all" means no filter (None), otherwise a
+    kind name, a comma-separated string or a list of kind names.
+    """
+    if kinds is None or kinds == "all":
+        return None
+    if isinstance(kinds, str):
+        kinds = kinds.split(",")
+    kinds = tuple(dict.fromkeys(kind.strip() for kind in kinds))
+    unknown = [kind for kind in kinds if kind not in KIND_CONDITIONS]
+    if unknown:
+        raise ValueError(f"Unknown food kind(s) {unknown}; expected some of {FOOD_KINDS}")
+    return kinds
+
+def kind_condition(kind):
+    return KIND_CONDITIONS[kind] if kind else "TRUE"
+
+def search_sql(kind=None):
+    return SEARCH_SQL.format(condition=kind_condition(kind))
+
+def merge_results(result_lists, k):
+    """Best k rows across per-kind result lists, by cosine similarity."""
+    merged = [row for rows in result_lists for row in rows]
+    merged.sort(key=lambda row: row["cosine_similarity"], reverse=True)
+    return merged[:k]
+
+async def set_ef_search(conn, ef_search, k):
+    # Session level: the pool resets it when the connection is released. Never below k,
+    # or the scan could not return k rows.
+    await conn.execute("SELECT set_config('hnsw.ef_search', $1, false)", str(max(ef_search, k)))
+
+async def search_kinds(conn, embedding, k, kinds=None, ef_search=None):
+    """
+    Top `k` foods for `embedding`: from the full index when `kinds` is None, otherwise
+    from each kind's partial index, merged. `ef_search` overrides hnsw.ef_search.
+    """
+    if ef_search:
+        await set_ef_search(conn, ef_search, k)
+    if kinds is None:
+        return await conn.fetch(search_sql(), embedding, k)
+    result_lists = [await conn.fetch(search_sql(kind), embedding, k) for kind in kinds]
+    return result_lists[0] if len(result_lists) == 1 else merge_results(result_lists, k)
@@ -1,25 +1,15 @@
 # gte_embedding.py
 
-import torch.nn.functional as F
+from functools import lru_cache
+import torch
 from torch import Tensor
-from transformers import AutoTokenizer, AutoModel
+from encoders import get_encoder
 
-def average_pool(last_hidden_states: Tensor,
-                 attention_mask: Tensor) -> Tensor:
-    last_hidden = last_hidden_states.masked_fill(~attention_mask[..., None].bool(), 0.0)
-    return last_hidden.sum(dim=1) / attention_mask.sum(dim=1)[..., None]
+@lru_cache(maxsize=None)
+def load_gte_encoder():
+    return get_encoder("thenlper/gte-base")
 
 def getGteEmbedding(input_texts: list[str]) -> Tensor:
-    tokenizer = AutoTokenizer.from_pretrained("thenlper/gte-base")
-    model = AutoModel.from_pretrained("thenlper/gte-base")
-
-    # Tokenize the input texts
-    batch_dict = tokenizer(input_texts, max_length=512, padding=True, truncation=True, return_tensors='pt')
-
-    outputs = model(**batch_dict)
-    embeddings = average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
-
-    # (Optionally) normalize embeddings
-    embeddings = F.normalize(embeddings, p=2, dim=1)
-    
-    return embeddings
+    # Mean-pooled, L2-normalized GTE embeddings from the configured encoder backend
+    embeddings = load_gte_encoder().encode(input_texts, max_length=512)
+    return torch.from_numpy(embeddings)
@@ -0,0 +1,70 @@
+# hybrid_search.py
+
+from filtered_search import kind_condition, search_kinds
+from pipeline_metrics import NULL_METRICS
+
+# The text the trigram index covers; must match the indexed expression in migration
+# 20261018120000_usda_lexical_trgm_index.sql exactly for the planner to use the index
+LEXICAL_TEXT = """("foodName" || ' ' || COALESCE("foodBrand", '') || ' ' || COALESCE("brandOwner", ''))"""
+
+# Lexical candidates the vectors are scored over
+DEFAULT_CANDIDATES = 200
+# Reciprocal-rank fusion constant: score = sum over rankings of 1 / (RRF_K + rank)
+RRF_K = 60
+
+# Trigram candidates for $1 (word similarity above pg_trgm.word_similarity_threshold,
+# served by the GIN index), best lexical match first, each with its bge similarity to
+# the query vector $2. The inner query ranks and limits without touching the vectors;
+# only the $3 rows it keeps are joined back and scored, and no HNSW walk happens.
+LEXICAL_SQL = """
+    SELECT
+        c."fdcId",
+        c."foodName",
+        c."foodBrand",
+        c."brandOwner",
+        c.lexical_similarity,
+        1 - (t."bgeBaseEmbedding" <=> $2) AS cosine_similarity
+    FROM (
+        SELECT id, "fdcId", "foodName", "foodBrand", "brandOwner", word_similarity($1, {text}) AS lexical_similarity
+        FROM "UsdaFoodItemEmbedding"
+        WHERE $1 <% {text} AND ({condition}) AND "bgeBaseEmbedding" IS NOT NULL
+        ORDER BY lexical_similarity DESC
+        LIMIT $3
+    ) c
+    JOIN "UsdaFoodItemEmbedding" t ON t.id = c.id
+    ORDER BY c.lexical_similarity DESC
+"""
+
+
+def lexical_sql(kinds=None):
+    condition = " OR ".join(kind_condition(kind) for kind in kinds) if kinds else kind_condition(None)
+    return LEXICAL_SQL.format(text=LEXICAL_TEXT, condition=condition)
+
+def rrf_fuse(rankings, k, rrf_k=RRF_K):
+    """
+    Fuses ranked lists of rows (best first) by reciprocal rank, keyed by fdcId. Returns
+    the best `k` rows as dicts with an added "rrf_score".
+    """
+    scores = {}
+    rows = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row["fdcId"]] = scores.get(row["fdcId"], 0.0) + 1.0 / (rrf_k + rank)
+            rows.setdefault(row["fdcId"], row)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [{**rows[fdc_id], "rrf_score": scores[fdc_id]} for fdc_id in best]
+
+async def hybrid_search(conn, term, embedding, k, kinds=None, candidates=DEFAULT_CANDIDATES, ef_search=None,
+                        metrics=NULL_METRICS):
+    """
+    Top `k` foods for `term` by reciprocal-rank fusion of trigram rank and bge rank over
+    the lexical candidates. When the term matches fewer than `k` rows lexically (typos,
+    descriptive queries), the ANN results are fused in as a third ranking instead.
+    """
+    lexical = await conn.fetch(lexical_sql(kinds), term, embedding, max(candidates, k))
+    by_vector = sorted(lexical, key=lambda row: row["cosine_similarity"], reverse=True)
+    rankings = [lexical, by_vector]
+    if len(lexical) < k:
+        metrics.count("hybrid_ann_fallbacks")
+        rankings.append(await search_kinds(conn, embedding, k, kinds, ef_search))
+    return rrf_fuse(rankings, k)
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import os
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+from dotenv import load_dotenv
+from buildEmbeddings import EMBEDDING_COLUMNS
+from pipeline_metrics import open_metrics
+from usda_bulk import DEFAULT_DATA_TYPES, BulkRelease, apply_release, stage_release
+
+# Bulk-download alternative to the id-range crawl in updateUsdaData.py: streams a
+# FoodData Central CSV release (the zip from https://fdc.nal.usda.gov/download-datasets
+# or its unpacked directory) into a staging table in one pass and applies only what
+# differs from "UsdaFoodItemEmbedding" by fdcId. New and changed rows are left without
+# embeddings for buildEmbeddings.py to fill, so no API quota is spent at all.
+
+# Load environment variables from .env file
+load_dotenv(dotenv_path="prisma/.env")
+
+# Fetch the DATABASE_URL from environment variables
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Ingest a FoodData Central bulk CSV release.")
+    parser.add_argument("release", help="Path to the release zip or its unpacked directory.")
+    parser.add_argument("--data-types", default=",".join(DEFAULT_DATA_TYPES),
+                        help="Comma-separated food.csv data_type values to ingest.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change and roll back.")
+    args = parser.parse_args()
+
+    metrics = open_metrics("ingestUsdaBulk")
+    release = BulkRelease(args.release)
+    parsed_url = urlparse(DATABASE_URL)
+    sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+    conn = await asyncpg.connect(sanitized_url)
+    try:
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            staged = await stage_release(conn, release.iter_foods(tuple(args.data_types.split(","))), metrics)
+            inserted, changed = await apply_release(conn, list(EMBEDDING_COLUMNS), metrics)
+        except BaseException:
+            await transaction.rollback()
+            raise
+        if args.dry_run:
+            await transaction.rollback()
+        else:
+            await transaction.commit()
+        metrics.count("rows_staged", staged)
+        metrics.count("rows_inserted", inserted)
+        metrics.count("rows_changed", changed)
+        print(f"{staged} foods in the release: {inserted} new, {changed} changed"
+              f"{' (dry run, nothing written)' if args.dry_run else '; run buildEmbeddings.py to embed them'}")
+    finally:
+        release.close()
+        metrics.close()
+        print(metrics.summary())
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
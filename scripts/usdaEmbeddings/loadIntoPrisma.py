@@ -92,31 +92,24 @@ async def main(resume=False):
                 brand_owner = row[brand_owner_idx] if brand_owner_idx is not None else ''
                 brand_name = row[brand_name_idx] if brand_name_idx is not None else ''
 
-                exists = await prisma.usdafooditemembedding.find_first(where={
+                batch.append({
+                    'fdcId': fdc_id,
                     'foodName': description,
                     'foodBrand': brand_name,
-                    'brandOwner': brand_owner
+                    'brandOwner': brand_owner,
                 })
-
-                if not exists:
-                    batch.append({
-                        'fdcId': fdc_id,
-                        'foodName': description,
-                        'foodBrand': brand_name,
-                        'brandOwner': brand_owner,
-                    })
-                else:
-                    pbar.set_description("Skipped existing row")
             except ValueError as e:
                 print(f"Error processing row with fdc_id {row[fdc_id_idx]}: {e}")
 
 
+            # Rows whose fdcId or case-insensitive name/brand/owner key is already in the
+            # table are skipped by the unique indexes (ON CONFLICT DO NOTHING)
             if len(batch) >= batch_size:
-                await prisma.usdafooditemembedding.create_many(data=batch)
+                await prisma.usdafooditemembedding.create_many(data=batch, skip_duplicates=True)
                 pbar.set_description("Batch inserted")
                 batch.clear()
 
         if batch:
-            await prisma.usdafooditemembedding.create_many(data=batch)
+            await prisma.usdafooditemembedding.create_many(data=batch, skip_duplicates=True)
 
 asyncio.run(main(resume=True))
\ No newline at end of file
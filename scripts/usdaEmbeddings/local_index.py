@@ -0,0 +1,234 @@
+# local_index.py
+
+import fcntl
+import json
+import os
+import numpy as np
+
+# Where local indexes live unless LOCAL_INDEX_DIR says otherwise
+DEFAULT_INDEX_DIR = ".ann_index"
+
+# usearch scalar types for the stored vectors
+VECTOR_DTYPES = ('f32', 'f16', 'i8')
+
+_FIELDS = ('foodName', 'foodBrand', 'brandOwner')
+
+
+class ItemTable:
+    """
+    fdcId, foodName, foodBrand and brandOwner for every vector in a local index, in
+    label order, so a search hit's label is also its row here. fdcIds are a memory-mapped
+    int64 array and the text fields sit in one UTF-8 blob addressed by an offsets array,
+    so every process reading the index shares the same pages. All three files are
+    append-only.
+    """
+
+    def __init__(self, directory):
+        self._fdc_ids_path = os.path.join(directory, "fdc_ids.bin")
+        self._offsets_path = os.path.join(directory, "offsets.bin")
+        self._strings_path = os.path.join(directory, "strings.bin")
+        for path in (self._fdc_ids_path, self._offsets_path, self._strings_path):
+            open(path, 'ab').close()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.fdc_ids)
+
+    def refresh(self):
+        # Offsets are appended last, so they decide how many rows are complete
+        rows = os.path.getsize(self._offsets_path) // (8 * len(_FIELDS) * 2)
+        self.fdc_ids = self._map(self._fdc_ids_path, np.int64, (rows,))
+        self.offsets = self._map(self._offsets_path, np.int64, (rows, len(_FIELDS), 2))
+        self.strings = self._map(self._strings_path, np.uint8, (os.path.getsize(self._strings_path),))
+
+    @staticmethod
+    def _map(path, dtype, shape):
+        if not np.prod(shape):
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+    def truncate(self, rows):
+        # Drops rows appended after the last saved graph, e.g. by a writer that crashed
+        # before save(); their bytes in the string blob are simply never referenced
+        os.truncate(self._fdc_ids_path, rows * 8)
+        os.truncate(self._offsets_path, rows * 8 * len(_FIELDS) * 2)
+        self.refresh()
+
+    def row(self, label):
+        item = {"fdcId": int(self.fdc_ids[label])}
+        for field, (start, length) in zip(_FIELDS, self.offsets[label]):
+            item[field] = bytes(self.strings[start:start + length]).decode('utf-8') if length >= 0 else None
+        return item
+
+    def append(self, items):
+        blob = bytearray()
+        base = len(self.strings)
+        offsets = np.empty((len(items), len(_FIELDS), 2), dtype=np.int64)
+        for i, item in enumerate(items):
+            for j, field in enumerate(_FIELDS):
+                value = item.get(field)
+                if value is None:
+                    # A negative length marks NULL, which is not the same as an empty string
+                    offsets[i, j] = (0, -1)
+                    continue
+                encoded = value.encode('utf-8')
+                offsets[i, j] = (base + len(blob), len(encoded))
+                blob += encoded
+
+        with open(self._strings_path, 'ab') as file:
+            file.write(blob)
+        with open(self._fdc_ids_path, 'ab') as file:
+            file.write(np.array([item['fdcId'] for item in items], dtype=np.int64).tobytes())
+        with open(self._offsets_path, 'ab') as file:
+            file.write(offsets.tobytes())
+        self.refresh()
+
+
+class LocalAnnIndex:
+    """
+    On-disk HNSW index (usearch) over one embedding column of "UsdaFoodItemEmbedding",
+    with float16 or int8 vectors and cosine distance. Readers open the graph as a memory
+    map, so searches run in-process without a database round trip and several processes
+    share one copy in the page cache. A writer opened with writable=True loads the graph,
+    takes an exclusive file lock and can add rows incrementally; save() swaps the new
+    graph in atomically and readers pick it up on refresh().
+    """
+
+    def __init__(self, directory, dim=None, dtype='f16', connectivity=16, expansion_add=128,
+                 expansion_search=64, writable=False):
+        try:
+            from usearch.index import Index
+        except ImportError as e:
+            raise ImportError("The local ANN index needs usearch: pip install usearch") from e
+        self._Index = Index
+        self.directory = directory
+        self.writable = writable
+        self._index_path = os.path.join(directory, "index.usearch")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock_file = None
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as file:
+                self.meta = json.load(file)
+        else:
+            if dim is None:
+                raise ValueError(f"No local index at {directory}; pass dim to create one")
+            if dtype not in VECTOR_DTYPES:
+                raise ValueError(f"dtype must be one of {VECTOR_DTYPES}, not {dtype}")
+            self.meta = {"dim": dim, "dtype": dtype, "connectivity": connectivity,
+                         "expansion_add": expansion_add, "expansion_search": expansion_search}
+            with open(self._meta_path, 'w') as file:
+                json.dump(self.meta, file)
+        self.dim = self.meta["dim"]
+
+        if writable:
+            self._lock_file = open(os.path.join(directory, "lock"), 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self.items = ItemTable(directory)
+        self._known_fdc_ids = None
+        self.index = None
+        self._index_mtime = None
+        self.refresh()
+        if writable and len(self.items) > len(self.index):
+            self.items.truncate(len(self.index))
+
+    def __len__(self):
+        return len(self.index)
+
+    def _new_index(self):
+        return self._Index(ndim=self.dim, metric='cos', dtype=self.meta["dtype"],
+                           connectivity=self.meta["connectivity"],
+                           expansion_add=self.meta["expansion_add"],
+                           expansion_search=self.meta["expansion_search"])
+
+    def refresh(self):
+        """Reopens the graph if a writer has saved a newer one since it was opened."""
+        mtime = os.path.getmtime(self._index_path) if os.path.exists(self._index_path) else None
+        if self.index is not None and mtime == self._index_mtime:
+            return
+        index = self._new_index()
+        if mtime is not None:
+            # Writers need the graph in memory to add to it; readers only map the file
+            if self.writable:
+                index.load(self._index_path)
+            else:
+                index.view(self._index_path)
+        self.index = index
+        self._index_mtime = mtime
+        self.items.refresh()
+
+    def search(self, queries, k=20):
+        """
+        Top-k neighbours for each query vector. Returns one list per query of dicts with
+        fdcId, foodName, foodBrand, brandOwner and cosine similarity, best first.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not len(self.index):
+            return [[] for _ in queries]
+        matches = self.index.search(queries, k)
+        labels = np.atleast_2d(matches.keys)
+        distances = np.atleast_2d(matches.distances)
+        counts = np.atleast_1d(getattr(matches, 'counts', [labels.shape[1]]))
+
+        results = []
+        for row_labels, row_distances, count in zip(labels, distances, counts):
+            results.append([
+                {**self.items.row(int(label)), "similarity": 1 - float(distance)}
+                for label, distance in zip(row_labels[:count], row_distances[:count])
+            ])
+        return results
+
+    def _check_writable(self):
+        if not self.writable:
+            raise RuntimeError("Local index was opened read-only")
+
+    def add(self, items, embeddings):
+        """
+        Adds rows (dicts with fdcId, foodName, foodBrand, brandOwner) and their embeddings,
+        skipping fdcIds already in the index. Returns the number of rows added; call save()
+        to publish them to readers.
+        """
+        self._check_writable()
+        if self._known_fdc_ids is None:
+            self._known_fdc_ids = set(self.items.fdc_ids.tolist())
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(items), self.dim)
+        keep = []
+        for i, item in enumerate(items):
+            if item['fdcId'] not in self._known_fdc_ids:
+                self._known_fdc_ids.add(item['fdcId'])
+                keep.append(i)
+        if not keep:
+            return 0
+
+        # Rows are written to the item table first, so every label a reader can see
+        # in a saved graph already has its row
+        first_label = len(self.items)
+        self.items.append([items[i] for i in keep])
+        labels = np.arange(first_label, first_label + len(keep), dtype=np.uint64)
+        self.index.add(labels, embeddings[keep])
+        return len(keep)
+
+    def save(self):
+        self._check_writable()
+        # Readers map the old file until they refresh, so replace it rather than rewrite it
+        tmp_path = f"{self._index_path}.tmp"
+        self.index.save(tmp_path)
+        os.replace(tmp_path, self._index_path)
+        self._index_mtime = os.path.getmtime(self._index_path)
+
+    def close(self):
+        if self._lock_file:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def local_index_path(column):
+    return os.path.join(os.getenv("LOCAL_INDEX_DIR", DEFAULT_INDEX_DIR), column)
+
+def open_local_index(column='bgeBaseEmbedding', **kwargs):
+    return LocalAnnIndex(local_index_path(column), **kwargs)
+
+def local_index_exists(column='bgeBaseEmbedding'):
+    return os.path.exists(os.path.join(local_index_path(column), "meta.json"))
@@ -0,0 +1,36 @@
+# pgvector_codec.py
+
+import struct
+import numpy as np
+
+# pgvector's binary wire format: uint16 dimensions, uint16 unused, then big-endian float32 values
+_VECTOR_HEADER = struct.Struct('>HH')
+_WIRE_DTYPE = np.dtype('>f4')
+
+
+def encode_vector(value):
+    """Encodes a 1-d array-like of floats into pgvector's binary representation."""
+    array = np.asarray(value, dtype=_WIRE_DTYPE)
+    if array.ndim != 1:
+        raise ValueError(f"expected a 1-d vector, got shape {array.shape}")
+    return _VECTOR_HEADER.pack(array.shape[0], 0) + array.tobytes()
+
+def decode_vector(data):
+    """Decodes pgvector's binary representation into a native float32 NumPy array."""
+    dimensions, _ = _VECTOR_HEADER.unpack_from(data)
+    return np.frombuffer(data, dtype=_WIRE_DTYPE, count=dimensions, offset=_VECTOR_HEADER.size).astype(np.float32)
+
+async def register_vector_codec(conn, schema='public'):
+    """
+    Makes `conn` send and receive `vector` values as binary float32 buffers.
+    Query parameters accept NumPy arrays or lists and results come back as NumPy arrays,
+    so vectors never go through '[0.0123,...]' strings. Use as a pool `init` callback
+    or call it once after asyncpg.connect().
+    """
+    await conn.set_type_codec(
+        'vector',
+        schema=schema,
+        encoder=encode_vector,
+        decoder=decode_vector,
+        format='binary',
+    )
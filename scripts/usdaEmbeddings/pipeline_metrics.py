@@ -0,0 +1,201 @@
+# pipeline_metrics.py
+
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds (seconds) of the Prometheus histogram buckets for stage durations
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Samples kept per stage for percentiles; beyond this a uniform reservoir sample is kept
+RESERVOIR_SIZE = 10000
+# Minimum seconds between textfile rewrites during a run
+TEXTFILE_INTERVAL = 10.0
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = value
+
+
+class Metrics:
+    """
+    Per-run stage timers, counters and histograms for the pipeline scripts.
+
+    Every timed stage (fetch, dedupe, encode, write, api_call, ...) feeds a histogram
+    and, when `jsonl_path` is set, is appended as one JSON line per observation. When
+    `textfile_path` is set the aggregates are written in the Prometheus text format,
+    for node_exporter's textfile collector, during the run and on close(). Safe to use
+    from the encoder thread and the event loop at the same time.
+    """
+
+    def __init__(self, job, jsonl_path=None, textfile_path=None):
+        self.job = job
+        self.textfile_path = textfile_path
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(Histogram)
+        self._lock = threading.Lock()
+        self._events = open(jsonl_path, 'a') if jsonl_path else None
+        self._last_textfile_write = 0.0
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, stage, seconds, **fields):
+        with self._lock:
+            self.histograms[stage].observe(seconds)
+            if self._events:
+                event = {"ts": time.time(), "job": self.job, "stage": stage, "seconds": seconds, **fields}
+                self._events.write(json.dumps(event) + "\n")
+            textfile_due = self.textfile_path and time.time() - self._last_textfile_write > TEXTFILE_INTERVAL
+            if textfile_due:
+                self._last_textfile_write = time.time()
+        if textfile_due:
+            self.write_textfile()
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time, **fields)
+
+    async def timed_iter(self, stage, iterable):
+        """Re-yields an async iterable, timing how long each item takes to arrive."""
+        iterator = iterable.__aiter__()
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            self.observe(stage, time.perf_counter() - start_time)
+            yield item
+
+    def mean(self, stage):
+        histogram = self.histograms.get(stage)
+        return histogram.total / histogram.count if histogram and histogram.count else 0.0
+
+    def summary(self):
+        lines = [f"{'stage':14}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                lines.append(f"{stage:14}{histogram.count:>8}{histogram.total:>10.2f}"
+                             f"{histogram.total / histogram.count * 1000:>10.1f}"
+                             f"{percentile(histogram.samples, 50) * 1000:>10.1f}"
+                             f"{percentile(histogram.samples, 99) * 1000:>10.1f}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name}: {value:g}")
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        labels = f'job="{self.job}"'
+        lines = [
+            "# HELP amino_pipeline_stage_seconds Time spent per pipeline stage call.",
+            "# TYPE amino_pipeline_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                stage_labels = f'{labels},stage="{stage}"'
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'amino_pipeline_stage_seconds_bucket{{{stage_labels},le="{bound}"}} {cumulative}')
+                lines.append(f'amino_pipeline_stage_seconds_bucket{{{stage_labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'amino_pipeline_stage_seconds_sum{{{stage_labels}}} {histogram.total}')
+                lines.append(f'amino_pipeline_stage_seconds_count{{{stage_labels}}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE amino_pipeline_{name}_total counter")
+                lines.append(f"amino_pipeline_{name}_total{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        # Write then rename, so the collector never reads a half-written file
+        tmp_path = f"{self.textfile_path}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, self.textfile_path)
+
+    def close(self):
+        if self.textfile_path:
+            self.write_textfile()
+        if self._events:
+            self._events.close()
+            self._events = None
+
+
+class NullMetrics:
+    """Accepts the Metrics calls and records nothing, for callers that were not given one."""
+
+    def count(self, name, value=1):
+        pass
+
+    def observe(self, stage, seconds, **fields):
+        pass
+
+    def timer(self, stage, **fields):
+        return nullcontext()
+
+    async def timed_iter(self, stage, iterable):
+        async for item in iterable:
+            yield item
+
+    def mean(self, stage):
+        return 0.0
+
+    def summary(self):
+        return ""
+
+    def prometheus_text(self):
+        return ""
+
+    def write_textfile(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def open_metrics(job):
+    """
+    Metrics for one script run. With METRICS_DIR set, observations are logged to
+    <METRICS_DIR>/<job>.jsonl and aggregates written to <METRICS_DIR>/<job>.prom.
+    """
+    metrics_dir = os.getenv("METRICS_DIR")
+    if not metrics_dir:
+        return Metrics(job)
+    os.makedirs(metrics_dir, exist_ok=True)
+    return Metrics(job, jsonl_path=os.path.join(metrics_dir, f"{job}.jsonl"),
+                   textfile_path=os.path.join(metrics_dir, f"{job}.prom"))
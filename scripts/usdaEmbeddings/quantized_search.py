@@ -0,0 +1,67 @@
+# quantized_search.py
+
+from filtered_search import set_ef_search
+
+# Compact first-pass representations of "bgeBaseEmbedding", each an HNSW expression
+# index (migration 20261018130000_usda_embedding_quantized_indexes.sql), so the table
+# keeps one float32 column for rescoring and only the index holds the compact copy:
+#   halfvec - float16, half the index size, nearly lossless
+#   binary  - one sign bit per dimension, 1/32 of the size, searched by Hamming distance
+# pgvector has no int8 vector type; int8 is available for the local HNSW index
+# (buildLocalIndex.py --dtype i8).
+QUANTIZATIONS = {
+    'halfvec': {
+        "index": "UsdaFoodItemEmbedding_bgeBaseEmbedding_halfvec_idx",
+        "create": """CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_halfvec_idx" ON public."UsdaFoodItemEmbedding" USING hnsw ((("bgeBaseEmbedding")::halfvec(768)) halfvec_ip_ops) WITH (m='16', ef_construction='128')""",
+        "order_by": """"bgeBaseEmbedding"::halfvec(768) <#> $1::vector::halfvec(768)""",
+    },
+    'binary': {
+        "index": "UsdaFoodItemEmbedding_bgeBaseEmbedding_binary_idx",
+        "create": """CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_binary_idx" ON public."UsdaFoodItemEmbedding" USING hnsw (((binary_quantize("bgeBaseEmbedding"))::bit(768)) bit_hamming_ops) WITH (m='16', ef_construction='128')""",
+        "order_by": """binary_quantize("bgeBaseEmbedding")::bit(768) <~> binary_quantize($1::vector)""",
+    },
+}
+
+# Candidates taken from the quantized index and rescored at full precision
+DEFAULT_RESCORE_CANDIDATES = 100
+
+# First pass walks the quantized index for $3 candidates; the outer query rescores
+# them with the float32 column and keeps the best $2. The query vector $1 is always
+# bound as a vector and cast in SQL, so the connection needs no halfvec codec.
+RESCORE_SQL = """
+    SELECT
+        "fdcId",
+        "foodName",
+        "foodBrand",
+        "brandOwner",
+        1 - ("bgeBaseEmbedding" <=> $1) AS cosine_similarity
+    FROM (
+        SELECT "fdcId", "foodName", "foodBrand", "brandOwner", "bgeBaseEmbedding"
+        FROM "UsdaFoodItemEmbedding"
+        WHERE "bgeBaseEmbedding" IS NOT NULL
+        ORDER BY {order_by}
+        LIMIT $3
+    ) candidates
+    ORDER BY "bgeBaseEmbedding" <#> $1
+    LIMIT $2
+"""
+
+
+def check_quantization(quantization):
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization must be one of {tuple(QUANTIZATIONS)}, not {quantization}")
+
+def rescore_sql(quantization):
+    check_quantization(quantization)
+    return RESCORE_SQL.format(order_by=QUANTIZATIONS[quantization]["order_by"])
+
+async def quantized_search(conn, embedding, k, quantization, candidates=DEFAULT_RESCORE_CANDIDATES,
+                           ef_search=None):
+    """
+    Top `k` foods for `embedding`: `candidates` rows from the `quantization` index,
+    rescored with the full-precision vectors. ef_search is raised to at least
+    `candidates`, since the first pass cannot return more rows than that.
+    """
+    candidates = max(candidates, k)
+    await set_ef_search(conn, ef_search or candidates, candidates)
+    return await conn.fetch(rescore_sql(quantization), embedding, k, candidates)
@@ -0,0 +1,53 @@
+# query_cache.py
+
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 50000
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded in-process LRU in front of "foodEmbeddingCache": query text -> (row id,
+    bge vector). A hit means the row exists in the table and the vector can be passed
+    straight into the search query, so a hot query needs no extra round trip. The id
+    is None for rows inserted in bulk, whose ids are not read back.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, text):
+        entry = self.entries.get(text)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(text)
+        self.hits += 1
+        return entry
+
+    def put(self, text, row_id, embedding):
+        self.entries[text] = (row_id, embedding)
+        self.entries.move_to_end(text)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def warm(self, conn, limit=None):
+        """
+        Loads the newest "foodEmbeddingCache" rows in one query, up to `limit` (default:
+        the cache size). Returns the number of rows loaded.
+        """
+        rows = await conn.fetch(
+            'SELECT id, "textToEmbed", "bgeBaseEmbedding" FROM "foodEmbeddingCache" '
+            'WHERE "bgeBaseEmbedding" IS NOT NULL ORDER BY id DESC LIMIT $1',
+            min(limit or self.max_size, self.max_size)
+        )
+        # Oldest first, so the newest rows end up most recently used
+        for row in reversed(rows):
+            self.put(row["textToEmbed"], row["id"], row["bgeBaseEmbedding"])
+        return len(rows)
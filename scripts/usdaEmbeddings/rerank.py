@@ -0,0 +1,75 @@
+# rerank.py
+
+import numpy as np
+
+# Share of the fused score that comes from the bge similarity; the rest is GTE
+DEFAULT_BGE_WEIGHT = 0.5
+
+
+def fuse_scores(bge_similarities, gte_similarities, bge_weight=DEFAULT_BGE_WEIGHT):
+    return bge_weight * np.asarray(bge_similarities) + (1 - bge_weight) * np.asarray(gte_similarities)
+
+
+class GteReranker:
+    """
+    Second-stage scoring of retrieved candidates with GTE. Catalog items' GTE
+    embeddings live in a persistent store keyed by fdcId and the sentence embedded
+    (a bulk release can rename a row in place, and the new text must miss), so popular
+    foods are encoded once per text; each call only encodes the query terms and
+    candidates the store has not seen, in a single model call. Candidates are
+    re-sorted by a weighted sum of the bge and GTE similarities.
+
+    `sentence_for(food)` builds the text a candidate is embedded from.
+    """
+
+    def __init__(self, model, store, sentence_for, bge_weight=DEFAULT_BGE_WEIGHT):
+        self.model = model
+        self.store = store
+        self.sentence_for = sentence_for
+        self.bge_weight = bge_weight
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, terms, foods):
+        sentences = [self.sentence_for(food) for food in foods]
+        keys = self.store.keys_for([f"{food['fdcId']}\0{sentence}" for food, sentence in zip(foods, sentences)])
+        rows = self.store.lookup(keys)
+        found = int((rows >= 0).sum())
+        missing = {}
+        for key, sentence, row in zip(keys.tolist(), sentences, rows):
+            if row < 0:
+                missing.setdefault(key, sentence)
+
+        # Terms and unseen candidates go through the model together
+        encoded = self.model.encode(list(terms) + list(missing.values()), max_length=512)
+        term_embeddings = encoded[:len(terms)]
+        if missing:
+            self.store.put_keys(np.array(list(missing), dtype=np.uint64), encoded[len(terms):])
+            rows = self.store.lookup(keys)
+
+        self.hits += found
+        self.misses += len(foods) - found
+        food_embeddings = self.store.vectors(rows) if len(rows) else np.empty((0, self.store.dim), dtype=np.float32)
+        return term_embeddings, food_embeddings
+
+    def rerank_batch(self, terms, foods_per_term):
+        """
+        For each term and its candidates (dicts with fdcId and cosine_similarity), returns
+        (food, gte_similarity, score) tuples sorted by fused score, best first.
+        """
+        all_foods = [food for foods in foods_per_term for food in foods]
+        term_embeddings, food_embeddings = self._embed(terms, all_foods)
+
+        reranked = []
+        start = 0
+        for term_embedding, foods in zip(term_embeddings, foods_per_term):
+            # Both sides are L2-normalized, so cosine similarity is a dot product
+            gte_similarities = food_embeddings[start:start + len(foods)] @ term_embedding
+            start += len(foods)
+            scores = fuse_scores([food["cosine_similarity"] for food in foods], gte_similarities, self.bge_weight)
+            order = np.argsort(-scores, kind='stable')
+            reranked.append([(foods[i], float(gte_similarities[i]), float(scores[i])) for i in order])
+        return reranked
+
+    def rerank(self, term, foods):
+        return self.rerank_batch([term], [foods])[0]
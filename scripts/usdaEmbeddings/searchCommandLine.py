@@ -1,163 +1,99 @@
+import argparse
 import asyncio
-from FlagEmbedding import FlagModel
+import json
+import sys
 import time
-from gte_embedding import getGteEmbedding
-import torch
-import asyncpg
-import os
-from urllib.parse import urlparse, urlunparse
-from dotenv import load_dotenv
-import re
-
-# Load environment variables
-load_dotenv(dotenv_path=".env.prod")
-DATABASE_URL = os.getenv("SUPABASE_PG_URI")
-parsed_url = urlparse(DATABASE_URL)
-# Convert ParseResult to a string
-url_string = parsed_url.geturl()
-
-# Use regex to find the domain part of the URL
-pattern = r"(?<=@)(.*?)(?=:|$)"
-match = re.search(pattern, url_string)
-if match:
-    print(match.group(0))  # This will print the domain part of the URL
-
-sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
-
-model = FlagModel('BAAI/bge-base-en-v1.5', use_fp16=False)
-model_large = FlagModel('BAAI/bge-large-en-v1.5', use_fp16=False)
-
-def construct_sentence(item):
-    description = item.get('description', '')  # Using 'description'
-    brand = item.get('brand', '')
-    owner = item.get('owner', '')
-
-    components = [description]
-    if brand:
-        components.append(brand)
-    if owner:
-        components.append(owner)
-
-    # Join components together
-    return " - ".join(filter(None, components))
-
-def construct_sentence_results(item):
-    foodName = item.get('foodName', '') 
-    foodBrand = item.get('foodBrand', '')
-    brandOwner = item.get('brandOwner', '')
-
-    components = [foodName]
-    if foodBrand:
-        components.append(foodBrand)
-    if brandOwner:
-        components.append(brandOwner)
-
-    # Join components together
-    return " - ".join(filter(None, components))
-
-
-    
-def vector_to_sql(value):
-    return '[' + ','.join(map(str, value)) + ']'
-    
-async def search_similar_foods(conn, sentence):
-    embedding_id = await fetch_or_save_embedding(conn, sentence)
-    isBranded = bool(sentence.split()[-1])  # Just a placeholder, replace with your logic for determining branded foods.
-    whereCondition = ("'foodBrand' IS NOT NULL" if isBranded else "'foodBrand' IS NULL OR 'foodBrand' = ''")
-
-    similar_foods = await conn.fetch(
-        """
-        SELECT 
-            "fdcId", 
-            "foodName", 
-            "foodBrand", 
-            "bgeBaseEmbedding"::text, 
-            1 - ("bgeBaseEmbedding" <=> (SELECT "bgeBaseEmbedding" FROM "foodEmbeddingCache" WHERE id = $1)) AS cosine_similarity 
-        FROM 
-            "UsdaFoodItemEmbedding" 
-        WHERE 
-            """ + whereCondition + """
-            AND "bgeBaseEmbedding" is not null
-        ORDER BY 
-        ("bgeBaseEmbedding" <#> (SELECT "bgeBaseEmbedding" FROM "foodEmbeddingCache" WHERE id = $1)) ASC
-        LIMIT 20
-        """, embedding_id
-    )
-    return similar_foods
-
-
-async def get_embedding(sentence, model_name='BAAI/bge-base-en-v1.5'):
-    model = FlagModel(model_name, use_fp16=False)
-    return model.encode([sentence])[0].tolist()
-
-def array_to_pg_vector(arr):
-    """Convert a Python list to PostgreSQL vector format."""
-    return "{" + ",".join(map(str, arr)) + "}"
-
-async def fetch_or_save_embedding(conn, sentence):
-    # Fetch from cache
-    cached_embedding = await conn.fetchrow(
-        'SELECT id FROM "foodEmbeddingCache" WHERE "textToEmbed" = $1 AND "bgeBaseEmbedding" IS NOT NULL',
-        sentence
-    )
-    if cached_embedding:
-        return cached_embedding["id"]
-    else:
-        new_embedding_array = await get_embedding(sentence)
-        
-        # Insert or update the embedding
-        result = await conn.fetchrow("""
-            INSERT INTO "foodEmbeddingCache" ("textToEmbed", "bgeBaseEmbedding")
-            VALUES ($1, $2::float8[])
-            ON CONFLICT ("textToEmbed")
-            DO UPDATE SET "bgeBaseEmbedding" = EXCLUDED."bgeBaseEmbedding"
-            WHERE "foodEmbeddingCache"."bgeBaseEmbedding" IS NULL
-            RETURNING id
-        """, sentence, new_embedding_array)
-
-        return result["id"]
-
-
-async def main():
-    # Establish database connection
-    conn = await asyncpg.connect(sanitized_url)
-
+from search_client import SearchClient
+from search_service import construct_sentence_results
+
+# Interactive client for searchServer.py, which keeps the models and database pool
+# warm. Start the server first: python searchServer.py
+# With --batch, terms are read one per line from a file (or - for stdin), searched in
+# chunks with the server's set-based batch search and written out as JSON lines.
+
+DEFAULT_BATCH_SIZE = 256
+
+
+def read_terms(path):
+    file = sys.stdin if path == "-" else open(path, 'r')
+    try:
+        for line in file:
+            term = line.strip()
+            if term:
+                yield term
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def run_batch(client, args):
+    output = sys.stdout if args.output in (None, "-") else open(args.output, 'w')
+    terms_done = 0
+    start_time = time.time()
+    try:
+        for terms in chunked(read_terms(args.batch), args.batch_size):
+            response = await client.search_batch(terms, args.k, rerank=args.rerank, kinds=args.kinds)
+            for result in response["results"]:
+                output.write(json.dumps(result) + "\n")
+            output.flush()
+            terms_done += len(terms)
+            elapsed = time.time() - start_time
+            print(f"{terms_done} terms, {terms_done / elapsed:.1f} terms/s "
+                  f"(last chunk {response['timings']['total_ms']:.0f} ms)", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+async def run_interactive(client, args):
     while True:
-        search_term = input("\nEnter a search term (or type 'exit' to quit): ")
-        
+        search_term = input("\nEnter a search term (or type 'exit' or 'stats'): ")
+
         if search_term.lower() == 'exit':
             break
-        
-        start_time = time.time()
-        similar_foods = await search_similar_foods(conn, search_term)  # Assumes this function remains unchanged
-        elapsed_time = time.time() - start_time
+        if search_term.lower() == 'stats':
+            print(await client.stats())
+            continue
 
-        # Generate GTE Embeddings for the search term
-        search_term_embedding_gte = getGteEmbedding([search_term])[0]
+        response = await client.search(search_term, args.k, args.kinds)
+        timings = response["timings"]
 
-        # Batch all food sentences
-        food_sentences = [construct_sentence_results(food) for food in similar_foods]
+        print(f"\nTop {len(response['results'])} similar foods (retrieval took {timings['retrieval_ms'] / 1000:.3f} s, "
+              f"rerank {timings['rerank_ms'] / 1000:.3f} s, total {timings['total_ms'] / 1000:.3f} s):")
 
-        # Generate GTE Embeddings for all food items in a single batch
-        food_embeddings_gte = getGteEmbedding(food_sentences)
+        for i, food in enumerate(response["results"]):
+            print(f"{i+1}. {food['fdcId']} {construct_sentence_results(food)} (BGE Similarity: {food['bgeSimilarity']:.3f}, GTE Similarity: {food['gteSimilarity']:.3f}, Score: {food['score']:.3f})")
 
-        # Calculate GTE similarity
-        gte_similarities = torch.nn.functional.cosine_similarity(
-            search_term_embedding_gte.unsqueeze(0),
-            food_embeddings_gte
-        ).tolist()
-        
-
-        print(f"\nTop 20 similar foods (search took {elapsed_time:.3f} s):")
-        
-        for i, (food, gte_similarity) in enumerate(zip(similar_foods, gte_similarities)):
-            print(f"{i+1}. {food['fdcId']} {construct_sentence_results(food)} (BGE Similarity: {food['cosine_similarity']:.3f}, GTE Similarity: {gte_similarity:.3f})")
-
-        #for i, (food, gte_similarity) in enumerate(zip(similar_foods, gte_similarities)):
-        #    print(f"{i+1}. {food['fdcId']} {food['foodName']} (Brand: {food.get('foodBrand', 'N/A')}, Owner: {food.get('brandOwner', 'N/A')}, BGE Similarity: {food['cosine_similarity']:.3f}, GTE Similarity: {gte_similarity:.3f})")
-
-
-    await conn.close()
+async def main():
+    parser = argparse.ArgumentParser(description="Search USDA foods through the search server.")
+    parser.add_argument("--socket", help="Unix socket of the search server.")
+    parser.add_argument("--host", help="Connect over TCP instead of a Unix socket.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-k", type=int, default=20, help="Number of results.")
+    parser.add_argument("--batch", metavar="FILE", help="Search every line of FILE (- for stdin) and print JSON lines.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Terms sent to the server per request.")
+    parser.add_argument("--output", help="Write batch results here instead of stdout.")
+    parser.add_argument("--rerank", action="store_true", help="Rerank batch results by the fused bge/GTE score.")
+    parser.add_argument("--kinds", help="Only search these food kinds: branded, generic or branded,generic (merged).")
+    args = parser.parse_args()
+
+    client = await SearchClient.connect(socket_path=args.socket, host=args.host, port=args.port)
+
+    try:
+        if args.batch:
+            await run_batch(client, args)
+        else:
+            await run_interactive(client, args)
+    finally:
+        await client.close()
 
 
 if __name__ == '__main__':
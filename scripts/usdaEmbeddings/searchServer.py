@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import os
+from urllib.parse import urlparse, urlunparse
+import asyncpg
+from dotenv import load_dotenv
+from encoders import get_encoder
+from exact_search import open_exact_index
+from hybrid_search import DEFAULT_CANDIDATES
+from local_index import open_local_index
+from pgvector_codec import register_vector_codec
+from pipeline_metrics import open_metrics
+from rerank import DEFAULT_BGE_WEIGHT
+from search_client import STREAM_LIMIT, default_socket_path
+from quantized_search import DEFAULT_RESCORE_CANDIDATES, QUANTIZATIONS
+from query_cache import DEFAULT_MAX_SIZE
+from search_service import BGE_MODEL_NAME, DEFAULT_K, GTE_MODEL_NAME, SearchService
+
+# Long-lived food search service. The bge and GTE models are loaded and the asyncpg
+# pool opened once at startup, so a query only pays for inference on a cache miss, and
+# recent query embeddings are held in memory, so a repeated query is one round trip.
+# Speaks one JSON object per line over a Unix socket or TCP:
+#   {"op": "search", "term": "greek yogurt", "k": 20}  ->  {"results": [...], "timings": {...}}
+#   {"op": "search_batch", "terms": [...], "k": 20, "rerank": false}
+#                                                      ->  {"results": [{"term", "results"}, ...], "timings": {...}}
+#   {"op": "stats"}                                    ->  {"stats": "<per-stage latency table>"}
+# Both search ops take an optional "kinds": "branded", "generic" or ["branded", "generic"].
+# searchCommandLine.py is the interactive client.
+
+# Load environment variables
+load_dotenv(dotenv_path=".env.prod")
+DATABASE_URL = os.getenv("SUPABASE_PG_URI")
+
+
+async def handle_client(service, metrics, reader, writer):
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # Longer than STREAM_LIMIT; the reader has discarded it
+                writer.write(json.dumps({"error": f"Request line exceeds {STREAM_LIMIT} bytes"}).encode() + b"\n")
+                await writer.drain()
+                continue
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                op = request.get("op", "search")
+                if op == "search":
+                    response = await service.search(request["term"], int(request.get("k", DEFAULT_K)),
+                                                    request.get("kinds"))
+                elif op == "search_batch":
+                    response = await service.search_batch(request["terms"], int(request.get("k", DEFAULT_K)),
+                                                          bool(request.get("rerank", False)), request.get("kinds"))
+                elif op == "stats":
+                    response = {"stats": metrics.summary()}
+                else:
+                    response = {"error": f"Unknown op: {op}"}
+            except Exception as e:
+                response = {"error": repr(e)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def start_search_server(service, metrics, socket_path=None, host=None, port=None):
+    def client_connected(reader, writer):
+        return handle_client(service, metrics, reader, writer)
+
+    if host:
+        server = await asyncio.start_server(client_connected, host, port, limit=STREAM_LIMIT)
+        print(f"Listening on {host}:{port}")
+    else:
+        socket_path = socket_path or default_socket_path()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(client_connected, socket_path, limit=STREAM_LIMIT)
+        print(f"Listening on {socket_path}")
+    return server
+
+async def main():
+    parser = argparse.ArgumentParser(description="Serve food searches with warm models and a database pool.")
+    parser.add_argument("--socket", default=None, help=f"Unix socket path (default: $SEARCH_SOCKET or {default_socket_path()}).")
+    parser.add_argument("--host", help="Listen on TCP instead of a Unix socket.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--bge-weight", type=float, default=DEFAULT_BGE_WEIGHT,
+                        help="Share of the rerank score from bge similarity; the rest is GTE.")
+    parser.add_argument("--local-index", nargs="?", const="hnsw", choices=["hnsw", "exact"],
+                        help="Answer top-k from a local index (see buildLocalIndex.py) instead of pgvector: "
+                             "the HNSW graph (default) or the exact brute-force matrix.")
+    parser.add_argument("--ef-search", type=int,
+                        help="hnsw.ef_search for pgvector searches (default: the server's, 40); higher is slower "
+                             "with better recall.")
+    parser.add_argument("--hybrid", action="store_true",
+                        help="Take candidates from the trigram index on name/brand/owner and fuse lexical and "
+                             "bge ranks, falling back to the vector index when few rows match lexically.")
+    parser.add_argument("--hybrid-candidates", type=int, default=DEFAULT_CANDIDATES,
+                        help="Lexical candidates scored per query with --hybrid.")
+    parser.add_argument("--quantization", choices=list(QUANTIZATIONS),
+                        help="Walk this compact index first and rescore its candidates at full precision.")
+    parser.add_argument("--rescore-candidates", type=int, default=DEFAULT_RESCORE_CANDIDATES,
+                        help="Candidates taken from the --quantization index per query.")
+    parser.add_argument("--query-cache-size", type=int, default=DEFAULT_MAX_SIZE,
+                        help="Query embeddings kept in the in-process LRU.")
+    parser.add_argument("--warm-query-cache", type=int, default=10000,
+                        help="Newest foodEmbeddingCache rows loaded into the LRU at startup (0 to skip).")
+    args = parser.parse_args()
+    if args.hybrid and args.local_index:
+        parser.error("--hybrid needs the database's trigram index and cannot be used with --local-index")
+
+    metrics = open_metrics("searchServer")
+    print("Loading models...")
+    bge_model = get_encoder(BGE_MODEL_NAME)
+    gte_model = get_encoder(GTE_MODEL_NAME)
+
+    parsed_url = urlparse(DATABASE_URL)
+    print(f"Connecting to {parsed_url.hostname}")
+    sanitized_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
+    pool = await asyncpg.create_pool(sanitized_url, min_size=args.pool_size, max_size=args.pool_size,
+                                     init=register_vector_codec)
+    local_index = None
+    if args.local_index == "hnsw":
+        local_index = open_local_index("bgeBaseEmbedding")
+    elif args.local_index == "exact":
+        local_index = open_exact_index("bgeBaseEmbedding")
+    service = SearchService(pool, bge_model, gte_model, metrics, local_index, args.bge_weight,
+                            args.query_cache_size, args.ef_search, args.hybrid, args.hybrid_candidates,
+                            args.quantization, args.rescore_candidates)
+    if args.warm_query_cache and not local_index:
+        print(f"Loaded {await service.warm_query_cache(args.warm_query_cache)} query embeddings")
+
+    # Warm up both models so the first real query does not pay for lazy initialization
+    await service.run_model(bge_model.encode, ["warm up"])
+    await service.rerank_batch(["warm up"], [[]])
+
+    server = await start_search_server(service, metrics, args.socket, args.host, args.port)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+        metrics.close()
+        print(metrics.summary())
+        await pool.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
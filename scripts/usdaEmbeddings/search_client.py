@@ -0,0 +1,60 @@
+# search_client.py
+
+import asyncio
+import json
+import os
+
+# Where the search server listens unless SEARCH_SOCKET or a TCP address says otherwise
+DEFAULT_SOCKET = "/tmp/amino_search.sock"
+# Longest line either side will read. A search_batch reply is one line (about 1 MB for
+# 256 terms at k=20), far past asyncio's 64 KiB default
+STREAM_LIMIT = 64 * 1024 * 1024
+
+
+def default_socket_path():
+    return os.getenv("SEARCH_SOCKET", DEFAULT_SOCKET)
+
+
+class SearchClient:
+    """
+    Client for searchServer.py. Requests and responses are one JSON object per line
+    over a Unix socket (default) or TCP, so one connection serves many queries.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, socket_path=None, host=None, port=None):
+        if host:
+            reader, writer = await asyncio.open_connection(host, port, limit=STREAM_LIMIT)
+        else:
+            reader, writer = await asyncio.open_unix_connection(socket_path or default_socket_path(),
+                                                                limit=STREAM_LIMIT)
+        return cls(reader, writer)
+
+    async def request(self, payload):
+        self.writer.write(json.dumps(payload).encode() + b"\n")
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Search server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Search server error: {response['error']}")
+        return response
+
+    async def search(self, term, k=20, kinds=None):
+        return await self.request({"op": "search", "term": term, "k": k, "kinds": kinds})
+
+    async def search_batch(self, terms, k=20, rerank=False, kinds=None):
+        return await self.request({"op": "search_batch", "terms": list(terms), "k": k, "rerank": rerank,
+                                   "kinds": kinds})
+
+    async def stats(self):
+        return (await self.request({"op": "stats"}))["stats"]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
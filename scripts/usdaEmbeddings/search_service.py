@@ -0,0 +1,357 @@
+# search_service.py
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from embedding_store import CachedEncoder, open_embedding_store
+from filtered_search import kind_condition, merge_results, parse_kinds, search_kinds, set_ef_search
+from hybrid_search import DEFAULT_CANDIDATES, hybrid_search
+from pipeline_metrics import NULL_METRICS
+from quantized_search import DEFAULT_RESCORE_CANDIDATES, check_quantization, quantized_search
+from query_cache import DEFAULT_MAX_SIZE, QueryEmbeddingCache
+from rerank import DEFAULT_BGE_WEIGHT, GteReranker
+
+BGE_MODEL_NAME = 'BAAI/bge-base-en-v1.5'
+BGE_EMBEDDING_DIM = 768
+GTE_MODEL_NAME = 'thenlper/gte-base'
+GTE_EMBEDDING_DIM = 768
+
+DEFAULT_K = 20
+
+CACHE_INSERT_SQL = """
+    INSERT INTO "foodEmbeddingCache" ("textToEmbed", "bgeBaseEmbedding")
+    VALUES ($1, $2)
+    ON CONFLICT ("textToEmbed")
+    DO UPDATE SET "bgeBaseEmbedding" = EXCLUDED."bgeBaseEmbedding"
+    WHERE "foodEmbeddingCache"."bgeBaseEmbedding" IS NULL
+    RETURNING id
+"""
+
+# Top-k for many cached query embeddings in one statement: each term joins its cache
+# row and a LATERAL subquery walks the HNSW index once per term. {condition} restricts
+# it to one food kind, and so to that kind's partial index.
+BATCH_SEARCH_SQL = """
+    SELECT q.ord, f."fdcId", f."foodName", f."foodBrand", f."brandOwner", f.cosine_similarity
+    FROM unnest($1::text[]) WITH ORDINALITY AS q(term, ord)
+    JOIN "foodEmbeddingCache" c ON c."textToEmbed" = q.term
+    CROSS JOIN LATERAL (
+        SELECT
+            e."fdcId",
+            e."foodName",
+            e."foodBrand",
+            e."brandOwner",
+            1 - (e."bgeBaseEmbedding" <=> c."bgeBaseEmbedding") AS cosine_similarity
+        FROM "UsdaFoodItemEmbedding" e
+        WHERE {condition} AND e."bgeBaseEmbedding" IS NOT NULL
+        ORDER BY e."bgeBaseEmbedding" <#> c."bgeBaseEmbedding"
+        LIMIT $2
+    ) f
+    ORDER BY q.ord, f.cosine_similarity DESC
+"""
+
+
+def construct_sentence_results(item):
+    foodName = item.get('foodName', '')
+    foodBrand = item.get('foodBrand', '')
+    brandOwner = item.get('brandOwner', '')
+
+    components = [foodName]
+    if foodBrand:
+        components.append(foodBrand)
+    if brandOwner:
+        components.append(brandOwner)
+
+    # Join components together
+    return " - ".join(filter(None, components))
+
+def format_result(food, gte_similarity=None, score=None):
+    result = {
+        "fdcId": food["fdcId"],
+        "foodName": food["foodName"],
+        "foodBrand": food["foodBrand"],
+        "brandOwner": food["brandOwner"],
+        "bgeSimilarity": float(food["cosine_similarity"]),
+    }
+    if gte_similarity is not None:
+        result["gteSimilarity"] = float(gte_similarity)
+    if score is not None:
+        result["score"] = float(score)
+    return result
+
+
+class SearchService:
+    """
+    Food search with everything expensive held for the life of the process: the bge
+    query encoder and its local embedding store, the GTE reranker and its candidate
+    store, and an asyncpg pool whose connections already have the vector codec
+    registered. Model calls run on one dedicated thread so they never block the event
+    loop serving other requests. Query embeddings already in "foodEmbeddingCache" are
+    also kept in an in-process LRU, so a hot query is one database round trip. Searches
+    can be restricted to branded or generic foods (see filtered_search), and with
+    `hybrid` candidates come from the trigram index first (see hybrid_search). With a
+    `quantization`, unfiltered searches walk a compact index and rescore (see
+    quantized_search). With a
+    local_index.LocalAnnIndex or exact_search.ExactIndex, top-k comes from that
+    in-process index instead of pgvector.
+    """
+
+    def __init__(self, pool, bge_model, gte_model, metrics=NULL_METRICS, local_index=None,
+                 bge_weight=DEFAULT_BGE_WEIGHT, query_cache_size=DEFAULT_MAX_SIZE, ef_search=None,
+                 hybrid=False, hybrid_candidates=DEFAULT_CANDIDATES, quantization=None,
+                 rescore_candidates=DEFAULT_RESCORE_CANDIDATES):
+        if quantization:
+            check_quantization(quantization)
+        self.pool = pool
+        self.quantization = quantization
+        self.rescore_candidates = rescore_candidates
+        self.ef_search = ef_search
+        self.hybrid = hybrid
+        self.hybrid_candidates = hybrid_candidates
+        self.bge_model = bge_model
+        self.reranker = GteReranker(gte_model,
+                                    open_embedding_store(GTE_MODEL_NAME, GTE_EMBEDDING_DIM, gte_model.variant,
+                                                         namespace="fdcId"),
+                                    construct_sentence_results, bge_weight)
+        self.metrics = metrics
+        self.local_index = local_index
+        # Looks sentences up in the local store and only encodes the rest
+        self.encoder = CachedEncoder(bge_model, open_embedding_store(BGE_MODEL_NAME, BGE_EMBEDDING_DIM,
+                                                                     bge_model.variant))
+        self.query_cache = QueryEmbeddingCache(query_cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-model")
+
+    async def run_model(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def get_embeddings(self, sentences):
+        return await self.run_model(self.encoder.encode, sentences)
+
+    async def get_embedding(self, sentence):
+        return (await self.get_embeddings([sentence]))[0]
+
+    async def warm_query_cache(self, limit=None):
+        async with self.pool.acquire() as conn:
+            return await self.query_cache.warm(conn, limit)
+
+    async def fetch_or_save_embedding(self, conn, sentence):
+        """Returns (cache row id, embedding) for `sentence`, adding the row if it is new."""
+        cached = self.query_cache.get(sentence)
+        if cached:
+            self.metrics.count("query_cache_hits")
+            return cached
+        self.metrics.count("query_cache_misses")
+
+        # Fetch from cache
+        cached_embedding = await conn.fetchrow(
+            'SELECT id, "bgeBaseEmbedding" FROM "foodEmbeddingCache" WHERE "textToEmbed" = $1 AND "bgeBaseEmbedding" IS NOT NULL',
+            sentence
+        )
+        if cached_embedding:
+            self.query_cache.put(sentence, cached_embedding["id"], cached_embedding["bgeBaseEmbedding"])
+            return cached_embedding["id"], cached_embedding["bgeBaseEmbedding"]
+
+        with self.metrics.timer("embed"):
+            new_embedding_array = await self.get_embedding(sentence)
+
+        # Insert or update the embedding
+        result = await conn.fetchrow(CACHE_INSERT_SQL, sentence, new_embedding_array)
+        # A concurrent insert of the same text wins the conflict and returns no row
+        row_id = result["id"] if result else None
+        self.query_cache.put(sentence, row_id, new_embedding_array)
+
+        return row_id, new_embedding_array
+
+    async def resolve_embeddings(self, conn, sentences):
+        """
+        Makes sure every sentence has a "foodEmbeddingCache" row: the in-process cache
+        and then one query find the cached ones, the rest are encoded in one batched call
+        and inserted together. Returns {sentence: embedding}.
+        """
+        embeddings = {}
+        uncached = []
+        for sentence in sentences:
+            cached = self.query_cache.get(sentence)
+            if cached:
+                embeddings[sentence] = cached[1]
+            else:
+                uncached.append(sentence)
+        self.metrics.count("query_cache_hits", len(embeddings))
+        self.metrics.count("query_cache_misses", len(uncached))
+        if not uncached:
+            return embeddings
+
+        rows = await conn.fetch(
+            'SELECT id, "textToEmbed", "bgeBaseEmbedding" FROM "foodEmbeddingCache" '
+            'WHERE "textToEmbed" = ANY($1::text[]) AND "bgeBaseEmbedding" IS NOT NULL',
+            uncached
+        )
+        for row in rows:
+            embeddings[row["textToEmbed"]] = row["bgeBaseEmbedding"]
+            self.query_cache.put(row["textToEmbed"], row["id"], row["bgeBaseEmbedding"])
+        missing = [sentence for sentence in uncached if sentence not in embeddings]
+        if missing:
+            with self.metrics.timer("embed", sentences=len(missing)):
+                new_embeddings = await self.get_embeddings(missing)
+            await conn.executemany(CACHE_INSERT_SQL, list(zip(missing, new_embeddings)))
+            for sentence, embedding in zip(missing, new_embeddings):
+                embeddings[sentence] = embedding
+                # executemany does not return the new ids
+                self.query_cache.put(sentence, None, embedding)
+        return embeddings
+
+    async def search_similar_foods(self, conn, sentence, k=DEFAULT_K, kinds=None):
+        with self.metrics.timer("resolve_embedding"):
+            _, embedding = await self.fetch_or_save_embedding(conn, sentence)
+
+        # The query vector is bound directly, so the database never looks it up again
+        if self.hybrid:
+            with self.metrics.timer("hybrid_search"):
+                return await hybrid_search(conn, sentence, embedding, k, kinds, self.hybrid_candidates,
+                                           self.ef_search, self.metrics)
+        with self.metrics.timer("vector_search"):
+            # The quantized indexes cover all foods; kind filters use the partial indexes
+            if self.quantization and kinds is None:
+                return await quantized_search(conn, embedding, k, self.quantization, self.rescore_candidates,
+                                              self.ef_search)
+            return await search_kinds(conn, embedding, k, kinds, self.ef_search)
+
+    async def vector_search_batch(self, conn, terms, k, kinds):
+        with self.metrics.timer("vector_search", queries=len(terms)):
+            if self.ef_search:
+                await set_ef_search(conn, self.ef_search, k)
+            rows_per_kind = [await conn.fetch(BATCH_SEARCH_SQL.format(condition=kind_condition(kind)), terms, k)
+                             for kind in (kinds or [None])]
+        foods_by_term = {term: [] for term in terms}
+        for rows in rows_per_kind:
+            for row in rows:
+                foods_by_term[terms[row["ord"] - 1]].append(row)
+        if len(rows_per_kind) > 1:
+            foods_by_term = {term: merge_results([foods], k) for term, foods in foods_by_term.items()}
+        return foods_by_term
+
+    async def hybrid_search_batch(self, conn, terms, embeddings, k, kinds):
+        # One statement per term, but each only scores its own lexical candidates
+        with self.metrics.timer("hybrid_search", queries=len(terms)):
+            return {
+                term: await hybrid_search(conn, term, embeddings[term], k, kinds, self.hybrid_candidates,
+                                          self.ef_search, self.metrics)
+                for term in terms
+            }
+
+    async def quantized_search_batch(self, conn, terms, embeddings, k):
+        with self.metrics.timer("vector_search", queries=len(terms)):
+            return {
+                term: await quantized_search(conn, embeddings[term], k, self.quantization, self.rescore_candidates,
+                                             self.ef_search)
+                for term in terms
+            }
+
+    def check_local_kinds(self, kinds):
+        if kinds is not None:
+            raise ValueError("Food kind filters need the pgvector indexes; the local index is unfiltered")
+
+    async def search_local_index(self, sentence, k=DEFAULT_K):
+        with self.metrics.timer("embed"):
+            embedding = await self.get_embedding(sentence)
+        with self.metrics.timer("local_search"):
+            # Picks up rows the USDA sync added since the graph was opened
+            self.local_index.refresh()
+            matches = self.local_index.search([embedding], k)[0]
+        return [{**match, "cosine_similarity": match["similarity"]} for match in matches]
+
+    async def rerank_batch(self, terms, foods_per_term):
+        with self.metrics.timer("rerank", queries=len(terms)):
+            return await self.run_model(self.reranker.rerank_batch, terms, foods_per_term)
+
+    async def search(self, term, k=DEFAULT_K, kinds=None):
+        """
+        Returns the top `k` foods for `term` retrieved by bge similarity and reranked by
+        the fused bge/GTE score, plus the milliseconds spent retrieving and reranking.
+        `kinds` ("branded", "generic" or both) restricts the candidates.
+        """
+        start_time = time.perf_counter()
+        kinds = parse_kinds(kinds)
+        if self.local_index:
+            self.check_local_kinds(kinds)
+            similar_foods = await self.search_local_index(term, k)
+        else:
+            async with self.pool.acquire() as conn:
+                similar_foods = await self.search_similar_foods(conn, term, k, kinds)
+        retrieval_time = time.perf_counter()
+        self.metrics.observe("retrieval", retrieval_time - start_time)
+
+        reranked = (await self.rerank_batch([term], [similar_foods]))[0]
+        end_time = time.perf_counter()
+        self.metrics.observe("search", end_time - start_time)
+
+        results = [format_result(food, gte_similarity, score) for food, gte_similarity, score in reranked]
+        return {
+            "results": results,
+            "timings": {
+                "retrieval_ms": (retrieval_time - start_time) * 1000,
+                "rerank_ms": (end_time - retrieval_time) * 1000,
+                "total_ms": (end_time - start_time) * 1000,
+            },
+        }
+
+    async def search_batch(self, terms, k=DEFAULT_K, rerank=False, kinds=None):
+        """
+        Top `k` foods for each of many terms. Embeddings are resolved in bulk and the
+        lookups run as one set-based query (or one batched local index search), so the
+        cost per term is a small fraction of search(). With `rerank` each term's results
+        are reranked by the fused bge/GTE score as in search(), and `kinds` filters as
+        in search(). Returns one {"term", "results"} per input term, in order, plus
+        stage timings.
+        """
+        start_time = time.perf_counter()
+        unique_terms = list(dict.fromkeys(terms))
+        kinds = parse_kinds(kinds)
+        if self.local_index:
+            self.check_local_kinds(kinds)
+            with self.metrics.timer("embed", sentences=len(unique_terms)):
+                embeddings = await self.get_embeddings(unique_terms)
+            embed_time = time.perf_counter()
+            with self.metrics.timer("local_search", queries=len(unique_terms)):
+                self.local_index.refresh()
+                matches = self.local_index.search(embeddings, k)
+            foods_by_term = {
+                term: [{**match, "cosine_similarity": match["similarity"]} for match in term_matches]
+                for term, term_matches in zip(unique_terms, matches)
+            }
+        else:
+            async with self.pool.acquire() as conn:
+                with self.metrics.timer("resolve_embedding", sentences=len(unique_terms)):
+                    embeddings = await self.resolve_embeddings(conn, unique_terms)
+                embed_time = time.perf_counter()
+                if self.hybrid:
+                    foods_by_term = await self.hybrid_search_batch(conn, unique_terms, embeddings, k, kinds)
+                elif self.quantization and kinds is None:
+                    foods_by_term = await self.quantized_search_batch(conn, unique_terms, embeddings, k)
+                else:
+                    foods_by_term = await self.vector_search_batch(conn, unique_terms, k, kinds)
+        retrieval_time = time.perf_counter()
+        self.metrics.observe("retrieval", retrieval_time - start_time, queries=len(unique_terms))
+
+        if rerank:
+            reranked = await self.rerank_batch(unique_terms, [foods_by_term[term] for term in unique_terms])
+            results_by_term = {
+                term: [format_result(food, gte_similarity, score) for food, gte_similarity, score in term_reranked]
+                for term, term_reranked in zip(unique_terms, reranked)
+            }
+        else:
+            results_by_term = {term: [format_result(food) for food in foods_by_term[term]] for term in unique_terms}
+        end_time = time.perf_counter()
+        self.metrics.observe("search_batch", end_time - start_time, queries=len(terms))
+
+        return {
+            "results": [{"term": term, "results": results_by_term[term]} for term in terms],
+            "timings": {
+                "embed_ms": (embed_time - start_time) * 1000,
+                "retrieval_ms": (retrieval_time - embed_time) * 1000,
+                "rerank_ms": (end_time - retrieval_time) * 1000,
+                "total_ms": (end_time - start_time) * 1000,
+            },
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import tempfile
+from pipeline_metrics import NULL_METRICS
+from searchCommandLine import DEFAULT_BATCH_SIZE
+from searchServer import start_search_server
+from search_client import SearchClient
+from search_service import DEFAULT_K
+
+
+class FakeService:
+    """Answers like SearchService with k long results per term, without models or a database."""
+
+    async def search(self, term, k, kinds=None):
+        return {"results": self.results(term, k), "timings": {}}
+
+    async def search_batch(self, terms, k, rerank=False, kinds=None):
+        return {"results": [{"term": term, "results": self.results(term, k)} for term in terms], "timings": {}}
+
+    def results(self, term, k):
+        return [{"fdcId": 1000000 + i, "foodName": f"{term} {'x' * 60}", "foodBrand": "Great Value",
+                 "brandOwner": "Walmart Inc.", "bgeSimilarity": 0.5} for i in range(k)]
+
+
+async def round_trip(terms, k):
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "search.sock")
+        server = await start_search_server(FakeService(), NULL_METRICS, socket_path)
+        async with server:
+            client = await SearchClient.connect(socket_path=socket_path)
+            try:
+                return await client.search_batch(terms, k)
+            finally:
+                await client.close()
+
+
+def test_search_batch_round_trip_at_cli_defaults():
+    # One reply line here is about 1 MB, past asyncio's 64 KiB default stream limit
+    terms = [f"food term number {i} {'y' * 40}" for i in range(DEFAULT_BATCH_SIZE)]
+    response = asyncio.run(round_trip(terms, DEFAULT_K))
+    assert [entry["term"] for entry in response["results"]] == terms
+    assert all(len(entry["results"]) == DEFAULT_K for entry in response["results"])
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import zipfile
+import pytest
+from pipeline_metrics import NULL_METRICS
+from usda_bulk import DEFAULT_DATA_TYPES, BulkRelease, apply_release, stage_release
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "usda_bulk_release.zip")
+DEDUPE_INDEX_MIGRATION = os.path.join(os.path.dirname(__file__), "..", "..", "supabase", "migrations",
+                                      "20261018140100_usda_dedupe_key_index.sql")
+
+# apply_release runs against a real Postgres (with pgvector available), in a scratch
+# schema that is dropped afterwards
+TEST_DSN = os.getenv("USDA_TEST_DSN")
+requires_postgres = pytest.mark.skipif(not TEST_DSN, reason="set USDA_TEST_DSN to a scratch Postgres")
+TEST_SCHEMA = "usda_bulk_test"
+
+EXPECTED = [
+    (1001, "Peanut Butter Cups", "The Hershey Company", "The Hershey Company"),
+    (1002, "Greek Yogurt, Plain", None, None),
+    (1003, "Banana, Raw", None, None),
+    (1006, "Milk, Whole", None, None),
+]
+
+
+@pytest.fixture(params=["zip", "directory"])
+def release(request, tmp_path):
+    path = FIXTURE
+    if request.param == "directory":
+        with zipfile.ZipFile(FIXTURE) as archive:
+            archive.extractall(tmp_path)
+        path = str(tmp_path)
+    release = BulkRelease(path)
+    yield release
+    release.close()
+
+
+def test_iter_foods(release):
+    # sub_sample_food is not a synced data type and 1005 has no description
+    assert list(release.iter_foods()) == EXPECTED
+
+def test_iter_foods_data_types(release):
+    assert list(release.iter_foods(("foundation_food",))) == [(1003, "Banana, Raw", None, None)]
+
+def test_iter_foods_without_branded_skips_owner_join(release):
+    foods = list(release.iter_foods(tuple(t for t in DEFAULT_DATA_TYPES if t != "branded_food")))
+    assert [food[0] for food in foods] == [1003, 1006]
+
+def test_brand_owners(release):
+    assert release.brand_owners() == {1001: "The Hershey Company", 1002: None}
+
+def test_missing_member(release):
+    with pytest.raises(FileNotFoundError):
+        release.open_csv("nutrient.csv")
+
+
+async def apply_fixture(existing):
+    """
+    Seeds "UsdaFoodItemEmbedding" with `existing` (fdcId, foodName, foodBrand,
+    brandOwner) rows, each with an embedding, applies the fixture release and returns
+    ((inserted, changed), {fdcId: (foodName, foodBrand, brandOwner, has_embedding)}).
+    """
+    import asyncpg
+    conn = await asyncpg.connect(TEST_DSN)
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        await conn.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {TEST_SCHEMA}")
+        await conn.execute(f"SET search_path TO {TEST_SCHEMA}, public")
+        await conn.execute("""
+            CREATE TABLE "UsdaFoodItemEmbedding" (
+                "id" serial PRIMARY KEY,
+                "fdcId" integer NOT NULL UNIQUE,
+                "foodName" text NOT NULL,
+                "foodBrand" text,
+                "brandOwner" text,
+                "bgeBaseEmbedding" vector(3)
+            )
+        """)
+        with open(DEDUPE_INDEX_MIGRATION, 'r') as file:
+            await conn.execute(file.read().replace('public."UsdaFoodItemEmbedding"', '"UsdaFoodItemEmbedding"'))
+        await conn.executemany("""
+            INSERT INTO "UsdaFoodItemEmbedding" ("fdcId", "foodName", "foodBrand", "brandOwner", "bgeBaseEmbedding")
+            VALUES ($1, $2, $3, $4, '[1,0,0]')
+        """, existing)
+
+        release = BulkRelease(FIXTURE)
+        try:
+            async with conn.transaction():
+                await stage_release(conn, release.iter_foods(), NULL_METRICS)
+                counts = await apply_release(conn, ["bgeBaseEmbedding"], NULL_METRICS)
+        finally:
+            release.close()
+
+        rows = await conn.fetch("""
+            SELECT "fdcId", "foodName", "foodBrand", "brandOwner", "bgeBaseEmbedding" IS NOT NULL AS embedded
+            FROM "UsdaFoodItemEmbedding"
+        """)
+        return counts, {row["fdcId"]: (row["foodName"], row["foodBrand"], row["brandOwner"], row["embedded"])
+                        for row in rows}
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+        await conn.close()
+
+
+@requires_postgres
+def test_apply_release_unchanged_renamed_and_new():
+    counts, rows = asyncio.run(apply_fixture([
+        (1003, "banana, raw", None, None),   # same text up to case: left alone
+        (1006, "Milk, 2%", None, None),      # renamed in the release
+    ]))
+    assert counts == (2, 1)
+    assert rows == {
+        1001: ("Peanut Butter Cups", "The Hershey Company", "The Hershey Company", False),
+        1002: ("Greek Yogurt, Plain", None, None, False),
+        1003: ("banana, raw", None, None, True),
+        1006: ("Milk, Whole", None, None, False),
+    }
+
+@requires_postgres
+def test_apply_release_swapped_names():
+    counts, rows = asyncio.run(apply_fixture([
+        (1002, "Banana, Raw", None, None),
+        (1003, "Greek Yogurt, Plain", None, None),
+    ]))
+    assert counts == (2, 2)
+    assert rows[1002] == ("Greek Yogurt, Plain", None, None, False)
+    assert rows[1003] == ("Banana, Raw", None, None, False)
+
+@requires_postgres
+def test_apply_release_skips_rename_and_insert_onto_held_key():
+    # 900 is not in the release and keeps its key, so 1006 stays unrenamed and the new
+    # 1001 (same key as 901, case aside) is not inserted
+    counts, rows = asyncio.run(apply_fixture([
+        (900, "Milk, Whole", "", ""),
+        (901, "PEANUT BUTTER CUPS", "the hershey company", "THE HERSHEY COMPANY"),
+        (1006, "Milk, 2%", None, None),
+    ]))
+    assert counts == (2, 0)
+    assert rows[1006] == ("Milk, 2%", None, None, True)
+    assert 1001 not in rows
+    assert {1002, 1003} <= rows.keys()
@@ -1,14 +1,18 @@
 import asyncio
 import asyncpg
 import os
-import requests
 from urllib.parse import urlparse, urlunparse
 from dotenv import load_dotenv
-from FlagEmbedding import FlagModel
-import json
-import time
-from urllib.parse import urlencode
 from tqdm import tqdm  # Importing tqdm for progress bar
+from pgvector_codec import register_vector_codec
+from embedding_store import CachedEncoder, open_embedding_store
+from encoders import get_encoder
+from pipeline_metrics import open_metrics
+from exact_search import exact_index_exists, open_exact_index
+from local_index import local_index_exists, open_local_index
+from embedding_pipeline import run_pipeline
+from usda_client import UsdaClient, iter_in_order
+from usda_sync import cleanup_duplicates, dedupe_rows, ensure_sync_staging_table, find_existing, insert_rows
 
 
 # Load environment variables from .env file
@@ -22,38 +26,12 @@ load_dotenv(dotenv_path=".env.local")
 # Ensure you have this environment variable set
 USDA_API_KEY = os.getenv("USDA_API_KEY")
 
-model = FlagModel('BAAI/bge-base-en-v1.5', use_fp16=False)
+# Sentences already embedded by the backfill or an earlier sync come from the local store
+bge_encoder = get_encoder('BAAI/bge-base-en-v1.5')
+model = CachedEncoder(bge_encoder, open_embedding_store('BAAI/bge-base-en-v1.5', 768, bge_encoder.variant))
 columnNameEmbedding = 'bgeBaseEmbedding'
 
-import os
-
-CONFIG_FILE = "api_request_count.cfg"
-
-def read_config():
-    if not os.path.exists(CONFIG_FILE):
-        return {"count": 0, "timestamp": time.time()}
-    
-    with open(CONFIG_FILE, 'r') as file:
-        return json.load(file)
-
-def update_config(count):
-    with open(CONFIG_FILE, 'w') as file:
-        json.dump({"count": count, "timestamp": time.time()}, file)
-
-def check_rate_limit():
-    config = read_config()
-    current_count = config["count"]
-    last_timestamp = config["timestamp"]
-    
-    if time.time() - last_timestamp < 3600 and current_count > 500: # 3600 seconds = 1 hour
-        print(f"Approaching rate limit. Current count: {current_count}. Waiting to continue...")
-        time.sleep(3600 - (time.time() - last_timestamp))
-        update_config(0)
-    else:
-        update_config(current_count + 1)
-
-def vector_to_sql(value):
-    return '[' + ','.join(map(str, value)) + ']'
+metrics = open_metrics("updateUsdaData_search")
 
 def normalize_string(s: str) -> str:
     return ' '.join(word.capitalize() for word in s.split())
@@ -74,87 +52,9 @@ def construct_sentence(item):
     return " - ".join(filter(None, components))
 
 
-async def cleanup_duplicates(conn):
-    # DELETE rows that don't have the max fdcId for their foodName, foodBrand, and brandOwner combination
-    await conn.execute("""
-        WITH MaxFdcId AS (
-            SELECT 
-                "foodName", 
-                "foodBrand", 
-                "brandOwner", 
-                MAX("fdcId") as max_fdcId
-            FROM "UsdaFoodItemEmbedding"
-            GROUP BY "foodName", "foodBrand", "brandOwner"
-        )
-
-        DELETE FROM "UsdaFoodItemEmbedding" u
-        USING MaxFdcId m
-        WHERE 
-            u."foodName" = m."foodName" AND 
-            (u."foodBrand" = m."foodBrand" OR (u."foodBrand" IS NULL AND m."foodBrand" IS NULL)) AND 
-            (u."brandOwner" = m."brandOwner" OR (u."brandOwner" IS NULL AND m."brandOwner" IS NULL)) AND 
-            u."fdcId" != m.max_fdcId;
-    """)
-
-
-def get_max_fdcId_for_dataType(data_type):
-    SEARCH_API_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
-
-    params = {
-        "query": "",  # An empty query to retrieve results without filtering by keywords
-        "dataType": [data_type],
-        "pageSize": 1,
-        "sortBy": "fdcId",
-        "sortOrder": "desc",
-        "api_key": USDA_API_KEY
-    }
-
-    response = requests.get(SEARCH_API_URL, params=params)
-    data = response.json()
-
-    if data and "foods" in data and data["foods"]:
-        return data["foods"][0]["fdcId"]
-    else:
-        return None
-
-
-def retrieve_max_fdcIds():
-    data_types = ["Branded", "Foundation", "Survey (FNDDS)", "SR Legacy"]
-    max_ids = {}
-
-    for dt in data_types:
-        max_ids[dt] = get_max_fdcId_for_dataType(dt)
-
-    return max_ids
-
-
-def get_usda_data(fdcIds):
-    check_rate_limit()
-    API_URL = "https://api.nal.usda.gov/fdc/v1/foods"
-    
-    # Convert the list of integers to a comma-separated string
-    fdcIds_param = ','.join(map(str, fdcIds)) if isinstance(fdcIds, list) else str(fdcIds)
-    
-    requestParams = {
-        "fdcIds": fdcIds_param,
-        "format": "abridged",
-        "api_key": USDA_API_KEY
-    }
-
+async def get_usda_data(client, fdcIds):
     try:
-        # Construct the URL
-        parsed_url = urlparse(API_URL)
-        constructed_url = urlunparse((
-            parsed_url.scheme,
-            parsed_url.netloc,
-            parsed_url.path,
-            parsed_url.params,
-            urlencode(requestParams),
-            parsed_url.fragment
-        ))
-
-        response = requests.get(API_URL, params=requestParams)
-        response_data = response.json()
+        response_data = await client.get_foods(fdcIds if isinstance(fdcIds, list) else [fdcIds])
 
         if not response_data:
             return None
@@ -197,28 +97,28 @@ def generate_probe_points(low, high, max_points=100):
     step = (high - low) // (prob_amount - 1)
     return [low + step * i for i in range(prob_amount)]
 
-def combined_search(low, high, probe_count=10):
+async def combined_search(client, low, high, probe_count=10):
     if low > high:
         return low
 
     probe_points = generate_probe_points(low, high, max_points=probe_count)
-    usda_data = get_usda_data(probe_points)
+    usda_data = await get_usda_data(client, probe_points) or []
     existing_fdcIds = [item['fdcId'] for item in usda_data if item]
 
     # All points have data
     if len(existing_fdcIds) == len(probe_points):
-        return combined_search(probe_points[-1] + 1, high, probe_count)
+        return await combined_search(client, probe_points[-1] + 1, high, probe_count)
 
     # All points are missing
     elif len(existing_fdcIds) == 0:
-        return combined_search(low, probe_points[0] - 1, probe_count)
+        return await combined_search(client, low, probe_points[0] - 1, probe_count)
 
     # We're in the boundary region
     else:
         missing_points = list(set(probe_points) - set(existing_fdcIds))
         if missing_points:
             first_missing_point = missing_points[0]
-            return binary_search_missing_fdcId(probe_points[0], first_missing_point - 1)
+            return await binary_search_missing_fdcId(client, probe_points[0], first_missing_point - 1)
         else:
             # This is an edge case where all probed points exist, but not necessarily consecutively.
             # Return the lowest probed point.
@@ -226,28 +126,43 @@ def combined_search(low, high, probe_count=10):
 
     
 
-def binary_search_missing_fdcId(low, high):
+async def binary_search_missing_fdcId(client, low, high):
     if low > high:
         return low
 
     midpoint = (low + high) // 2
-    usda_data = get_usda_data([midpoint])
+    usda_data = await get_usda_data(client, [midpoint])
 
     if not usda_data:  # If midpoint is missing
-        return binary_search_missing_fdcId(low, midpoint - 1)
+        return await binary_search_missing_fdcId(client, low, midpoint - 1)
     else:
-        return binary_search_missing_fdcId(midpoint + 1, high)
+        return await binary_search_missing_fdcId(client, midpoint + 1, high)
 
-def find_next_missing_fdcId(max_fdcId_db, max_fdcId_usda):
-    return combined_search(max_fdcId_db, max_fdcId_usda)
+async def find_next_missing_fdcId(client, max_fdcId_db, max_fdcId_usda):
+    return await combined_search(client, max_fdcId_db, max_fdcId_usda)
 
 
 def get_progress_bar(total, description):
     return tqdm(total=total, desc=description, dynamic_ncols=True, leave=True)
 
-async def process_and_update(conn):
-    max_ids_from_usda = retrieve_max_fdcIds()
+async def process_and_update(conn, read_conn, client, local_indexes=()):
+    max_ids_from_usda = await client.max_fdc_ids()
     data_types = ["Branded", "Foundation", "Survey (FNDDS)", "SR Legacy"]
+    seen = set()
+
+    def encode_batch(rows):
+        with metrics.timer("encode", sentences=len(rows)):
+            return model.encode([row["sentence"] for row in rows])
+
+    async def write_batch(rows, embeddings):
+        with metrics.timer("write", rows=len(rows)):
+            inserted_rows = await insert_rows(conn, columnNameEmbedding, rows, embeddings)
+        metrics.count("rows_inserted", len(inserted_rows))
+
+        if local_indexes and inserted_rows:
+            with metrics.timer("local_index_add"):
+                for local_index in local_indexes:
+                    local_index.add([row for row, _ in inserted_rows], [embedding for _, embedding in inserted_rows])
 
     for data_type in data_types:
         max_fdcId_db = await find_starting_fdcId(conn)
@@ -258,37 +173,37 @@ async def process_and_update(conn):
             max_fdcId_db = max_fdcId_usda - 1
 
         # Locate the range of missing items
-        start_fdcId = find_next_missing_fdcId(max_fdcId_db, max_fdcId_usda)
+        start_fdcId = await find_next_missing_fdcId(client, max_fdcId_db, max_fdcId_usda)
         print(f"Starting from fdcId: {start_fdcId}")
 
         # Progress bar initialization
         progress_bar = get_progress_bar(max_fdcId_usda - start_fdcId + 1, f"Processing {data_type}")
 
-        # Fetch data in batches from USDA
+        # Pages are fetched ahead, checked against the table with one query each and fed to
+        # the pipeline, which encodes a page as one batch while the previous page is written
         BATCH_SIZE = 200
-        for current_fdcId in range(start_fdcId, max_fdcId_usda + 1, BATCH_SIZE):
-            # Get batch of data
-            end_fdcId = min(current_fdcId + BATCH_SIZE - 1, max_fdcId_usda)
-            fdcIds_range = list(range(current_fdcId, end_fdcId + 1))
-            usda_data_batch = get_usda_data(fdcIds_range)
-
-            if not usda_data_batch:
-                progress_bar.update(BATCH_SIZE)  # Update progress bar
-                continue
-
-            for item in usda_data_batch:
-                sentence = construct_sentence(item)
-                embedding = model.encode([sentence])[0]
-                description = normalize_string(item.get('description', ""))
-                brand = item.get('brand', None)
-                owner = item.get('owner', None)
-
-                existing_item = await conn.fetchrow("SELECT * FROM \"UsdaFoodItemEmbedding\" WHERE \"foodName\"=$1 AND \"foodBrand\"=$2 AND \"brandOwner\"=$3", description, brand, owner)
-
-                if not existing_item:
-                    await conn.execute(f"INSERT INTO \"UsdaFoodItemEmbedding\" (\"fdcId\", \"foodName\", \"foodBrand\", \"brandOwner\", \"{columnNameEmbedding}\") VALUES ($1, $2, $3, $4, $5)", item['fdcId'], description, brand, owner, vector_to_sql(embedding))
-
-            progress_bar.update(BATCH_SIZE)  # Update progress bar with the BATCH_SIZE
+        id_batches = (list(range(current_fdcId, min(current_fdcId + BATCH_SIZE - 1, max_fdcId_usda) + 1))
+                      for current_fdcId in range(start_fdcId, max_fdcId_usda + 1, BATCH_SIZE))
+
+        async def new_rows_per_page(id_batches, progress_bar):
+            async for fdcIds_range, usda_data_batch in iter_in_order(lambda ids: get_usda_data(client, ids),
+                                                                     id_batches, client.max_in_flight):
+                progress_bar.update(BATCH_SIZE)  # Update progress bar with the BATCH_SIZE
+                if not usda_data_batch:
+                    continue
+
+                rows = [{"fdcId": item['fdcId'], "foodName": normalize_string(item.get('description', "")),
+                         "foodBrand": item.get('brand', None), "brandOwner": item.get('owner', None),
+                         "sentence": construct_sentence(item)}
+                        for item in usda_data_batch]
+                # Repeats within the run would otherwise all pass the check before any is written
+                with metrics.timer("dedupe"):
+                    rows = dedupe_rows(rows, seen)
+                with metrics.timer("exists_check", rows=len(rows)):
+                    existing = await find_existing(read_conn, rows)
+                yield [row for i, row in enumerate(rows) if i not in existing]
+
+        await run_pipeline(new_rows_per_page(id_batches, progress_bar), encode_batch, write_batch)
         progress_bar.close()
                 
 async def main(cleanUp=False):
@@ -297,11 +212,29 @@ async def main(cleanUp=False):
     sanitized_url = urlunparse(
         (parsed_url.scheme, parsed_url.netloc, parsed_url.path, "", "", ""))
     conn = await asyncpg.connect(sanitized_url)
+    await register_vector_codec(conn)
+    await ensure_sync_staging_table(conn, columnNameEmbedding)
+    # Existence checks for upcoming pages run while the current page is written
+    read_conn = await asyncpg.connect(sanitized_url)
+    # Keep the local indexes current, if they have been exported with buildLocalIndex.py
+    local_indexes = []
+    if local_index_exists(columnNameEmbedding):
+        local_indexes.append(open_local_index(columnNameEmbedding, writable=True))
+    if exact_index_exists(columnNameEmbedding):
+        local_indexes.append(open_exact_index(columnNameEmbedding, writable=True))
+    client = UsdaClient(USDA_API_KEY, metrics=metrics)
     try:
         if cleanUp:
             await cleanup_duplicates(conn)
-        await process_and_update(conn)
+        await process_and_update(conn, read_conn, client, local_indexes)
     finally:
+        await client.close()
+        for local_index in local_indexes:
+            local_index.save()
+            local_index.close()
+        metrics.close()
+        print(metrics.summary())
+        await read_conn.close()
         await conn.close()
 
 asyncio.run(main(cleanUp=False))
@@ -0,0 +1,167 @@
+# usda_bulk.py
+
+import csv
+import io
+import os
+import zipfile
+from usda_sync import dedupe_key_sql
+
+# FoodData Central data_type values the API sync covers, as they appear in food.csv
+DEFAULT_DATA_TYPES = ("branded_food", "foundation_food", "survey_fndds_food", "sr_legacy_food")
+
+STAGING_TABLE = "usda_bulk_staging"
+RENAMES_TABLE = "usda_bulk_renames"
+COPY_CHUNK_ROWS = 50000
+
+
+def normalize_string(s: str) -> str:
+    # Same capitalization the API sync applies to descriptions
+    return ' '.join(word.capitalize() for word in s.split())
+
+
+class BulkRelease:
+    """
+    A FoodData Central CSV release, either the downloaded zip or the directory it
+    unpacks to. Members are found by file name wherever they sit in the archive, and
+    are read as text streams, so nothing is extracted to disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+
+    def open_csv(self, name):
+        if self.archive:
+            matches = [member for member in self.archive.namelist() if os.path.basename(member) == name]
+            if not matches:
+                raise FileNotFoundError(f"{name} not found in {self.path}")
+            return io.TextIOWrapper(self.archive.open(matches[0]), encoding='utf-8', newline='')
+        for root, _, files in os.walk(self.path):
+            if name in files:
+                return open(os.path.join(root, name), 'r', encoding='utf-8', newline='')
+        raise FileNotFoundError(f"{name} not found under {self.path}")
+
+    def brand_owners(self):
+        """fdc_id -> brand_owner for every branded food."""
+        with self.open_csv("branded_food.csv") as file:
+            return {int(row["fdc_id"]): row["brand_owner"] or None for row in csv.DictReader(file)}
+
+    def iter_foods(self, data_types=DEFAULT_DATA_TYPES):
+        """
+        Yields (fdcId, foodName, foodBrand, brandOwner) for the release's foods of
+        `data_types`, mapped the way updateUsdaData maps API responses: the description
+        capitalized per word, and brand and owner both set from brand_owner for branded
+        foods and None otherwise.
+        """
+        owners = self.brand_owners() if "branded_food" in data_types else {}
+        with self.open_csv("food.csv") as file:
+            for row in csv.DictReader(file):
+                if row["data_type"] not in data_types or not row["description"]:
+                    continue
+                fdc_id = int(row["fdc_id"])
+                owner = owners.get(fdc_id)
+                yield fdc_id, normalize_string(row["description"]), owner, owner
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def stage_release(conn, foods, metrics):
+    """COPYs the release into a temp staging table in chunks. Returns the row count."""
+    await conn.execute(f"""
+        CREATE TEMP TABLE {STAGING_TABLE} (
+            "fdcId" integer PRIMARY KEY,
+            "foodName" text NOT NULL,
+            "foodBrand" text,
+            "brandOwner" text
+        ) ON COMMIT DROP
+    """)
+    staged = 0
+    for chunk in chunked(foods, COPY_CHUNK_ROWS):
+        with metrics.timer("copy", rows=len(chunk)):
+            await conn.copy_records_to_table(STAGING_TABLE, records=chunk,
+                                             columns=["fdcId", "foodName", "foodBrand", "brandOwner"])
+        staged += len(chunk)
+    await conn.execute(f"ANALYZE {STAGING_TABLE}")
+    return staged
+
+async def apply_release(conn, embedding_columns, metrics):
+    """
+    Diffs the staged release against "UsdaFoodItemEmbedding" by fdcId and applies it,
+    inside the caller's transaction.
+
+    Rows whose name or owner changed (compared case-insensitively; foodBrand is not
+    compared since older rows were loaded with brand_name there) are renamed and their
+    embeddings cleared. A rename onto a dedupe key another row holds is skipped unless
+    that row is renamed away in the same release, so swaps and chains of renames go
+    through; among renames onto one key the highest fdcId wins. New fdcIds are
+    inserted without embeddings, keeping the highest fdcId among duplicates within the
+    release, as the API sync does; ON CONFLICT DO NOTHING skips those whose dedupe key
+    is already in the table. Cleared and new rows are what the embedding backfill
+    (buildEmbeddings.py) picks up next.
+
+    Returns (inserted, changed).
+    """
+    cleared = ", ".join(f'"{column}" = NULL' for column in embedding_columns)
+    key = dedupe_key_sql("s")
+    with metrics.timer("apply_changed"):
+        await conn.execute(f"""
+            CREATE TEMP TABLE {RENAMES_TABLE} ON COMMIT DROP AS
+            SELECT DISTINCT ON ({key}) s."fdcId", s."foodName", s."foodBrand", s."brandOwner", {key} AS key
+            FROM {STAGING_TABLE} AS s
+            JOIN "UsdaFoodItemEmbedding" AS c ON c."fdcId" = s."fdcId"
+            WHERE (LOWER(c."foodName"), LOWER(COALESCE(c."brandOwner", '')))
+                  IS DISTINCT FROM (LOWER(s."foodName"), LOWER(COALESCE(s."brandOwner", '')))
+            ORDER BY {key}, s."fdcId" DESC
+        """)
+        # A rename may only take a key from a row that is itself renamed away; dropping
+        # one rename can strand a key another depended on, so repeat until none go
+        while True:
+            status = await conn.execute(f"""
+                DELETE FROM {RENAMES_TABLE} AS r
+                WHERE EXISTS (
+                    SELECT 1 FROM "UsdaFoodItemEmbedding" d
+                    WHERE {dedupe_key_sql("d")} = r.key AND d."fdcId" <> r."fdcId"
+                      AND NOT EXISTS (SELECT 1 FROM {RENAMES_TABLE} m WHERE m."fdcId" = d."fdcId")
+                )
+            """)
+            if int(status.split()[-1]) == 0:
+                break
+        # The unique index is checked row by row, so a swap applied in one pass would
+        # hold a key twice midway: first park every renamed row on a key of its own
+        await conn.execute(f"""
+            UPDATE "UsdaFoodItemEmbedding" AS t
+            SET "foodName" = t."foodName" || E'\\x1e' || t."fdcId"
+            FROM {RENAMES_TABLE} AS r
+            WHERE t."fdcId" = r."fdcId"
+        """)
+        status = await conn.execute(f"""
+            UPDATE "UsdaFoodItemEmbedding" AS t
+            SET "foodName" = r."foodName", "foodBrand" = r."foodBrand", "brandOwner" = r."brandOwner", {cleared}
+            FROM {RENAMES_TABLE} AS r
+            WHERE t."fdcId" = r."fdcId"
+        """)
+    changed = int(status.split()[-1])
+
+    with metrics.timer("apply_new"):
+        status = await conn.execute(f"""
+            INSERT INTO "UsdaFoodItemEmbedding" ("fdcId", "foodName", "foodBrand", "brandOwner")
+            SELECT DISTINCT ON ({key}) s."fdcId", s."foodName", s."foodBrand", s."brandOwner"
+            FROM {STAGING_TABLE} AS s
+            WHERE NOT EXISTS (SELECT 1 FROM "UsdaFoodItemEmbedding" t WHERE t."fdcId" = s."fdcId")
+            ORDER BY {key}, s."fdcId" DESC
+            ON CONFLICT DO NOTHING
+        """)
+    inserted = int(status.split()[-1])
+    return inserted, changed
@@ -0,0 +1,153 @@
+# usda_client.py
+
+import asyncio
+import os
+import random
+import time
+import httpx
+from pipeline_metrics import NULL_METRICS
+
+API_URL = "https://api.nal.usda.gov/fdc/v1"
+
+# api.data.gov's default quota per key; USDA_REQUESTS_PER_HOUR overrides it
+DEFAULT_REQUESTS_PER_HOUR = 1000
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_RETRIES = 5
+# Seconds before the first retry; doubled on each further attempt
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+DATA_TYPES = ["Branded", "Foundation", "Survey (FNDDS)", "SR Legacy"]
+
+
+class TokenBucket:
+    """
+    In-memory token bucket: `rate` tokens per second, holding at most `capacity`.
+    acquire() waits without blocking the event loop until a token is available, so
+    over any window of T seconds at most capacity + rate * T requests start.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class UsdaClient:
+    """
+    Async FoodData Central client. One httpx.AsyncClient keeps connections alive across
+    calls, a semaphore bounds the requests in flight, and a token bucket sized to the
+    hourly quota spaces them out, so many fdcId batches can be fetched concurrently
+    without tripping the limit. Rate-limit responses, server errors and transport
+    failures are retried with exponential backoff and jitter, honouring Retry-After.
+    """
+
+    def __init__(self, api_key, requests_per_hour=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 retries=DEFAULT_RETRIES, timeout=30.0, metrics=NULL_METRICS):
+        requests_per_hour = requests_per_hour or int(os.getenv("USDA_REQUESTS_PER_HOUR", DEFAULT_REQUESTS_PER_HOUR))
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.metrics = metrics
+        # A burst no larger than the concurrency keeps every rolling hour near the quota
+        self.bucket = TokenBucket(requests_per_hour / 3600, max_in_flight)
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.http = httpx.AsyncClient(
+            base_url=API_URL,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.http.aclose()
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def get(self, path, params):
+        params = {**params, "api_key": self.api_key}
+        for attempt in range(self.retries + 1):
+            response = None
+            async with self.semaphore:
+                await self.bucket.acquire()
+                try:
+                    response = await self.http.get(path, params=params)
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        raise
+                self.metrics.count("api_requests")
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response.json()
+            if response is not None and attempt == self.retries:
+                response.raise_for_status()
+            self.metrics.count("api_retries")
+            await asyncio.sleep(self._backoff(attempt, response))
+
+    async def get_foods(self, fdc_ids, format="abridged"):
+        """Raw food records for up to 200 fdcIds; ids USDA does not have are left out."""
+        with self.metrics.timer("api_call", ids=len(fdc_ids)):
+            return await self.get("/foods", {"fdcIds": ",".join(map(str, fdc_ids)), "format": format})
+
+    async def max_fdc_id(self, data_type):
+        data = await self.get("/foods/search", {
+            "query": "",  # An empty query to retrieve results without filtering by keywords
+            "dataType": [data_type],
+            "pageSize": 1,
+            "sortBy": "fdcId",
+            "sortOrder": "desc",
+        })
+        if data and data.get("foods"):
+            return data["foods"][0]["fdcId"]
+        return None
+
+    async def max_fdc_ids(self, data_types=DATA_TYPES):
+        max_ids = await asyncio.gather(*(self.max_fdc_id(data_type) for data_type in data_types))
+        return dict(zip(data_types, max_ids))
+
+
+async def iter_in_order(fetch, id_batches, window):
+    """
+    Yields (ids, fetch(ids)) for each batch in order while keeping up to `window`
+    fetches running ahead, so the caller's per-batch work overlaps the next requests.
+    """
+    pending = []
+    id_batches = iter(id_batches)
+    for ids in id_batches:
+        pending.append((ids, asyncio.ensure_future(fetch(ids))))
+        if len(pending) >= window:
+            break
+    try:
+        while pending:
+            ids, task = pending.pop(0)
+            result = await task
+            next_ids = next(id_batches, None)
+            if next_ids is not None:
+                pending.append((next_ids, asyncio.ensure_future(fetch(next_ids))))
+            yield ids, result
+    finally:
+        for _, task in pending:
+            task.cancel()
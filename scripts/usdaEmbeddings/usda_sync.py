@@ -0,0 +1,107 @@
+# usda_sync.py
+
+# Page-at-a-time helpers for the incremental USDA sync (updateUsdaData.py and
+# updateUsdaData_search.py): one set-based existence check and one COPY-backed insert
+# per API page instead of a query and an INSERT per item.
+
+SYNC_STAGING_TABLE = "usda_sync_staging"
+
+
+def dedupe_key_sql(alias):
+    """
+    The unique dedupe-key index's expression over `alias`'s name, brand and owner
+    columns. Must stay identical to the indexed expression (migration 20261018140100)
+    for the planner to use the index or for ON CONFLICT to infer it.
+    """
+    return (f"""LOWER({alias}."foodName") || E'\\x1f' || LOWER(COALESCE({alias}."foodBrand", ''))"""
+            f""" || E'\\x1f' || LOWER(COALESCE({alias}."brandOwner", ''))""")
+
+# Existing rows with the same dedupe key; $1-$3 are parallel arrays and the result is
+# the 1-based positions that already exist. One unique-index probe per position.
+EXISTING_SQL = f"""
+    SELECT q.ord
+    FROM unnest($1::text[], $2::text[], $3::text[]) WITH ORDINALITY AS q("foodName", "foodBrand", "brandOwner", ord)
+    WHERE EXISTS (SELECT 1 FROM "UsdaFoodItemEmbedding" t WHERE {dedupe_key_sql("t")} = {dedupe_key_sql("q")})
+"""
+
+
+def row_key(row):
+    return (row["foodName"].lower(),
+            (row["foodBrand"] or '').lower(),
+            (row["brandOwner"] or '').lower())
+
+def dedupe_rows(rows, seen):
+    """
+    Keeps the highest fdcId for each dedupe key (name, brand and owner, lowered, with
+    None and '' alike) and drops keys already in `seen` (keys handed out by earlier
+    pages of this run, which may still be on their way to the database). Adds the kept
+    keys to `seen`.
+    """
+    kept = []
+    for row in sorted(rows, key=lambda row: row["fdcId"], reverse=True):
+        key = row_key(row)
+        if key not in seen:
+            seen.add(key)
+            kept.append(row)
+    return kept
+
+async def find_existing(conn, rows):
+    """
+    Positions in `rows` whose dedupe key is already in the table, in one query that
+    probes the unique dedupe-key index rather than scanning for lowered matches.
+    """
+    if not rows:
+        return set()
+    result = await conn.fetch(EXISTING_SQL, [row["foodName"] for row in rows], [row["foodBrand"] for row in rows],
+                              [row["brandOwner"] for row in rows])
+    return {record["ord"] - 1 for record in result}
+
+async def cleanup_duplicates(conn):
+    """
+    Deletes all but one row per dedupe key: the highest fdcId, then the lowest id, the
+    same ranking migration 20261018140000 used. The unique index keeps new duplicates
+    out, so this only matters after the index was dropped (e.g. for a restore).
+    """
+    await conn.execute(f"""
+        DELETE FROM "UsdaFoodItemEmbedding" u
+        USING (
+            SELECT t.id, ROW_NUMBER() OVER (PARTITION BY {dedupe_key_sql("t")} ORDER BY t."fdcId" DESC, t.id ASC) AS rank
+            FROM "UsdaFoodItemEmbedding" t
+        ) d
+        WHERE u.id = d.id AND d.rank > 1
+    """)
+
+async def ensure_sync_staging_table(conn, column):
+    # Session-local; call once per connection after pgvector_codec.register_vector_codec
+    await conn.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {SYNC_STAGING_TABLE} (
+            "fdcId" integer NOT NULL,
+            "foodName" text NOT NULL,
+            "foodBrand" text,
+            "brandOwner" text,
+            "{column}" vector
+        ) ON COMMIT DELETE ROWS
+    """)
+
+async def insert_rows(conn, column, rows, embeddings):
+    """
+    Inserts a page of new rows with their embeddings: one COPY into the staging table
+    and one INSERT ... SELECT ... ON CONFLICT DO NOTHING, which skips rows whose fdcId
+    or dedupe key is already taken (including by another sync racing this one).
+    Returns the (row, embedding) pairs that were actually inserted.
+    """
+    if not rows:
+        return []
+    records = [(row["fdcId"], row["foodName"], row["foodBrand"], row["brandOwner"], embedding)
+               for row, embedding in zip(rows, embeddings)]
+    async with conn.transaction():
+        await conn.copy_records_to_table(SYNC_STAGING_TABLE, records=records,
+                                         columns=["fdcId", "foodName", "foodBrand", "brandOwner", column])
+        inserted = await conn.fetch(f"""
+            INSERT INTO "UsdaFoodItemEmbedding" ("fdcId", "foodName", "foodBrand", "brandOwner", "{column}")
+            SELECT "fdcId", "foodName", "foodBrand", "brandOwner", "{column}" FROM {SYNC_STAGING_TABLE}
+            ON CONFLICT DO NOTHING
+            RETURNING "fdcId"
+        """)
+    inserted_ids = {record["fdcId"] for record in inserted}
+    return [(row, embedding) for row, embedding in zip(rows, embeddings) if row["fdcId"] in inserted_ids]
@@ -0,0 +1,4 @@
+-- Lets the embedding backfill page through rows that still need an embedding
+-- (WHERE id > $1 AND "bgeBaseEmbedding" IS NULL ORDER BY id) without walking
+-- the rows that are already done.
+CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_missing_bgeBaseEmbedding_idx" ON public."UsdaFoodItemEmbedding" USING btree (id) WHERE ("bgeBaseEmbedding" IS NULL);
@@ -0,0 +1,4 @@
+-- Lets the multi-column embedding backfill page through rows missing either
+-- embedding (WHERE id > $1 AND ("bgeBaseEmbedding" IS NULL OR "bgeLargeEmbedding" IS NULL)
+-- ORDER BY id) the same way the single-column partial index does for bgeBase.
+CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_missing_bge_embeddings_idx" ON public."UsdaFoodItemEmbedding" USING btree (id) WHERE (("bgeBaseEmbedding" IS NULL) OR ("bgeLargeEmbedding" IS NULL));
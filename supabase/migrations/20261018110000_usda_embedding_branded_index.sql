@@ -0,0 +1,11 @@
+-- Partial HNSW indexes so searches restricted to branded or generic foods walk a
+-- graph of matching rows only, instead of walking the full graph and filtering
+-- afterwards (which returns fewer rows than asked for when the filter is selective).
+-- The predicates must stay identical to KIND_CONDITIONS in
+-- scripts/usdaEmbeddings/filtered_search.py for the planner to pick these indexes.
+-- This one is the branded index; 20261018110100 adds the generic one.
+--
+-- Built CONCURRENTLY so the table stays writable during the build; that cannot run
+-- inside a transaction block, so this file holds this one statement only. A failed
+-- build leaves an INVALID index: drop it and re-run.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_branded_idx" ON public."UsdaFoodItemEmbedding" USING hnsw ("bgeBaseEmbedding" vector_ip_ops) WITH (m='16', ef_construction='128') WHERE (COALESCE("foodBrand", ''::text) <> ''::text);
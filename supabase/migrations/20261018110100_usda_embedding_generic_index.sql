@@ -0,0 +1,3 @@
+-- Generic-food counterpart of 20261018110000_usda_embedding_branded_index.sql, built
+-- CONCURRENTLY in a file of its own for the same reason.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_generic_idx" ON public."UsdaFoodItemEmbedding" USING hnsw ("bgeBaseEmbedding" vector_ip_ops) WITH (m='16', ef_construction='128') WHERE (COALESCE("foodBrand", ''::text) = ''::text);
@@ -0,0 +1,32 @@
+-- search_usda_database looked the query vector up in a subquery repeated in the select
+-- list and the ORDER BY; read it once into a variable instead. The filter stays
+-- "foodBrand" IS NOT NULL, as before: rows loaded with an empty brand string still come
+-- back (getBestFoodEmbeddingMatches.ts relies on the current results). That is not the
+-- branded index's predicate, so this function keeps using the full HNSW index.
+CREATE OR REPLACE FUNCTION public.search_usda_database(embedding_id integer, limit_amount integer DEFAULT 5)
+ RETURNS TABLE("fdcId" integer, "foodName" text, "foodBrand" text, "brandOwner" text, "cosineSimilarity" double precision)
+ LANGUAGE plpgsql
+AS $function$
+DECLARE
+    query_embedding vector;
+BEGIN
+    SELECT "bgeBaseEmbedding" INTO query_embedding FROM "foodEmbeddingCache" WHERE id = embedding_id;
+
+    RETURN QUERY
+    SELECT
+        u."fdcId",
+        u."foodName",
+        u."foodBrand",
+        u."brandOwner",
+        1 - (u."bgeBaseEmbedding" <=> query_embedding) AS "cosineSimilarity"
+    FROM
+        "UsdaFoodItemEmbedding" u
+    WHERE
+        u."foodBrand" IS NOT NULL
+        AND u."bgeBaseEmbedding" IS NOT NULL
+    ORDER BY
+        (u."bgeBaseEmbedding" <#> query_embedding) ASC
+    LIMIT limit_amount;
+END;
+$function$
+;
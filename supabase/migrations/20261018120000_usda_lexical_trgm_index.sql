@@ -0,0 +1,7 @@
+create extension if not exists "pg_trgm" with schema "public";
+
+-- Trigram index over name, brand and owner for the hybrid search path
+-- (scripts/usdaEmbeddings/hybrid_search.py): lexical matches give a candidate set the
+-- query vector is scored against directly, without walking the HNSW graph. The
+-- expression must stay identical to LEXICAL_TEXT there.
+CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_lexical_trgm_idx" ON public."UsdaFoodItemEmbedding" USING gin ((("foodName" || ' ' || COALESCE("foodBrand", '') || ' ' || COALESCE("brandOwner", ''))) gin_trgm_ops);
@@ -0,0 +1,11 @@
+-- halfvec and binary_quantize need pgvector 0.7 or later
+ALTER EXTENSION "vector" UPDATE;
+
+-- Compact first-pass indexes for searches that rescore their candidates with the
+-- float32 "bgeBaseEmbedding" column (scripts/usdaEmbeddings/quantized_search.py).
+-- They are expression indexes, so nothing changes in how rows are written and the
+-- compact copies only take space in the index. Keep these definitions identical to
+-- QUANTIZATIONS there.
+CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_halfvec_idx" ON public."UsdaFoodItemEmbedding" USING hnsw ((("bgeBaseEmbedding")::halfvec(768)) halfvec_ip_ops) WITH (m='16', ef_construction='128');
+
+CREATE INDEX IF NOT EXISTS "UsdaFoodItemEmbedding_bgeBaseEmbedding_binary_idx" ON public."UsdaFoodItemEmbedding" USING hnsw (((binary_quantize("bgeBaseEmbedding"))::bit(768)) bit_hamming_ops) WITH (m='16', ef_construction='128');
@@ -0,0 +1,55 @@
+-- Case-insensitive identity of a USDA food: name, brand and owner, lowered, with NULL
+-- and '' treated alike, joined by a unit separator. 20261018140100 puts a unique index
+-- on it; this migration removes the rows that would violate it, keeping the highest
+-- fdcId per key (lowest id on a tie), the same ranking as usda_sync.cleanup_duplicates.
+--
+-- The key folds case and NULL/'' where the old cleanup_duplicates compared exactly, so
+-- more rows go than that job ever removed. Every removed row is copied, without its
+-- embeddings, into "UsdaFoodItemEmbeddingDedupeRemoved" along with the fdcId kept in
+-- its place and whether the old exact comparison would also have removed it, and the
+-- counts are raised as a NOTICE. To preview on a copy of production:
+--   SELECT count(*) FILTER (WHERE rank > 1) FROM (<the ranked query below>) d;
+
+CREATE TABLE IF NOT EXISTS public."UsdaFoodItemEmbeddingDedupeRemoved" (
+    "id" integer PRIMARY KEY,
+    "fdcId" integer NOT NULL,
+    "foodName" text NOT NULL,
+    "foodBrand" text,
+    "brandOwner" text,
+    "keptFdcId" integer NOT NULL,
+    "exactDuplicate" boolean NOT NULL,
+    "removedAt" timestamptz NOT NULL DEFAULT now()
+);
+
+DO $$
+DECLARE
+    removed bigint;
+    exact bigint;
+BEGIN
+    INSERT INTO public."UsdaFoodItemEmbeddingDedupeRemoved"
+        ("id", "fdcId", "foodName", "foodBrand", "brandOwner", "keptFdcId", "exactDuplicate")
+    SELECT d.id, d."fdcId", d."foodName", d."foodBrand", d."brandOwner", k."fdcId",
+           (d."foodName", d."foodBrand", d."brandOwner") IS NOT DISTINCT FROM (k."foodName", k."foodBrand", k."brandOwner")
+    FROM (
+        SELECT id, "fdcId", "foodName", "foodBrand", "brandOwner",
+               FIRST_VALUE(id) OVER w AS kept_id,
+               ROW_NUMBER() OVER w AS rank
+        FROM public."UsdaFoodItemEmbedding"
+        WINDOW w AS (
+            PARTITION BY (LOWER("foodName") || E'\x1f' || LOWER(COALESCE("foodBrand", '')) || E'\x1f' || LOWER(COALESCE("brandOwner", '')))
+            ORDER BY "fdcId" DESC, id ASC
+        )
+    ) d
+    JOIN public."UsdaFoodItemEmbedding" k ON k.id = d.kept_id
+    WHERE d.rank > 1;
+
+    DELETE FROM public."UsdaFoodItemEmbedding" u
+    USING public."UsdaFoodItemEmbeddingDedupeRemoved" r
+    WHERE u.id = r.id;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+
+    SELECT count(*) FILTER (WHERE "exactDuplicate") INTO exact FROM public."UsdaFoodItemEmbeddingDedupeRemoved";
+    RAISE NOTICE 'usda dedupe key: removed % rows (% exact duplicates, % only by case or NULL/empty folding); see "UsdaFoodItemEmbeddingDedupeRemoved"',
+        removed, exact, removed - exact;
+END
+$$;
@@ -0,0 +1,11 @@
+-- Unique index on the dedupe key (see 20261018140000). It turns the sync's existence
+-- check and every duplicate check into an index lookup, and lets inserts skip
+-- duplicates with ON CONFLICT. An expression index rather than a generated column, so
+-- the table and its HNSW indexes are not rewritten; queries must repeat the expression
+-- exactly (scripts/usdaEmbeddings/usda_sync.py builds it with dedupe_key_sql).
+--
+-- Built CONCURRENTLY so writes continue during the build; that cannot run inside a
+-- transaction block, so this file holds this one statement only. If a duplicate slips
+-- in between the two migrations the build fails and leaves an INVALID index: run
+-- cleanup_duplicates, DROP INDEX "UsdaFoodItemEmbedding_dedupe_key" and re-run.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "UsdaFoodItemEmbedding_dedupe_key" ON public."UsdaFoodItemEmbedding" USING btree ((LOWER("foodName") || E'\x1f' || LOWER(COALESCE("foodBrand", '')) || E'\x1f' || LOWER(COALESCE("brandOwner", ''))));